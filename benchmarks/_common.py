@@ -0,0 +1,38 @@
+"""
+Helpers shared by the benchmarks that run server.py in a subprocess. The
+server/ package shadows server.py, so it cannot be imported and started
+in-process.
+"""
+import os
+import socket
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port(kind: int = socket.SOCK_STREAM) -> int:
+    with socket.socket(socket.AF_INET, kind) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port: int, stream_port: int = 0, udp_port: int = 0, extra: list[str] = ()) -> subprocess.Popen:
+    """server.py on port, once it accepts connections. A stream or UDP port of 0 turns that channel off."""
+    proc = subprocess.Popen(
+        [sys.executable, "server.py", "--port", str(port), "--stream-port", str(stream_port),
+         "--udp-port", str(udp_port), "--quiet", *extra],
+        cwd=ROOT,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 5.0
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError("server did not start")
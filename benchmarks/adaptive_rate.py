@@ -0,0 +1,174 @@
+"""
+Round trips of OnlineManager as the game and the server change
+
+Starts server.py and runs an OnlineManager standing on map.tmx through a
+series of phases, each --phase seconds long:
+
+    alone         remote players walk on another map
+    far, moving   remote players walk on our map, far off screen
+    near, still   remote players stand next to us
+    near, moving  remote players walk around next to us
+    paused        as near, moving, with an overlay open
+    server busy   as near, moving, against a server started with
+                  --busy-requests 0 so every reply and pong says it is overloaded
+
+Reports how often the client polled (GET /players and POST /sync, counted
+by the server) or got a push on the stream, the interval it settled on and
+the RTT it measured. Before the rate adapted polling was a fixed 10 Hz and
+the stream pushed on every tick that changed something. Exits non-zero
+if the rates do not go the way they should: fastest near moving players,
+slower far away, alone, paused and against a busy server.
+
+Usage:
+    python benchmarks/adaptive_rate.py --phase 4 --mode poll
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.core.managers.online_manager import OnlineManager
+from src.utils import GameSettings
+
+from _common import free_port, start_server
+
+MAP = "map.tmx"
+FPS = 60
+# Where our player stands
+HOME = (500.0, 500.0)
+PHASES = ("alone", "far, moving", "near, still", "near, moving", "paused", "server busy")
+
+
+def polls(base: str) -> int:
+    """GET /players and POST /sync the server answered, everything our client sends"""
+    total = 0
+    for line in requests.get(f"{base}/metrics", timeout=5).text.splitlines():
+        if line.startswith("http_requests_total{") and (
+            'route="/sync",method="POST"' in line or 'route="/players",method="GET"' in line
+        ):
+            total += int(float(line.rsplit(" ", 1)[1]))
+    return total
+
+
+class Walkers:
+    """Remote players posting straight to the server at 20 Hz, placed by the current phase"""
+
+    def __init__(self, base: str, players: int):
+        self.base = base
+        self.session = requests.Session()
+        self.pids = [self.session.get(f"{base}/register", timeout=5).json()["id"] for _ in range(players)]
+        self.phase = "alone"
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self._walk, name="Walkers", daemon=True)
+        self.thread.start()
+
+    def _walk(self) -> None:
+        rng = random.Random(1)
+        try:
+            while not self.stop.wait(0.05):
+                for pid in self.pids:
+                    map_name, x, y, moving = MAP, HOME[0] + 200, HOME[1], False
+                    if self.phase == "alone":
+                        map_name, x, y, moving = "gym.tmx", rng.uniform(0, 1000), rng.uniform(0, 1000), True
+                    elif self.phase == "far, moving":
+                        x, y, moving = rng.uniform(4000, 5000), rng.uniform(4000, 5000), True
+                    elif self.phase != "near, still":
+                        x, y, moving = HOME[0] + rng.uniform(-300, 300), HOME[1] + rng.uniform(-300, 300), True
+                    self.session.post(f"{self.base}/players", json={
+                        "id": pid, "x": x, "y": y, "map": map_name, "direction": "left", "moving": moving,
+                    }, timeout=5)
+        except requests.RequestException:
+            # The server is gone at the end of the run
+            pass
+
+    def close(self) -> None:
+        self.stop.set()
+        self.thread.join(timeout=5.0)
+
+
+def run_phase(manager: OnlineManager, seconds: float) -> None:
+    """The game loop, reporting a player standing at HOME"""
+    next_frame = time.perf_counter()
+    for _ in range(int(seconds * FPS)):
+        manager.update(HOME[0], HOME[1], MAP, "down", False)
+        manager.get_list_players()
+        next_frame += 1 / FPS
+        time.sleep(max(0.0, next_frame - time.perf_counter()))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="OnlineManager poll rate as the game and server change")
+    parser.add_argument("--phase", type=float, default=4.0, help="seconds per phase")
+    parser.add_argument("--mode", choices=("poll", "stream"), default="poll")
+    parser.add_argument("--players", type=int, default=3, help="remote players")
+    args = parser.parse_args()
+
+    GameSettings.ONLINE_USE_STREAM = args.mode == "stream"
+    GameSettings.ONLINE_USE_UDP = False
+    print(f"{args.mode}, {args.players} remote players, {args.phase:g} s per phase, "
+          f"bounds {GameSettings.ONLINE_MIN_POLL_INTERVAL:g}-{GameSettings.ONLINE_MAX_POLL_INTERVAL:g} s")
+    print(f"{'':14}{'per second':>12}{'interval s':>12}{'rtt ms':>9}")
+    rates = {}
+    procs = []
+    manager = None
+    try:
+        for phase in PHASES:
+            if phase in ("alone", "server busy"):
+                # The busy phase gets its own server that always reports overload
+                if manager is not None:
+                    manager.exit()
+                    walkers.close()
+                port, stream_port = free_port(), free_port()
+                procs.append(start_server(port, stream_port, extra=["--busy-requests", "0"] if phase == "server busy" else []))
+                base = f"http://127.0.0.1:{port}"
+                GameSettings.ONLINE_SERVER_URL = base
+                GameSettings.ONLINE_STREAM_PORT = stream_port
+                walkers = Walkers(base, args.players)
+                manager = OnlineManager()
+                manager.enter()
+                if not manager.wait_registered(5.0):
+                    raise RuntimeError("could not register")
+                pushes = [0]
+                apply_delta = manager._apply_delta
+
+                def counting(data: dict, apply_delta=apply_delta, pushes=pushes) -> None:
+                    pushes[0] += 1
+                    apply_delta(data)
+
+                manager._apply_delta = counting
+            walkers.phase = phase
+            manager.set_paused(phase == "paused")
+            # Let it settle into the phase before counting
+            run_phase(manager, 1.0)
+            before = polls(base) if args.mode == "poll" else pushes[0]
+            run_phase(manager, args.phase)
+            after = polls(base) if args.mode == "poll" else pushes[0]
+            rates[phase] = (after - before) / args.phase
+            rtt = f"{manager.rtt * 1000:.1f}" if manager.rtt is not None else "-"
+            print(f"{phase:14}{rates[phase]:>12.1f}{manager.poll_interval:>12.2f}{rtt:>9}")
+    finally:
+        if manager is not None:
+            manager.exit()
+            walkers.close()
+        for proc in procs:
+            proc.kill()
+
+    fastest = rates["near, moving"]
+    ok = all(rates[phase] < fastest for phase in ("far, moving", "near, still", "paused"))
+    ok &= rates["server busy"] < fastest
+    if args.mode == "poll":
+        # Nothing changes on a map without others, the stream pushes nothing either way
+        ok &= rates["alone"] < fastest
+    print("OK" if ok else "FAILED, rates not ordered as expected")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""
+Rects left after merging collision tiles, and a check that they cover them
+
+For map.tmx and gym.tmx compares one rect per collision tile, what Map
+used to keep and draw, with Map.merged_collision_rects(), and times
+drawing each set the way DRAW_HITBOXES does. Then merges --random grids
+of random sizes and densities the same way.
+
+Every merged set is checked to cover exactly the blocked tiles, each
+exactly once: rects on the tile grid, inside the map, not overlapping,
+and adding up to the same tiles. Exits non-zero if one does not.
+
+Usage:
+    python benchmarks/collision_merge.py --random 200
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pygame as pg
+
+from src.maps import CollisionGrid, Map
+from src.utils import GameSettings, Position, PositionCamera
+
+TILE = GameSettings.TILE_SIZE
+
+
+def covers_exactly(grid: CollisionGrid, rects: list[pg.Rect]) -> bool:
+    covered = bytearray(grid.width * grid.height)
+    for rect in rects:
+        if rect.x % TILE or rect.y % TILE or rect.w % TILE or rect.h % TILE or rect.w <= 0 or rect.h <= 0:
+            return False
+        x0, y0, x1, y1 = rect.left // TILE, rect.top // TILE, rect.right // TILE, rect.bottom // TILE
+        if x0 < 0 or y0 < 0 or x1 > grid.width or y1 > grid.height:
+            return False
+        for y in range(y0, y1):
+            for x in range(x0, x1):
+                if covered[y * grid.width + x]:
+                    # Overlaps another rect
+                    return False
+                covered[y * grid.width + x] = 1
+    return covered == grid.cells
+
+
+def draw_ms(screen: pg.Surface, rects: list[pg.Rect], repeat: int = 50) -> float:
+    camera = PositionCamera(0, 0)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for rect in rects:
+            pg.draw.rect(screen, (255, 0, 0), camera.transform_rect(rect), 1)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Merged collision rects against one per tile")
+    parser.add_argument("--random", type=int, default=200, help="random grids to check")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    ok = True
+
+    pg.init()
+    screen = pg.display.set_mode((GameSettings.SCREEN_WIDTH, GameSettings.SCREEN_HEIGHT))
+    print(f"{'':10}{'tiles':>7}{'merged':>8}{'fewer':>8}{'merge ms':>10}{'draw ms tiles':>15}{'merged':>8}  exact")
+    for name in ("map.tmx", "gym.tmx"):
+        game_map = Map(name, [], Position(0, 0))
+        start = time.perf_counter()
+        merged = game_map.merged_collision_rects()
+        merge_ms = (time.perf_counter() - start) * 1000
+        grid = game_map._collision_grid
+        tiles = [
+            pg.Rect(x * TILE, y * TILE, TILE, TILE)
+            for y in range(grid.height) for x in range(grid.width) if grid.is_blocked(x, y)
+        ]
+        exact = covers_exactly(grid, merged)
+        ok &= exact
+        print(f"{name:10}{len(tiles):>7}{len(merged):>8}{len(tiles) / len(merged):>7.1f}x{merge_ms:>10.2f}"
+              f"{draw_ms(screen, tiles):>15.2f}{draw_ms(screen, merged):>8.2f}  {exact}")
+
+    rng = random.Random(args.seed)
+    failed = 0
+    for _ in range(args.random):
+        grid = CollisionGrid(rng.randint(1, 60), rng.randint(1, 60), TILE)
+        density = rng.random()
+        for y in range(grid.height):
+            for x in range(grid.width):
+                if rng.random() < density:
+                    grid.block(x, y)
+        failed += not covers_exactly(grid, grid.merged_rects())
+    ok &= failed == 0
+    print(f"{args.random} random grids, {failed} not covered exactly")
+    print("OK" if ok else "FAILED")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
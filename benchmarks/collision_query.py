@@ -0,0 +1,133 @@
+"""
+Cost of a collision query against map size, tile grid against a rect scan
+
+Checks CollisionGrid against colliderect over one rect per blocked tile,
+made from the collision layers of the TMX file the way Map used to (what
+Map.check_collision did before) on map.tmx and gym.tmx, for rects of
+the player's size at random positions on and around the map, including
+touching edges and outside it.
+
+Then builds square maps of --sizes tiles with --blocked of them blocked
+and times a query of a player-sized rect both ways, one rect at a time and
+batched with collides_many(). Exits non-zero if the two ever disagree or
+a grid query on the biggest map costs more than 3x one on the smallest.
+
+Usage:
+    python benchmarks/collision_query.py --sizes 32,128,512,2048
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pygame as pg
+import pytmx
+
+from src.maps import CollisionGrid, Map
+from src.utils import GameSettings, Position
+
+TILE = GameSettings.TILE_SIZE
+
+
+def tile_rects(game_map: Map) -> list[pg.Rect]:
+    """One rect per tile of the collision layers, the list Map used to keep"""
+    rects = []
+    for layer in game_map.tmxdata.visible_layers:
+        if isinstance(layer, pytmx.TiledTileLayer) and (
+            "collision" in layer.name.lower() or "house" in layer.name.lower()
+        ):
+            rects += [pg.Rect(x * TILE, y * TILE, TILE, TILE) for x, y, gid in layer if gid != 0]
+    return rects
+
+
+def random_rects(rng: random.Random, width: int, height: int, n: int) -> list[pg.Rect]:
+    """Player-sized rects, some on the grid exactly and some up to a tile off the map"""
+    rects = []
+    for _ in range(n):
+        x = rng.randint(-TILE, width * TILE)
+        y = rng.randint(-TILE, height * TILE)
+        if rng.random() < 0.3:
+            x, y = x // TILE * TILE, y // TILE * TILE
+        rects.append(pg.Rect(x, y, TILE, TILE))
+    return rects
+
+
+def scan(rect: pg.Rect, rects: list[pg.Rect]) -> bool:
+    for collision_rect in rects:
+        if rect.colliderect(collision_rect):
+            return True
+    return False
+
+
+def timed(fn, repeat: int) -> float:
+    """Seconds per call of fn(), best of three"""
+    best = float("inf")
+    for _ in range(3):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+        best = min(best, (time.perf_counter() - start) / repeat)
+    return best
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Collision queries, tile grid against rect scan")
+    parser.add_argument("--sizes", default="32,128,512,2048", help="map widths/heights in tiles")
+    parser.add_argument("--blocked", type=float, default=0.1, help="share of tiles blocked")
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    ok = True
+
+    pg.init()
+    pg.display.set_mode((1, 1))
+    for name in ("map.tmx", "gym.tmx"):
+        game_map = Map(name, [], Position(0, 0))
+        rects = random_rects(rng, game_map.tmxdata.width, game_map.tmxdata.height, args.queries)
+        tiles = tile_rects(game_map)
+        expected = [scan(rect, tiles) for rect in rects]
+        got = [game_map.check_collision(rect) for rect in rects]
+        batched = game_map.check_collisions(rects)
+        same = expected == got == batched
+        ok &= same
+        print(f"{name}: {len(tiles)} blocked tiles, {len(rects)} queries, "
+              f"{sum(expected)} colliding, grid matches rect scan: {same}")
+
+    sizes = [int(s) for s in args.sizes.split(",")]
+    print(f"\n{args.blocked:.0%} of tiles blocked, player-sized rect, microseconds per query")
+    print(f"{'tiles':>12}{'blocked':>10}{'rect scan':>12}{'grid':>8}{'batched':>9}")
+    grid_cost = {}
+    for size in sizes:
+        grid = CollisionGrid(size, size, TILE)
+        rects = []
+        for y in range(size):
+            for x in range(size):
+                if rng.random() < args.blocked:
+                    grid.block(x, y)
+                    rects.append(pg.Rect(x * TILE, y * TILE, TILE, TILE))
+        queries = random_rects(rng, size, size, args.queries)
+        # The scan gets slow, it is timed and checked on fewer queries on big maps
+        sample = queries[:max(20, args.queries * 64 // size)]
+        same = [scan(rect, rects) for rect in sample] == grid.collides_many(sample)
+        ok &= same
+        it = iter(range(10 ** 9))
+        scan_cost = timed(lambda: scan(sample[next(it) % len(sample)], rects), len(sample))
+        grid_cost[size] = timed(lambda: grid.collides(queries[next(it) % len(queries)]), len(queries))
+        batched = timed(lambda: grid.collides_many(queries), 1) / len(queries)
+        print(f"{size:>6}x{size:<5}{len(rects):>10}{scan_cost * 1e6:>12.1f}{grid_cost[size] * 1e6:>8.2f}"
+              f"{batched * 1e6:>9.2f}{'' if same else '  MISMATCH'}")
+
+    flat = grid_cost[sizes[-1]] <= 3 * grid_cost[sizes[0]]
+    ok &= flat
+    print("OK" if ok else "FAILED")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
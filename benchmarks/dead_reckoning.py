@@ -0,0 +1,177 @@
+"""
+Packets sent and position error of the dead-reckoning send policy
+
+Records a player walking around a walled room with the movement rules of
+Player.update (8 directions, snap to the grid on a wall) at 60 fps: a
+scripted part with idling, straight lines, diagonals, walking into walls
+and tapping keys, then random input. The recording is replayed twice,
+sending every frame the state changed (what the client did before) and
+sending what DeadReckoning picks. Sent states reach a RemoteTrack after
+--latency plus up to --jitter seconds, which draws the player every frame
+as GameScene does.
+
+Reports the packets each way sends, split by what the player was doing,
+and the largest error of the drawn position against the recorded one.
+Exits non-zero if the sender ever let the position remote players
+extrapolate drift more than DEAD_RECKONING_ERROR (plus one frame of
+walking) from the real one.
+
+Usage:
+    python benchmarks/dead_reckoning.py --duration 120 --latency 0.03
+"""
+import argparse
+import math
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.core.managers.online_manager import (
+    DEAD_RECKONING_ERROR, HEARTBEAT_INTERVAL, INTERPOLATION_DELAY, DeadReckoning, RemoteTrack,
+)
+
+TILE = 64
+SPEED = 4.0 * TILE
+FPS = 60
+ROOM = (20 * TILE, 15 * TILE)
+KEYS = {"left": (-1, 0), "right": (1, 0), "up": (0, -1), "down": (0, 1)}
+# Keys held and for how long
+SCRIPT = [
+    ((), 3.0),
+    (("right",), 2.0),
+    (("right", "down"), 1.5),
+    (("down",), 4.0),
+    ((), 2.0),
+    (("left",), 0.2), ((), 0.3), (("left",), 0.2), ((), 0.3), (("left",), 0.2),
+    (("up", "left"), 6.0),
+    (("right",), 1.0), (("up",), 1.0), (("left",), 1.0), (("down",), 1.0),
+    ((), 5.0),
+]
+
+# t, x, y, direction, moving
+Frame = tuple[float, float, float, str, bool]
+
+
+def record(duration: float, seed: int) -> list[Frame]:
+    rng = random.Random(seed)
+    script = list(SCRIPT)
+    while sum(seconds for _, seconds in script) < duration:
+        keys = rng.choice([(), ("left",), ("right",), ("up",), ("down",), ("up", "right"), ("down", "left")])
+        script.append((keys, rng.uniform(0.1, 3.0)))
+
+    frames = []
+    t, x, y = 0.0, 5.0 * TILE, 5.0 * TILE
+    direction = "down"
+    for keys, seconds in script:
+        end = t + seconds
+        while t < end:
+            # Frame times wobble like a real game loop
+            dt = 1 / FPS + rng.uniform(-0.002, 0.002)
+            t += dt
+            dx = sum(KEYS[k][0] for k in keys)
+            dy = sum(KEYS[k][1] for k in keys)
+            norm = math.hypot(dx, dy)
+            moving = norm != 0
+            if moving:
+                dx, dy = dx / norm * SPEED * dt, dy / norm * SPEED * dt
+                if abs(dy) > abs(dx):
+                    direction = "up" if dy < 0 else "down"
+                else:
+                    direction = "left" if dx < 0 else "right"
+                # Walls snap the blocked axis to the grid, like Player.update
+                x = x + dx if 0 <= x + dx <= ROOM[0] - TILE else round(x / TILE) * TILE
+                y = y + dy if 0 <= y + dy <= ROOM[1] - TILE else round(y / TILE) * TILE
+            frames.append((t, x, y, direction, moving))
+    return frames
+
+
+def replay(frames: list[Frame], policy: str, latency: float, jitter: float, seed: int) -> dict:
+    rng = random.Random(seed)
+    reckoning = DeadReckoning()
+    # Arrival time, send time and state of everything sent
+    sent = []
+    drift = 0.0
+    last = None
+    for t, x, y, direction, moving in frames:
+        if policy == "every frame":
+            state = reckoning.observe(t, x, y, "map.tmx", direction, moving)
+            reckoning.reset()
+            if state == last:
+                state = None
+        else:
+            state = reckoning.observe(t, x, y, "map.tmx", direction, moving)
+        if state is not None:
+            last = state
+            # Delivered in order, like the stream, HTTP, and UDP dropping late datagrams
+            arrival = max(t + latency + rng.uniform(0, jitter), sent[-1][0] if sent else 0.0)
+            sent.append((arrival, t, state))
+        # Where remote players extrapolate us to right now
+        sent_at, (sx, sy, *_, vx, vy) = sent[-1][1], sent[-1][2]
+        drift = max(drift, math.hypot(sx + vx * (t - sent_at) - x, sy + vy * (t - sent_at) - y))
+
+    # Receiver side, drawn every frame at the recorded frame times
+    arrivals = sent
+    track = RemoteTrack()
+    errors = []
+    i = 0
+    positions = [(t, x, y) for t, x, y, _, _ in frames]
+    j = 0
+    for now, _, _, _, _ in frames:
+        while i < len(arrivals) and arrivals[i][0] <= now:
+            _, _, (sx, sy, _, _, _, vx, vy) = arrivals[i]
+            track.add(arrivals[i][0], sx, sy, vx, vy)
+            i += 1
+        if not track.samples:
+            continue
+        # Drawn INTERPOLATION_DELAY in the past, on top of the latency
+        target = now - INTERPOLATION_DELAY - latency
+        while j + 1 < len(positions) and positions[j + 1][0] <= target:
+            j += 1
+        if target < positions[0][0]:
+            continue
+        dx, dy = track.position(now - INTERPOLATION_DELAY)
+        errors.append(math.hypot(dx - positions[j][1], dy - positions[j][2]))
+
+    # Packets by what the player did in the frame they were sent
+    kinds = {"idle": 0, "walking": 0}
+    for _, _, (_, _, _, _, moving, _, _) in sent:
+        kinds["walking" if moving else "idle"] += 1
+    errors.sort()
+    return {
+        "packets": len(sent), **kinds, "drift": drift,
+        "p99": errors[int(len(errors) * 0.99)], "max": errors[-1],
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Dead reckoning against sending every frame")
+    parser.add_argument("--duration", type=float, default=120.0, help="seconds of recorded movement")
+    parser.add_argument("--latency", type=float, default=0.03)
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    frames = record(args.duration, args.seed)
+    seconds = frames[-1][0]
+    walking = sum(1 for f in frames if f[4]) / FPS
+    print(f"{seconds:.0f} s recorded at {FPS} fps, walking {walking:.0f} s, idle {seconds - walking:.0f} s; "
+          f"latency {args.latency * 1000:.0f} ms + up to {args.jitter * 1000:.0f} ms")
+    print(f"threshold {DEAD_RECKONING_ERROR:g} px, heartbeat {HEARTBEAT_INTERVAL:g} s")
+    print(f"{'':14}{'packets':>9}{'per s walking':>15}{'per s idle':>12}{'drift px':>10}{'p99 px':>9}{'max px':>9}")
+    results = {}
+    for policy in ("every frame", "dead reckoning"):
+        r = results[policy] = replay(frames, policy, args.latency, args.jitter, args.seed)
+        print(f"{policy:14}{r['packets']:>9}{r['walking'] / walking:>15.2f}{r['idle'] / (seconds - walking):>12.2f}"
+              f"{r['drift']:>10.1f}{r['p99']:>9.1f}{r['max']:>9.1f}")
+    print("(drift: how far the sender let what remote players extrapolate get from the real position; "
+          "p99/max: drawn position against the recorded one)")
+
+    bound = DEAD_RECKONING_ERROR + SPEED * (1 / FPS + 0.002)
+    ok = results["dead reckoning"]["drift"] <= bound
+    print("OK" if ok else f"FAILED, drift over {bound:.1f} px")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,168 @@
+"""
+Frame times of a game loop using OnlineManager against a slow server
+
+Starts server.py behind a proxy that holds every chunk the server sends
+for --delay seconds, a server that answers but slowly. A few remote players
+walk around on it so there are deltas to apply. Then runs a game loop at
+60 fps that does what GameScene does with the OnlineManager: enter() when
+the scene starts, update() and get_list_players() every frame, exit() and
+enter() again halfway through, like going into a battle and back. Every
+frame also burns --work ms of CPU, standing in for the game itself.
+
+Reports how long enter() and exit() took and the distribution of frame
+times. Run it on two checkouts to compare them.
+
+Usage:
+    python benchmarks/frame_jitter.py --delay 0.5 --duration 10 --mode stream
+"""
+import argparse
+import os
+import random
+import socket
+import statistics
+import sys
+import threading
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.core.managers.online_manager import OnlineManager
+from src.utils import GameSettings
+
+from _common import free_port, start_server
+
+MAP = "map.tmx"
+FPS = 60
+
+
+class SlowProxy:
+    """Forwards TCP connections to upstream, delaying everything coming back by delay seconds"""
+
+    def __init__(self, upstream: int, delay: float):
+        self.upstream = upstream
+        self.delay = delay
+        self.sock = socket.create_server(("127.0.0.1", 0))
+        self.port = self.sock.getsockname()[1]
+        threading.Thread(target=self._accept, name="SlowProxy", daemon=True).start()
+
+    def _accept(self) -> None:
+        while True:
+            try:
+                client, _ = self.sock.accept()
+                server = socket.create_connection(("127.0.0.1", self.upstream))
+            except OSError:
+                return
+            threading.Thread(target=self._pump, args=(client, server, 0.0), daemon=True).start()
+            threading.Thread(target=self._pump, args=(server, client, self.delay), daemon=True).start()
+
+    @staticmethod
+    def _pump(src: socket.socket, dst: socket.socket, delay: float) -> None:
+        try:
+            while data := src.recv(65536):
+                time.sleep(delay)
+                dst.sendall(data)
+        except OSError:
+            pass
+        finally:
+            for sock in (src, dst):
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+
+def walk_remote_players(base: str, players: int, stop: threading.Event) -> None:
+    """Move players around at 10 Hz, straight against the server"""
+    session = requests.Session()
+    rng = random.Random(1)
+    try:
+        pids = [session.get(f"{base}/register", timeout=5).json()["id"] for _ in range(players)]
+        while not stop.wait(0.1):
+            for pid in pids:
+                session.post(f"{base}/players", json={
+                    "id": pid, "x": rng.uniform(0, 2000), "y": rng.uniform(0, 2000), "map": MAP,
+                    "direction": "left", "moving": True,
+                }, timeout=5)
+    except requests.RequestException:
+        # The server is gone at the end of the run
+        pass
+
+
+def burn(seconds: float) -> None:
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Game loop frame times against a slow server")
+    parser.add_argument("--delay", type=float, default=0.5, help="seconds the proxy holds every reply")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--mode", choices=("stream", "poll"), default="stream")
+    parser.add_argument("--players", type=int, default=10, help="remote players walking around")
+    parser.add_argument("--work", type=float, default=4.0, help="ms of CPU per frame for the game itself")
+    args = parser.parse_args()
+
+    port, stream_port = free_port(), free_port()
+    proc = start_server(port, stream_port)
+    http_proxy = SlowProxy(port, args.delay)
+    stream_proxy = SlowProxy(stream_port, args.delay)
+    GameSettings.ONLINE_SERVER_URL = f"http://127.0.0.1:{http_proxy.port}"
+    GameSettings.ONLINE_STREAM_PORT = stream_proxy.port
+    GameSettings.ONLINE_USE_STREAM = args.mode == "stream"
+    GameSettings.ONLINE_USE_UDP = False
+
+    stop = threading.Event()
+    walkers = threading.Thread(
+        target=walk_remote_players, args=(f"http://127.0.0.1:{port}", args.players, stop), daemon=True,
+    )
+    walkers.start()
+    manager = OnlineManager()
+    frames = []
+    calls = {}
+    seen = 0
+    try:
+        start = time.perf_counter()
+        manager.enter()
+        calls["enter()"] = time.perf_counter() - start
+        switched = False
+        frame_count = int(args.duration * FPS)
+        next_frame = time.perf_counter()
+        for i in range(frame_count):
+            start = time.perf_counter()
+            if not switched and i >= frame_count // 2:
+                switched = True
+                manager.exit()
+                calls["exit()"] = time.perf_counter() - start
+                manager.enter()
+                calls["exit() + enter()"] = time.perf_counter() - start
+            manager.update(100.0 + i, 100.0, MAP, "right", True)
+            seen = max(seen, len(manager.get_list_players()))
+            burn(args.work / 1000)
+            frames.append(time.perf_counter() - start)
+            next_frame += 1 / FPS
+            time.sleep(max(0.0, next_frame - time.perf_counter()))
+    finally:
+        start = time.perf_counter()
+        manager.exit()
+        calls["final exit()"] = time.perf_counter() - start
+        stop.set()
+        proc.kill()
+
+    budget = 1 / FPS
+    ms = sorted(f * 1000 for f in frames)
+    print(f"{args.mode}, server replies delayed {args.delay * 1000:.0f} ms, {args.players} remote players, "
+          f"{args.work:g} ms of game work per frame, saw up to {seen} remote players")
+    for name, seconds in calls.items():
+        print(f"  {name:18} {seconds * 1000:8.1f} ms")
+    print(f"  frames             {len(ms)}, {sum(f > budget for f in frames)} over the {budget * 1000:.1f} ms budget")
+    print(f"  frame time ms      p50 {statistics.median(ms):.2f}  p99 {ms[int(len(ms) * 0.99)]:.2f}  "
+          f"max {ms[-1]:.2f}  stdev {statistics.pstdev(ms):.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+"""
+How smoothly remote players are drawn, raw positions against RemoteTrack
+
+Simulates a remote player walking in a straight line whose position is
+received at --rate Hz with random delay and loss, and draws it every frame
+at 60 fps. For each way of drawing it reports how uneven the per-frame
+movement is (0 for a perfectly smooth walk), how many frames it did not
+move at all, and the largest error against where the player really was
+INTERPOLATION_DELAY earlier. Exits non-zero if interpolation is not
+smoother than drawing the raw positions.
+
+Usage:
+    python benchmarks/interpolation.py --rate 10 --jitter 0.03 --loss 0.1
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.core.managers.online_manager import INTERPOLATION_DELAY, RemoteTrack
+
+FPS = 60
+# Walking speed in pixels per second
+SPEED = 200.0
+
+
+def arrivals(rate: float, jitter: float, loss: float, duration: float, seed: int) -> list[tuple[float, float]]:
+    """(receive time, x) of every update that made it, in receive order"""
+    rng = random.Random(seed)
+    received = []
+    for i in range(int(duration * rate)):
+        sent = i / rate
+        if rng.random() >= loss:
+            received.append((sent + rng.uniform(0, jitter), sent * SPEED))
+    received.sort()
+    return received
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Remote player smoothness, raw against interpolated")
+    parser.add_argument("--rate", type=float, default=10.0, help="updates per second")
+    parser.add_argument("--jitter", type=float, default=0.03, help="max extra delay of an update, seconds")
+    parser.add_argument("--loss", type=float, default=0.1)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    received = arrivals(args.rate, args.jitter, args.loss, args.duration, args.seed)
+    track = RemoteTrack()
+    raw = None
+    drawn = {"raw": [], "interpolated": []}
+    errors = {"raw": [], "interpolated": []}
+    i = 0
+    for frame in range(FPS, int((args.duration - 1) * FPS)):
+        now = frame / FPS
+        while i < len(received) and received[i][0] <= now:
+            track.add(received[i][0], received[i][1], 0.0, SPEED, 0.0)
+            raw = received[i][1]
+            i += 1
+        x, _ = track.position(now - INTERPOLATION_DELAY)
+        drawn["raw"].append(raw)
+        drawn["interpolated"].append(x)
+        errors["raw"].append(abs(raw - now * SPEED))
+        errors["interpolated"].append(abs(x - (now - INTERPOLATION_DELAY) * SPEED))
+
+    print(f"{args.rate:g} Hz updates, up to {args.jitter * 1000:.0f} ms jitter, {args.loss:.0%} lost, drawn at {FPS} fps")
+    print(f"{'':14}{'step stdev px':>15}{'frozen frames':>15}{'max error px':>14}")
+    stdev = {}
+    for label, xs in drawn.items():
+        steps = [b - a for a, b in zip(xs, xs[1:])]
+        stdev[label] = statistics.pstdev(steps)
+        frozen = sum(abs(s) < 1e-9 for s in steps) / len(steps)
+        print(f"{label:14}{stdev[label]:>15.2f}{frozen:>15.0%}{max(errors[label]):>14.1f}")
+    print(f"(errors against the true position, {INTERPOLATION_DELAY * 1000:.0f} ms earlier for interpolated)")
+    return 0 if stdev["interpolated"] < stdev["raw"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
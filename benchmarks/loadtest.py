@@ -0,0 +1,435 @@
+"""
+Load test for server.py with headless simulated players
+
+Every simulated player is an asyncio task that follows the OnlineManager
+protocol: it registers, then every poll interval either POSTs /sync with
+its new position or GETs /players?since= when it stood still. Players walk
+random paths over the walkable tiles of the real map.tmx and gym.tmx.
+
+Reports throughput, latency percentiles, error rate, and the server's CPU
+and RSS once per second, and writes everything to a JSON file that a later
+run can be compared against with --baseline.
+
+Usage:
+    python benchmarks/loadtest.py --spawn --clients 10,100,1000 --duration 20
+    python benchmarks/loadtest.py --spawn --server-args="--legacy" --protocol legacy
+    python benchmarks/loadtest.py --spawn --server-args="--workers 4"
+    python benchmarks/loadtest.py --url http://host:8989 --server-pid 1234
+    python benchmarks/loadtest.py --spawn --baseline loadtest_result.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shlex
+import time
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass, field
+from urllib.parse import urlsplit
+
+from _common import free_port, start_server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAPS_DIR = os.path.join(ROOT, "assets", "maps")
+MAPS = ["map.tmx", "gym.tmx"]
+TILE_SIZE = 64
+# Same as Player.speed, in tiles per second
+SPEED = 4.0
+
+
+# ----------------------------------------------------------------------
+# Maps
+# ----------------------------------------------------------------------
+@dataclass
+class WalkMap:
+    name: str
+    width: int
+    height: int
+    walkable: set[tuple[int, int]]
+    tiles: list[tuple[int, int]]
+
+
+def load_walk_map(name: str) -> WalkMap:
+    """Walkable tiles, using the same collision/house layer rule as Map"""
+    root = ET.parse(os.path.join(MAPS_DIR, name)).getroot()
+    width, height = int(root.get("width")), int(root.get("height"))
+    blocked: set[tuple[int, int]] = set()
+    for layer in root.iter("layer"):
+        layer_name = layer.get("name", "").lower()
+        if "collision" not in layer_name and "house" not in layer_name:
+            continue
+        data = layer.find("data")
+        cells = [int(v) for v in data.text.replace("\n", "").split(",") if v.strip()]
+        for i, gid in enumerate(cells):
+            if gid != 0:
+                blocked.add((i % width, i // width))
+    walkable = {(x, y) for x in range(width) for y in range(height)} - blocked
+    return WalkMap(name, width, height, walkable, sorted(walkable))
+
+
+class Walker:
+    """Walks tile by tile towards random targets, with idle pauses in between"""
+
+    def __init__(self, walk_map: WalkMap, rng: random.Random):
+        self.map = walk_map
+        self.rng = rng
+        self.tile = rng.choice(walk_map.tiles)
+        self.x = float(self.tile[0] * TILE_SIZE)
+        self.y = float(self.tile[1] * TILE_SIZE)
+        self.target = self.tile
+        self.idle = 0.0
+        self.direction = "down"
+
+    def step(self, dt: float) -> bool:
+        """Advance by dt, return True if the position changed"""
+        if self.idle > 0:
+            self.idle -= dt
+            return False
+        if self.tile == self.target:
+            if self.rng.random() < 0.3:
+                self.idle = self.rng.uniform(0.5, 3.0)
+            tx = min(max(self.tile[0] + self.rng.randint(-8, 8), 0), self.map.width - 1)
+            ty = min(max(self.tile[1] + self.rng.randint(-8, 8), 0), self.map.height - 1)
+            self.target = (tx, ty)
+            return False
+
+        dx = (self.target[0] > self.tile[0]) - (self.target[0] < self.tile[0])
+        dy = (self.target[1] > self.tile[1]) - (self.target[1] < self.tile[1])
+        nxt = (self.tile[0] + dx, self.tile[1]) if dx else (self.tile[0], self.tile[1] + dy)
+        if nxt not in self.map.walkable:
+            # Blocked, give up on this target
+            self.target = self.tile
+            return False
+        self.direction = {(1, 0): "right", (-1, 0): "left", (0, 1): "down", (0, -1): "up"}[
+            (nxt[0] - self.tile[0], nxt[1] - self.tile[1])
+        ]
+
+        goal_x, goal_y = nxt[0] * TILE_SIZE, nxt[1] * TILE_SIZE
+        move = SPEED * TILE_SIZE * dt
+        self.x += max(-move, min(move, goal_x - self.x))
+        self.y += max(-move, min(move, goal_y - self.y))
+        if self.x == goal_x and self.y == goal_y:
+            self.tile = nxt
+        return True
+
+
+# ----------------------------------------------------------------------
+# Minimal HTTP/1.1 keep-alive client
+# ----------------------------------------------------------------------
+class HttpClient:
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+
+    async def request(self, method: str, path: str, body: bytes = b"", content_type: str = "") -> tuple[int, bytes]:
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        head = f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Length: {len(body)}\r\n"
+        if content_type:
+            head += f"Content-Type: {content_type}\r\n"
+        try:
+            self._writer.write(head.encode("ascii") + b"\r\n" + body)
+            await self._writer.drain()
+
+            status_line = await self._reader.readline()
+            if not status_line:
+                raise ConnectionError("connection closed")
+            version, status = status_line.split(b" ", 2)[:2]
+            length = 0
+            close = version == b"HTTP/1.0"
+            while True:
+                line = await self._reader.readline()
+                if line in (b"\r\n", b""):
+                    break
+                name, _, value = line.partition(b":")
+                name = name.strip().lower()
+                if name == b"content-length":
+                    length = int(value)
+                elif name == b"connection":
+                    close = value.strip().lower() == b"close"
+            data = await self._reader.readexactly(length) if length else b""
+        except Exception:
+            await self.close()
+            raise
+        if close:
+            await self.close()
+        return int(status), data
+
+    async def close(self) -> None:
+        writer, self._writer, self._reader = self._writer, None, None
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+
+# ----------------------------------------------------------------------
+# Simulated players
+# ----------------------------------------------------------------------
+@dataclass
+class Stats:
+    latencies: list[float] = field(default_factory=list)
+    requests: int = 0
+    errors: int = 0
+    bytes_in: int = 0
+
+    def take(self) -> "Stats":
+        taken = Stats(self.latencies, self.requests, self.errors, self.bytes_in)
+        self.latencies, self.requests, self.errors, self.bytes_in = [], 0, 0, 0
+        return taken
+
+
+async def timed(stats: Stats, client: HttpClient, method: str, path: str, body: bytes = b"") -> tuple[int, bytes] | None:
+    start = time.perf_counter()
+    try:
+        status, data = await asyncio.wait_for(
+            client.request(method, path, body, "application/json" if body else ""), timeout=5
+        )
+    except (OSError, asyncio.TimeoutError, ConnectionError, ValueError, asyncio.IncompleteReadError):
+        stats.errors += 1
+        await client.close()
+        return None
+    stats.requests += 1
+    stats.latencies.append(time.perf_counter() - start)
+    stats.bytes_in += len(data)
+    if status >= 400:
+        stats.errors += 1
+    return status, data
+
+
+async def simulated_player(
+    host: str, port: int, protocol: str, poll: float, walk_maps: list[WalkMap],
+    stats: Stats, stop: asyncio.Event, rng: random.Random,
+) -> None:
+    client = HttpClient(host, port)
+    walker = Walker(rng.choice(walk_maps), rng)
+    await asyncio.sleep(rng.uniform(0, poll))
+
+    pid = None
+    while pid is None and not stop.is_set():
+        reply = await timed(stats, client, "GET", "/register")
+        if reply and reply[0] == 200:
+            pid = json.loads(reply[1])["id"]
+        else:
+            await asyncio.sleep(0.1)
+
+    version = -1
+    last = time.perf_counter()
+    while not stop.is_set():
+        now = time.perf_counter()
+        moved = walker.step(now - last)
+        last = now
+        state = json.dumps({
+            "id": pid, "x": walker.x, "y": walker.y, "map": walker.map.name,
+            "direction": walker.direction, "moving": moved,
+        }).encode("utf-8")
+
+        if protocol == "legacy":
+            # What the client did before /sync: POST every frame, then a full GET
+            await timed(stats, client, "POST", "/players", state)
+            await timed(stats, client, "GET", "/players")
+        else:
+            if moved or version == -1:
+                reply = await timed(stats, client, "POST", f"/sync?since={version}", state)
+            else:
+                reply = await timed(stats, client, "GET", f"/players?since={version}&map={walker.map.name}")
+            if reply and reply[0] == 200:
+                version = json.loads(reply[1]).get("version", version)
+
+        await asyncio.sleep(max(0.0, poll - (time.perf_counter() - now)))
+    await client.close()
+
+
+# ----------------------------------------------------------------------
+# Server process sampling (Linux /proc, skipped elsewhere)
+# ----------------------------------------------------------------------
+class ProcSampler:
+    def __init__(self, pid: int | None):
+        self.pid = pid
+        self._last_cpu: float | None = None
+        self._last_time = time.monotonic()
+        self._ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+    def sample(self) -> tuple[float | None, float | None]:
+        """CPU percent since the last sample and RSS in MB"""
+        if self.pid is None:
+            return None, None
+        try:
+            # server.py --workers forks, count its worker processes too
+            with open(f"/proc/{self.pid}/task/{self.pid}/children") as f:
+                pids = [self.pid, *map(int, f.read().split())]
+            cpu = rss = 0.0
+            for pid in pids:
+                with open(f"/proc/{pid}/stat") as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+                cpu += (int(fields[11]) + int(fields[12])) / self._ticks
+                with open(f"/proc/{pid}/status") as f:
+                    rss += next(int(line.split()[1]) for line in f if line.startswith("VmRSS:")) / 1024
+        except (OSError, StopIteration, IndexError, ValueError):
+            return None, None
+        now = time.monotonic()
+        percent = None
+        if self._last_cpu is not None:
+            percent = 100.0 * (cpu - self._last_cpu) / max(now - self._last_time, 1e-9)
+        self._last_cpu, self._last_time = cpu, now
+        return percent, rss
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def summarize(latencies: list[float], requests: int, errors: int, seconds: float) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "rps": requests / seconds,
+        "error_rate": errors / max(requests + errors, 1),
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p90_ms": percentile(latencies, 0.90) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": (latencies[-1] if latencies else 0.0) * 1000,
+    }
+
+
+async def run_load(
+    host: str, port: int, clients: int, duration: float, protocol: str, poll: float,
+    walk_maps: list[WalkMap], server_pid: int | None, seed: int,
+) -> dict:
+    stats = Stats()
+    stop = asyncio.Event()
+    rng = random.Random(seed)
+    tasks = [
+        asyncio.create_task(simulated_player(
+            host, port, protocol, poll, walk_maps, stats, stop, random.Random(rng.random())
+        ))
+        for _ in range(clients)
+    ]
+
+    sampler = ProcSampler(server_pid)
+    sampler.sample()
+    timeline = []
+    all_latencies: list[float] = []
+    total_requests = total_errors = 0
+    start = time.perf_counter()
+    for second in range(int(duration)):
+        await asyncio.sleep(max(0.0, start + second + 1 - time.perf_counter()))
+        window = stats.take()
+        cpu, rss = sampler.sample()
+        point = {"t": second + 1, **summarize(window.latencies, window.requests, window.errors, 1.0)}
+        point.update({"bytes_in": window.bytes_in, "server_cpu": cpu, "server_rss_mb": rss})
+        timeline.append(point)
+        all_latencies.extend(window.latencies)
+        total_requests += window.requests
+        total_errors += window.errors
+        print(
+            f"  [{clients:5d} clients] t={second + 1:3d}s {point['rps']:8.0f} req/s  "
+            f"p50 {point['p50_ms']:7.2f} ms  p99 {point['p99_ms']:8.2f} ms  errors {window.errors:4d}  "
+            f"cpu {cpu if cpu is not None else float('nan'):5.1f}%  "
+            f"rss {rss if rss is not None else float('nan'):6.1f} MB",
+            flush=True,
+        )
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    summary = summarize(all_latencies, total_requests, total_errors, elapsed)
+    cpus = [p["server_cpu"] for p in timeline if p["server_cpu"] is not None]
+    rsss = [p["server_rss_mb"] for p in timeline if p["server_rss_mb"] is not None]
+    summary["server_cpu_avg"] = sum(cpus) / len(cpus) if cpus else None
+    summary["server_rss_max_mb"] = max(rsss) if rsss else None
+    return {"clients": clients, "summary": summary, "timeline": timeline}
+
+
+# ----------------------------------------------------------------------
+# Entry point
+# ----------------------------------------------------------------------
+def compare(results: list[dict], baseline_path: str) -> None:
+    with open(baseline_path) as f:
+        baseline = {r["clients"]: r["summary"] for r in json.load(f)["runs"]}
+    print(f"\nCompared with {baseline_path}:")
+    for run in results:
+        old = baseline.get(run["clients"])
+        if old is None:
+            continue
+        new = run["summary"]
+        parts = []
+        for key in ("rps", "p50_ms", "p99_ms", "error_rate", "server_cpu_avg", "server_rss_max_mb"):
+            if new.get(key) is None or old.get(key) is None:
+                continue
+            change = (new[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+            parts.append(f"{key} {old[key]:.2f} -> {new[key]:.2f} ({change:+.0f}%)")
+        print(f"  {run['clients']:5d} clients: " + ", ".join(parts))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load test server.py with simulated players")
+    parser.add_argument("--url", default="http://127.0.0.1:8989", help="server to test unless --spawn")
+    parser.add_argument("--spawn", action="store_true", help="start server.py on a free port for each run")
+    parser.add_argument("--server-args", default="", help="extra server.py arguments with --spawn")
+    parser.add_argument("--server-pid", type=int, help="pid to sample CPU/RSS from without --spawn")
+    parser.add_argument("--clients", default="10,100", help="comma separated client counts, one run each")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per run")
+    parser.add_argument("--poll", type=float, default=0.02, help="seconds between requests per client")
+    parser.add_argument("--protocol", choices=("sync", "legacy"), default="sync")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", default="loadtest_result.json")
+    parser.add_argument("--baseline", help="earlier result file to compare against")
+    args = parser.parse_args()
+
+    walk_maps = [load_walk_map(name) for name in MAPS]
+    url = urlsplit(args.url)
+    runs = []
+    for clients in (int(c) for c in args.clients.split(",")):
+        proc = None
+        host, port, pid = url.hostname or "127.0.0.1", url.port or 8989, args.server_pid
+        if args.spawn:
+            host, port = "127.0.0.1", free_port()
+            proc = start_server(port, extra=shlex.split(args.server_args))
+            pid = proc.pid
+        try:
+            print(f"Running {clients} clients for {args.duration:.0f}s ({args.protocol} protocol)")
+            runs.append(asyncio.run(run_load(
+                host, port, clients, args.duration, args.protocol, args.poll, walk_maps, pid, args.seed
+            )))
+        finally:
+            if proc is not None:
+                proc.terminate()
+                proc.wait()
+
+    print("\nSummary:")
+    for run in runs:
+        s = run["summary"]
+        print(
+            f"  {run['clients']:5d} clients: {s['rps']:8.0f} req/s  p50 {s['p50_ms']:7.2f} ms  "
+            f"p90 {s['p90_ms']:7.2f} ms  p99 {s['p99_ms']:8.2f} ms  errors {s['error_rate'] * 100:5.2f}%"
+        )
+
+    result = {
+        "config": {
+            "url": None if args.spawn else args.url,
+            "server_args": args.server_args,
+            "duration": args.duration,
+            "poll": args.poll,
+            "protocol": args.protocol,
+            "seed": args.seed,
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "runs": runs,
+    }
+    with open(args.out, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"Results written to {args.out}")
+
+    if args.baseline:
+        compare(runs, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Map baking with and without the shared scaled tile cache
+
+Bakes every chunk of --map three ways: scaling the tile image for every
+cell as Map did before, with an empty TILE_IMAGES (each tile scaled once),
+and again for a second Map of the same file, like loading a save again,
+which finds every tile already scaled.
+
+Then times GameManager.from_dict on --save, and from_dict plus drawing the
+first frame of every map in it, with and without the cache. Maps are baked
+when first drawn, so that frame is where the cache pays off.
+
+Usage:
+    python benchmarks/map_bake.py --map map.tmx --save saves/game0.json
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pygame as pg
+
+from src.maps import map as map_module
+from src.maps.map import ChunkCache, Map, TileImageCache
+from src.utils import GameSettings, Position, PositionCamera
+
+
+def uncached_tile_image(self: Map, gid: int) -> pg.Surface | None:
+    """Map._tile_image as it was: the tile scaled again for every cell"""
+    image = self.tmxdata.get_tile_image_by_gid(gid)
+    if image is None:
+        return None
+    return pg.transform.scale(image, (GameSettings.TILE_SIZE, GameSettings.TILE_SIZE))
+
+
+def fresh_caches() -> None:
+    map_module.TILE_IMAGES = TileImageCache()
+    map_module.CHUNK_CACHE = ChunkCache(GameSettings.MAP_CHUNK_BUDGET_MB << 20)
+
+
+def bake_all(game_map: Map) -> float:
+    start = time.perf_counter()
+    for cy in range(game_map._chunks_h):
+        for cx in range(game_map._chunks_w):
+            game_map._bake_chunk(cx, cy)
+    return time.perf_counter() - start
+
+
+def load_game(save: dict, screen: pg.Surface) -> tuple[float, float]:
+    """Seconds for GameManager.from_dict, and for it plus the first frame of every map"""
+    from src.core.managers.game_manager import GameManager
+
+    start = time.perf_counter()
+    manager = GameManager.from_dict(save)
+    loaded = time.perf_counter() - start
+    for game_map in manager.maps.values():
+        game_map.draw(screen, PositionCamera(int(game_map.spawn.x) - screen.get_width() // 2,
+                                             int(game_map.spawn.y) - screen.get_height() // 2))
+    return loaded, time.perf_counter() - start
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Map bake time with and without the scaled tile cache")
+    parser.add_argument("--map", default="map.tmx")
+    parser.add_argument("--save", default=os.path.join(ROOT, "saves", "game0.json"))
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    pg.init()
+    screen = pg.display.set_mode((GameSettings.SCREEN_WIDTH, GameSettings.SCREEN_HEIGHT))
+    cached_tile_image = Map._tile_image
+
+    runs = {"scaled every cell": [], "cache, empty": [], "cache, warm": []}
+    for _ in range(args.repeat):
+        fresh_caches()
+        Map._tile_image = uncached_tile_image
+        runs["scaled every cell"].append(bake_all(Map(args.map, [], Position(0, 0))))
+        Map._tile_image = cached_tile_image
+        runs["cache, empty"].append(bake_all(Map(args.map, [], Position(0, 0))))
+        runs["cache, warm"].append(bake_all(Map(args.map, [], Position(0, 0))))
+    game_map = Map(args.map, [], Position(0, 0))
+    cells = sum(
+        1 for layer in game_map.tmxdata.visible_layers if hasattr(layer, "data")
+        for row in layer.data for gid in row if gid
+    )
+    print(f"baking all of {args.map}: {game_map._chunks_w * game_map._chunks_h} chunks, {cells} cells, "
+          f"{len(map_module.TILE_IMAGES)} distinct tiles, median of {args.repeat}")
+    base = statistics.median(runs["scaled every cell"])
+    for name, seconds in runs.items():
+        median = statistics.median(seconds)
+        print(f"  {name:20}{median * 1000:8.1f} ms  {base / median:5.1f}x")
+
+    with open(args.save) as f:
+        save = json.load(f)
+    print(f"\nGameManager.from_dict({os.path.relpath(args.save, ROOT)}), median of {args.repeat}")
+    for name, tile_image in (("scaled every cell", uncached_tile_image), ("cache", cached_tile_image)):
+        Map._tile_image = tile_image
+        loaded, drawn = [], []
+        for _ in range(args.repeat):
+            fresh_caches()
+            load, total = load_game(save, screen)
+            loaded.append(load)
+            drawn.append(total)
+        print(f"  {name:20}from_dict {statistics.median(loaded) * 1000:7.1f} ms, "
+              f"+ first frame of every map {statistics.median(drawn) * 1000:7.1f} ms")
+    Map._tile_image = cached_tile_image
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
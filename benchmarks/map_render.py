@@ -0,0 +1,165 @@
+"""
+Peak memory and draw time of the chunked map renderer on a big map
+
+Writes a synthetic map of --size x --size tiles using the real tileset: a
+floor layer with every tile set, a decoration layer with 20% of them and a
+collision layer with 10%. A camera then pans over it at --speed tiles per
+second for --frames frames at the game's screen size, changing direction
+now and then, and Map.draw is timed every frame.
+
+The same is run with the map prebaked into one surface and blitted whole,
+the way Map drew before, on the sizes that fit in memory (4 bytes a pixel,
+a 500 x 500 map would need 3.8 GB). Every run is a fresh process so peak
+RSS is its own.
+
+Usage:
+    python benchmarks/map_render.py --size 500 --prebaked-sizes 100,200
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pygame as pg
+
+from src.maps.map import CHUNK_CACHE, Map
+from src.utils import GameSettings, Position, PositionCamera
+
+TILESET = os.path.join(ROOT, "assets", "maps", "tileset.tsx")
+# Floor, decoration and collision gids taken from map.tmx
+FLOOR = (1, 2, 109, 112)
+DECOR = (53, 54, 55, 105, 106, 107, 157, 158)
+WALLS = (265, 573, 574, 575)
+
+
+def write_map(path: str, size: int, seed: int) -> None:
+    rng = random.Random(seed)
+    layers = [("Floor", FLOOR, 1.0), ("Decoration", DECOR, 0.2), ("Collision", WALLS, 0.1)]
+    with open(path, "w") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write(f'<map version="1.10" orientation="orthogonal" renderorder="right-down" width="{size}" '
+                f'height="{size}" tilewidth="16" tileheight="16" infinite="0">\n')
+        f.write(f' <tileset firstgid="1" source="{TILESET}"/>\n')
+        for i, (name, gids, share) in enumerate(layers, 1):
+            f.write(f' <layer id="{i}" name="{name}" width="{size}" height="{size}">\n  <data encoding="csv">\n')
+            rows = (
+                ",".join(str(rng.choice(gids)) if rng.random() < share else "0" for _ in range(size))
+                for _ in range(size)
+            )
+            f.write(",\n".join(rows))
+            f.write("\n  </data>\n </layer>\n")
+        f.write("</map>\n")
+
+
+class PrebakedMap(Map):
+    """Map as it drew before: the whole map baked into one surface up front, blitted whole"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        tiles = pg.Rect(0, 0, self.tmxdata.width, self.tmxdata.height)
+        self._surface = pg.Surface(
+            (tiles.width * GameSettings.TILE_SIZE, tiles.height * GameSettings.TILE_SIZE), pg.SRCALPHA
+        )
+        self._render_all_layers(self._surface, tiles)
+
+    def draw(self, screen: pg.Surface, camera: PositionCamera):
+        screen.blit(self._surface, camera.transform_position(Position(0, 0)))
+
+
+def run(renderer: str, path: str, frames: int, speed: float, seed: int) -> dict:
+    """One renderer in this process"""
+    pg.init()
+    screen = pg.display.set_mode((GameSettings.SCREEN_WIDTH, GameSettings.SCREEN_HEIGHT))
+    start = time.perf_counter()
+    game_map = (PrebakedMap if renderer == "prebaked" else Map)(path, [], Position(0, 0))
+    load = time.perf_counter() - start
+
+    rng = random.Random(seed)
+    tile = GameSettings.TILE_SIZE
+    limit_x = game_map.tmxdata.width * tile - screen.get_width()
+    limit_y = game_map.tmxdata.height * tile - screen.get_height()
+    x, y = limit_x / 2, limit_y / 2
+    dx, dy = 1.0, 0.0
+    times = []
+    for frame in range(frames):
+        if frame % 120 == 0:
+            dx, dy = rng.choice([(1, 0), (-1, 0), (0, 1), (0, -1), (0.7, 0.7), (-0.7, 0.7)])
+        x = min(max(x + dx * speed * tile / 60, 0), limit_x)
+        y = min(max(y + dy * speed * tile / 60, 0), limit_y)
+        start = time.perf_counter()
+        screen.fill((0, 0, 0))
+        game_map.draw(screen, PositionCamera(int(x), int(y)))
+        times.append(time.perf_counter() - start)
+
+    times.sort()
+    return {
+        "load_s": load,
+        "p50_ms": statistics.median(times) * 1000,
+        "p99_ms": times[int(len(times) * 0.99)] * 1000,
+        "max_ms": times[-1] * 1000,
+        "chunks": len(CHUNK_CACHE),
+        "cache_mb": CHUNK_CACHE.size / (1 << 20),
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Chunked against prebaked map rendering")
+    parser.add_argument("--size", type=int, default=500, help="map width and height in tiles")
+    parser.add_argument("--prebaked-sizes", default="100,200",
+                        help="sizes to also run the prebaked renderer and the chunked one on")
+    parser.add_argument("--frames", type=int, default=1200)
+    parser.add_argument("--speed", type=float, default=8.0, help="camera speed, tiles per second")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--run", nargs=2, metavar=("RENDERER", "MAP"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run(args.run[0], args.run[1], args.frames, args.speed, args.seed)))
+        return 0
+
+    sizes = sorted({int(s) for s in args.prebaked_sizes.split(",") if s} | {args.size})
+    print(f"{args.frames} frames at {GameSettings.SCREEN_WIDTH}x{GameSettings.SCREEN_HEIGHT}, camera at "
+          f"{args.speed:g} tiles/s, {GameSettings.MAP_CHUNK_TILES}x{GameSettings.MAP_CHUNK_TILES} tile chunks, "
+          f"budget {GameSettings.MAP_CHUNK_BUDGET_MB} MB")
+    print(f"{'':20}{'load s':>8}{'draw p50 ms':>13}{'p99 ms':>9}{'max ms':>9}{'chunks':>8}{'cache MB':>10}"
+          f"{'peak RSS MB':>13}")
+    ok = True
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            path = os.path.join(directory, f"synthetic_{size}.tmx")
+            write_map(path, size, args.seed)
+            renderers = ("prebaked", "chunked") if str(size) in args.prebaked_sizes.split(",") else ("chunked",)
+            for renderer in renderers:
+                proc = subprocess.run(
+                    [sys.executable, __file__, "--run", renderer, path, "--frames", str(args.frames),
+                     "--speed", str(args.speed), "--seed", str(args.seed)],
+                    capture_output=True, text=True,
+                )
+                label = f"{size}x{size} {renderer}"
+                if proc.returncode != 0:
+                    ok = False
+                    print(f"{label:20}failed: {proc.stderr.strip().splitlines()[-1:]}")
+                    continue
+                r = json.loads(proc.stdout.strip().splitlines()[-1])
+                print(f"{label:20}{r['load_s']:>8.2f}{r['p50_ms']:>13.2f}{r['p99_ms']:>9.2f}{r['max_ms']:>9.2f}"
+                      f"{r['chunks']:>8}{r['cache_mb']:>10.0f}{r['peak_rss_mb']:>13.0f}")
+                if renderer == "chunked":
+                    ok &= r["cache_mb"] <= GameSettings.MAP_CHUNK_BUDGET_MB
+    print("OK" if ok else "FAILED")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
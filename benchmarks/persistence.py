@@ -0,0 +1,135 @@
+"""
+Write amplification and recovery time of the player journal
+
+Runs a PlayerHandler with a Journal in a temporary directory while a share
+of the players move every 50 ms tick, like clients at 20 Hz. Reports how
+many bytes reached the disk per update (log plus snapshots, after the
+journal coalesced updates of the same player between writes) against one
+log entry per update, and what the journal costs the updating thread.
+
+Then restarts from the files twice, once from the last periodic snapshot
+and the short log after it, and once after a run that wrote no snapshot so
+the whole run is replayed from the log, and checks the recovered players
+match. Recovery includes writing the new snapshot the server starts with.
+
+Usage:
+    python benchmarks/persistence.py --players 5000 --duration 5
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from server.persistence import RECORD, Journal
+from server.playerHandler import PlayerHandler
+
+MAPS = ("map.tmx", "gym.tmx", "house.tmx")
+TICK = 0.05
+
+
+def run(handler: PlayerHandler, players: int, moving: float, duration: float, seed: int) -> tuple[int, float]:
+    """Move players for duration seconds, returns the updates made and seconds spent in update()"""
+    rng = random.Random(seed)
+    updates = 0
+    spent = 0.0
+    movers = rng.sample(range(players), int(players * moving))
+    end = time.monotonic() + duration
+    next_tick = time.monotonic()
+    while time.monotonic() < end:
+        start = time.perf_counter()
+        for pid in movers:
+            handler.update(pid, rng.random() * 2000, rng.random() * 2000, MAPS[pid % len(MAPS)], "left", True)
+        spent += time.perf_counter() - start
+        updates += len(movers)
+        next_tick += TICK
+        time.sleep(max(0.0, next_tick - time.monotonic()))
+    return updates, spent
+
+
+def same_players(a: PlayerHandler, b: PlayerHandler) -> bool:
+    # Positions are compared at the float32 precision the journal stores
+    return a.players.keys() == b.players.keys() and all(
+        abs(p.x - q.x) < 1e-3 and abs(p.y - q.y) < 1e-3
+        and (p.map, p.direction, p.moving) == (q.map, q.direction, q.moving)
+        for p, q in ((a.players[pid], b.players[pid]) for pid in a.players)
+    )
+
+
+def recover(directory: str) -> tuple[PlayerHandler, float]:
+    start = time.perf_counter()
+    handler = PlayerHandler()
+    handler.attach_journal(Journal(directory, fsync=False))
+    elapsed = time.perf_counter() - start
+    handler.stop()
+    return handler, elapsed
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Journal write amplification and recovery time")
+    parser.add_argument("--players", type=int, default=5000)
+    parser.add_argument("--moving", type=float, default=0.2, help="share of players moving every tick")
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--snapshot-interval", type=float, default=2.0)
+    parser.add_argument("--no-fsync", action="store_true")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    entry = 1 + RECORD.size
+    ok = True
+    with tempfile.TemporaryDirectory() as directory:
+        plain = PlayerHandler()
+        for _ in range(args.players):
+            plain.register()
+        plain_updates, plain_spent = run(plain, args.players, args.moving, 1.0, args.seed)
+
+        handler = PlayerHandler()
+        journal = Journal(directory, snapshot_interval=args.snapshot_interval, fsync=not args.no_fsync)
+        handler.attach_journal(journal)
+        for _ in range(args.players):
+            handler.register()
+        updates, spent = run(handler, args.players, args.moving, args.duration, args.seed)
+        handler.stop()
+        stats = journal.stats
+        written = stats.log_bytes + stats.snapshot_bytes
+
+        print(f"{args.players} players, {args.moving:.0%} moving at {1 / TICK:.0f} Hz for {args.duration:g} s, "
+              f"snapshot every {args.snapshot_interval:g} s")
+        print(f"  updates            {updates}  ({stats.updates_written} written after coalescing)")
+        print(f"  log bytes          {stats.log_bytes}")
+        print(f"  snapshot bytes     {stats.snapshot_bytes}  ({stats.snapshots} snapshots)")
+        print(f"  bytes per update   {written / updates:.1f}  vs {entry} for one log entry each")
+        print(f"  write amplification {written / (updates * entry):.2f}")
+        print(f"  update() cost      {spent / updates * 1e6:.2f} us with journal, "
+              f"{plain_spent / plain_updates * 1e6:.2f} us without")
+
+        recovered, seconds = recover(directory)
+        same = same_players(handler, recovered) and recovered._next_id == handler._next_id
+        ok &= same
+        print(f"\nrecovery from the last snapshot + log: {seconds * 1000:.1f} ms for {len(recovered.players)} players, "
+              f"match: {same}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        # No snapshot while running, the whole run has to be replayed from the log
+        handler = PlayerHandler()
+        journal = Journal(directory, snapshot_interval=3600, fsync=False)
+        handler.attach_journal(journal)
+        for _ in range(args.players):
+            handler.register()
+        run(handler, args.players, args.moving, args.duration, args.seed + 1)
+        handler.stop()
+        log_size = os.path.getsize(os.path.join(directory, "players.log"))
+        recovered, seconds = recover(directory)
+        same = same_players(handler, recovered)
+        ok &= same
+        print(f"recovery from snapshot + {log_size / 1024:.0f} KB log: {seconds * 1000:.1f} ms, match: {same}")
+
+    print("OK" if ok else "FAILED")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
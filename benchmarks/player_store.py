@@ -0,0 +1,180 @@
+"""
+Dataclass store (PlayerHandler) against the NumPy array store (ArrayPlayerHandler)
+
+Fills both with the same players spread over a few maps, then reports the
+memory each one holds per player and how long it takes to build snapshots
+of the world and of one map, as JSON and binary, after a player moved.
+Also times a delta with a few changed players and an expiry pass, and
+checks that both stores return the same players, and the same per-map
+deltas after players move within and between maps and expire: the same
+changed and removed ids, and None when only other maps changed, and
+that the id of an expired player is not handed out again. The
+shared-memory store (server.py --workers) is checked the same way, except
+that it may also list as removed a player who changed map twice, as long
+as it is not on the map. Exits non-zero if they differ.
+
+Usage:
+    python benchmarks/player_store.py --players 10000
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from server import binaryProtocol
+from server.arrayPlayerTable import ArrayPlayerHandler
+from server.playerHandler import PlayerHandler
+from server.sharedPlayerTable import SharedPlayerHandler
+
+MAPS = ("map.tmx", "gym.tmx", "house.tmx", "cave.tmx")
+
+
+def fill(handler, players: int, seed: int) -> None:
+    rng = random.Random(seed)
+    for _ in range(players):
+        pid = handler.register()
+        handler.update(
+            pid, rng.randrange(4000) * 0.5, rng.randrange(4000) * 0.5, rng.choice(MAPS),
+            rng.choice(binaryProtocol.DIRECTIONS), rng.random() < 0.5,
+        )
+
+
+def deltas_agree(players: int, rounds: int, seed: int) -> bool:
+    stores = (PlayerHandler(), ArrayPlayerHandler(), SharedPlayerHandler())
+    for handler in stores:
+        fill(handler, players, seed)
+    rng = random.Random(seed)
+
+    def ids(handler, since: int, map_name: str):
+        delta = handler.delta(since, map_name)
+        return None if delta is None else (delta.full, set(delta.players), set(delta.removed))
+
+    def shared_agrees(exact, shared, map_name: str) -> bool:
+        if exact is None or shared is None:
+            return exact == shared
+        extra = shared[2] - exact[2]
+        return exact[:2] == shared[:2] and exact[2] <= shared[2] and not extra & stores[2].list_players(map_name).keys()
+
+    def agree(sinces: list[int]) -> bool:
+        return all(
+            ids(stores[0], sinces[0], name) == ids(stores[1], sinces[1], name)
+            and shared_agrees(ids(stores[0], sinces[0], name), ids(stores[2], sinces[2], name), name)
+            for name in MAPS
+        )
+
+    first = [handler.version for handler in stores]
+    ok = True
+    for _ in range(rounds):
+        since = [handler.version for handler in stores]
+        elsewhere = rng.random() < 0.3
+        on_first = stores[0].list_players(MAPS[0])
+        for _ in range(rng.randint(1, 20)):
+            pid = rng.randrange(players)
+            if elsewhere and pid in on_first:
+                # Only players on the other maps move, a delta of MAPS[0] is None
+                continue
+            # Most stay on their map, some go to another one
+            map_name = rng.choice(MAPS[1:] if elsewhere else MAPS) if rng.random() < 0.3 else None
+            x = rng.random() * 100
+            for handler in stores:
+                handler.update(pid, x, 0.0, map_name or handler.list_players()[pid]["map"])
+        ok &= agree(since) and agree(first)
+    for handler in stores:
+        handler.expire(time.monotonic() + handler.timeout_seconds + 1)
+    ok &= agree(first)
+    # Ids are never handed out again, so an expired client cannot move whoever registers next
+    return ok and all(handler.register() >= players and not handler.update(0, 1.0, 1.0, MAPS[0]) for handler in stores)
+
+
+def measure_memory(factory, players: int) -> tuple[object, float]:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    handler = factory()
+    fill(handler, players, seed=1)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return handler, (after - before) / players
+
+
+def time_ms(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Compare the dataclass and NumPy player stores")
+    parser.add_argument("--players", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    deltas_same = deltas_agree(500, 200, seed=3)
+
+    stores = {
+        "dataclass": measure_memory(PlayerHandler, args.players),
+        "array": measure_memory(ArrayPlayerHandler, args.players),
+    }
+
+    # Same players in both, positions compared at float32 precision
+    dict_players = stores["dataclass"][0].list_players(MAPS[0])
+    array_players = stores["array"][0].list_players(MAPS[0])
+    same = dict_players.keys() == array_players.keys() and all(
+        abs(p["x"] - array_players[pid]["x"]) < 1e-3 and p["map"] == array_players[pid]["map"]
+        and p["direction"] == array_players[pid]["direction"] and p["moving"] == array_players[pid]["moving"]
+        for pid, p in dict_players.items()
+    )
+    print(f"{args.players} players over {len(MAPS)} maps, stores agree: {same}, per-map deltas agree: {deltas_same}")
+    print(f"{'':24}{'dataclass':>12}{'array':>12}")
+    print(f"{'bytes per player':24}" + "".join(f"{per:>12.0f}" for _, per in stores.values()))
+
+    rng = random.Random(2)
+
+    def rebuild(handler, map_name, binary):
+        # Move someone on that map first, otherwise the cached snapshot is served
+        def run():
+            handler.update(rng.randrange(args.players), rng.random() * 100, 0.0, map_name or MAPS[0])
+            handler.encoded_snapshot(map_name, binary)
+        return run
+
+    rows = [
+        ("world snapshot json", lambda h: rebuild(h, None, False)),
+        ("world snapshot binary", lambda h: rebuild(h, None, True)),
+        ("map snapshot json", lambda h: rebuild(h, MAPS[1], False)),
+        ("map snapshot binary", lambda h: rebuild(h, MAPS[1], True)),
+    ]
+    for label, make in rows:
+        cells = [time_ms(make(handler), args.repeat) for handler, _ in stores.values()]
+        print(f"{label + ' ms':24}" + "".join(f"{c:>12.3f}" for c in cells))
+
+    def delta_of_few(handler):
+        def run():
+            since = handler.version
+            for _ in range(10):
+                handler.update(rng.randrange(args.players), rng.random() * 100, 0.0, MAPS[0])
+            json.loads(handler.encoded_delta(since, MAPS[0]))
+        return run
+
+    cells = [time_ms(delta_of_few(handler), args.repeat) for handler, _ in stores.values()]
+    print(f"{'10-change delta ms':24}" + "".join(f"{c:>12.3f}" for c in cells))
+    cells = [time_ms(lambda: handler.expire(time.monotonic()), args.repeat) for handler, _ in stores.values()]
+    print(f"{'expiry pass, none due ms':24}" + "".join(f"{c:>12.3f}" for c in cells))
+    cells = []
+    for handler, _ in stores.values():
+        start = time.perf_counter()
+        expired = handler.expire(time.monotonic() + handler.timeout_seconds + 1)
+        cells.append((time.perf_counter() - start) * 1000)
+        assert len(expired) == args.players
+    print(f"{'expiry pass, all due ms':24}" + "".join(f"{c:>12.3f}" for c in cells))
+    return 0 if same and deltas_same else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
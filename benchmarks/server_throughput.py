@@ -0,0 +1,99 @@
+"""
+Throughput benchmark for server.py
+
+Starts the server twice (legacy single-threaded HTTP/1.0 and the default
+threaded HTTP/1.1 server) and hammers each with the same client mix the game
+produces: every simulated client POSTs its position and GETs /players.
+
+Usage:
+    python benchmarks/server_throughput.py --clients 32 --duration 5
+"""
+import argparse
+import http.client
+import json
+import threading
+import time
+
+from _common import free_port, start_server
+
+
+def client(port: int, stop: threading.Event, latencies: list[float], errors: list[int]) -> None:
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    pid = None
+    while pid is None and not stop.is_set():
+        try:
+            conn.request("GET", "/register")
+            pid = json.loads(conn.getresponse().read())["id"]
+        except (OSError, http.client.HTTPException):
+            # The legacy server drops connections once its backlog is full
+            errors.append(1)
+            conn.close()
+    x = 0.0
+    while not stop.is_set():
+        x += 1.0
+        body = json.dumps({"id": pid, "x": x, "y": 0.0, "map": "map.tmx"})
+        for method, path, payload in (("POST", "/players", body), ("GET", "/players", None)):
+            start = time.perf_counter()
+            try:
+                headers = {"Content-Type": "application/json"} if payload else {}
+                conn.request(method, path, body=payload, headers=headers)
+                resp = conn.getresponse()
+                resp.read()
+                if resp.status != 200:
+                    errors.append(1)
+            except (OSError, http.client.HTTPException):
+                errors.append(1)
+                conn.close()
+                continue
+            latencies.append(time.perf_counter() - start)
+    conn.close()
+
+
+def run(port: int, clients: int, duration: float) -> dict:
+    stop = threading.Event()
+    latencies: list[float] = []
+    errors: list[int] = []
+    threads = [
+        threading.Thread(target=client, args=(port, stop, latencies, errors), daemon=True)
+        for _ in range(clients)
+    ]
+    for t in threads:
+        t.start()
+    time.sleep(duration)
+    stop.set()
+    for t in threads:
+        t.join(timeout=10)
+
+    latencies.sort()
+    n = len(latencies)
+    return {
+        "requests": n,
+        "errors": len(errors),
+        "rps": n / duration,
+        "p50_ms": latencies[n // 2] * 1000 if n else 0.0,
+        "p99_ms": latencies[min(n - 1, int(n * 0.99))] * 1000 if n else 0.0,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=5.0)
+    args = parser.parse_args()
+
+    for name, extra in (("legacy", ["--legacy"]), ("threaded", [])):
+        port = free_port()
+        proc = start_server(port, extra=extra)
+        try:
+            r = run(port, args.clients, args.duration)
+        finally:
+            proc.terminate()
+            proc.wait()
+        print(
+            f"{name:>9}: {r['rps']:8.0f} req/s  p50 {r['p50_ms']:7.2f} ms  "
+            f"p99 {r['p99_ms']:7.2f} ms  errors {r['errors']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
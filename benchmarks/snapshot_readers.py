@@ -0,0 +1,122 @@
+"""
+Concurrent reader benchmark for PlayerHandler snapshots
+
+A writer moves a few players at 20 Hz while N reader threads fetch the
+player list, either the old way (snapshot + json.dumps per read) or from
+the cached pre-encoded snapshot. Reports reads/s, how many times the JSON
+was encoded, and how long readers spent waiting on and holding the lock.
+
+Usage:
+    python benchmarks/snapshot_readers.py --players 500 --duration 2
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from server.playerHandler import PlayerHandler
+
+
+class TimedLock:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._acquired_at = 0.0
+        self.acquires = 0
+        self.wait = 0.0
+        self.held = 0.0
+
+    def __enter__(self) -> "TimedLock":
+        start = time.perf_counter()
+        self._lock.acquire()
+        self._acquired_at = time.perf_counter()
+        self.acquires += 1
+        self.wait += self._acquired_at - start
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.held += time.perf_counter() - self._acquired_at
+        self._lock.release()
+
+
+def run(readers: int, players: int, duration: float, cached: bool) -> dict:
+    handler = PlayerHandler()
+    for _ in range(players):
+        pid = handler.register()
+        handler.update(pid, float(pid), 0.0, "map.tmx")
+    lock = TimedLock()
+    handler._lock = lock
+
+    stop = threading.Event()
+    reads = [0] * readers
+    encodes = [0]
+    real_dumps = json.dumps
+
+    def counting_dumps(*args, **kwargs):
+        encodes[0] += 1
+        return real_dumps(*args, **kwargs)
+
+    def reader(i: int) -> None:
+        while not stop.is_set():
+            if cached:
+                handler.encoded_snapshot("map.tmx")
+            else:
+                version, ps = handler.snapshot("map.tmx")
+                counting_dumps({"players": ps, "version": version}).encode("utf-8")
+            reads[i] += 1
+
+    def writer() -> None:
+        x = 0.0
+        while not stop.wait(0.05):
+            x += 1.0
+            for pid in range(5):
+                handler.update(pid, x, 0.0, "map.tmx")
+
+    import server.playerHandler as module
+    module.json.dumps = counting_dumps
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    threads.append(threading.Thread(target=writer))
+    try:
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        time.sleep(duration)
+        stop.set()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        module.json.dumps = real_dumps
+
+    total = sum(reads)
+    return {
+        "reads_per_s": total / elapsed,
+        "encodes": encodes[0],
+        "lock_wait_ms": lock.wait * 1000,
+        "lock_held_ms": lock.held * 1000,
+        "lock_acquires": lock.acquires,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--players", type=int, default=500)
+    parser.add_argument("--duration", type=float, default=2.0)
+    args = parser.parse_args()
+
+    for readers in (1, 4, 16, 64):
+        for cached in (False, True):
+            r = run(readers, args.players, args.duration, cached)
+            print(
+                f"readers {readers:3d} {'cached' if cached else 'encode':>6}: "
+                f"{r['reads_per_s']:9.0f} reads/s  encodes {r['encodes']:6d}  "
+                f"lock acquires {r['lock_acquires']:6d}  wait {r['lock_wait_ms']:8.1f} ms  "
+                f"held {r['lock_held_ms']:7.1f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Radius queries, PlayerHandler.near against brute force
+
+First checks the grid: players move, change map and expire at random,
+and every query must return exactly the players a brute-force distance
+filter over the whole map finds. Exits non-zero on a mismatch.
+
+Then times queries at a growing population, keeping the density fixed
+(so a query always has about the same number of players near it): the
+grid should stay flat while brute force grows with the population.
+
+Usage:
+    python benchmarks/spatial_query.py --sizes 1000,10000,100000
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from server.playerHandler import GRID_CELL, PlayerHandler
+
+MAPS = ("map.tmx", "gym.tmx")
+# Players per grid cell in the timing runs
+DENSITY = 0.25
+
+
+def brute_force(handler: PlayerHandler, map_name: str, x: float, y: float, r: float) -> set[int]:
+    players = handler.list_players(map_name)
+    return {pid for pid, p in players.items() if (p["x"] - x) ** 2 + (p["y"] - y) ** 2 <= r * r}
+
+
+def check(rounds: int, seed: int) -> bool:
+    rng = random.Random(seed)
+    handler = PlayerHandler(timeout_seconds=1.0)
+    side = 40 * GRID_CELL
+    for _ in range(300):
+        handler.register()
+    mismatches = 0
+    for round_ in range(rounds):
+        for _ in range(50):
+            pid = rng.randrange(handler._next_id)
+            handler.update(pid, rng.uniform(-side, side), rng.uniform(-side, side), rng.choice(MAPS))
+        if round_ % 50 == 49:
+            # Expire everyone idle, then bring the population back
+            handler.expire(time.monotonic() + 0.5)
+            for _ in range(100):
+                handler.register()
+        for _ in range(20):
+            map_name = rng.choice(MAPS)
+            x, y = rng.uniform(-side, side), rng.uniform(-side, side)
+            # Radii from inside one cell up to most of the map, and on cell boundaries
+            r = rng.choice((rng.uniform(0, GRID_CELL), rng.uniform(0, side), GRID_CELL * rng.randrange(1, 8)))
+            got = set(handler.near(map_name, x, y, r)[1])
+            if got != brute_force(handler, map_name, x, y, r):
+                mismatches += 1
+    print(f"correctness: {rounds * 20} queries against brute force, {mismatches} mismatches")
+    return mismatches == 0
+
+
+def time_queries(size: int, radius: float, queries: int, seed: int) -> tuple[float, float, float]:
+    rng = random.Random(seed)
+    handler = PlayerHandler()
+    side = math.sqrt(size / DENSITY) * GRID_CELL
+    for _ in range(size):
+        pid = handler.register()
+        handler.update(pid, rng.uniform(0, side), rng.uniform(0, side), MAPS[0])
+    points = [(rng.uniform(0, side), rng.uniform(0, side)) for _ in range(queries)]
+
+    start = time.perf_counter()
+    found = sum(len(handler.near(MAPS[0], x, y, radius)[1]) for x, y in points)
+    grid = (time.perf_counter() - start) / queries
+
+    brute_queries = max(1, queries // 20)
+    start = time.perf_counter()
+    for x, y in points[:brute_queries]:
+        brute_force(handler, MAPS[0], x, y, radius)
+    brute = (time.perf_counter() - start) / brute_queries
+    return grid, brute, found / queries
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="PlayerHandler.near against brute force")
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    parser.add_argument("--radius", type=float, default=5 * GRID_CELL, help="query radius in pixels")
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=200, help="rounds of the correctness check")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    ok = check(args.rounds, args.seed)
+
+    print(f"\nradius {args.radius:g} px, {DENSITY} players per cell")
+    print(f"{'players':>10}{'found':>8}{'grid us':>12}{'brute us':>12}{'speedup':>10}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        grid, brute, found = time_queries(size, args.radius, args.queries, args.seed)
+        print(f"{size:>10}{found:>8.1f}{grid * 1e6:>12.1f}{brute * 1e6:>12.1f}{brute / grid:>9.0f}x")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+"""
+Teleporter and warp checks, tile index against building a rect per trigger
+
+Map.check_teleport and Map.check_warp used to build a pg.Rect for every
+trigger and test it, and Player.update calls them every frame. Now they
+look up the tiles under the player in a TriggerIndex.
+
+Checks the index returns what the old scan did (the first trigger in list
+order that overlaps) for player-sized rects at random positions, on
+aligned tiles and between them, with --triggers teleporters and as many
+warps on a --size x --size tile map, some on the same tile. Then times a
+check with the player standing away from every trigger (every frame but
+the one that fires) and on one. Exits non-zero if the results differ.
+
+Usage:
+    python benchmarks/trigger_lookup.py --triggers 10,100,1000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pygame as pg
+
+from src.maps import TriggerIndex
+from src.utils import GameSettings, Position, Teleport, Warp
+
+TILE = GameSettings.TILE_SIZE
+
+
+def scan_teleport(teleporters: list[Teleport], rect: pg.Rect) -> Teleport | None:
+    """The old Map.check_teleport"""
+    for teleporter in teleporters:
+        tp_rect = pg.Rect(teleporter.pos.x, teleporter.pos.y, TILE, TILE)
+        if rect.colliderect(tp_rect):
+            return teleporter
+    return None
+
+
+def scan_warp(warps: list[Warp], rect: pg.Rect) -> Warp | None:
+    """The old Map.check_warp"""
+    for warp in warps:
+        warp_rect = pg.Rect(warp.source.x, warp.source.y, TILE, TILE)
+        if rect.colliderect(warp_rect):
+            return warp
+    return None
+
+
+def timed(fn, rects: list[pg.Rect]) -> float:
+    """Microseconds per call, best of three"""
+    best = float("inf")
+    for _ in range(3):
+        start = time.perf_counter()
+        for rect in rects:
+            fn(rect)
+        best = min(best, (time.perf_counter() - start) / len(rects))
+    return best * 1e6
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Trigger lookups, tile index against a rect scan")
+    parser.add_argument("--triggers", default="2,10,100,1000", help="teleporters (and warps) per map")
+    parser.add_argument("--size", type=int, default=200, help="map width and height in tiles")
+    parser.add_argument("--queries", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    ok = True
+
+    print(f"{args.size}x{args.size} tile map, player-sized rect, microseconds per check")
+    print(f"{'triggers':>9}{'scan, away':>12}{'index':>8}{'scan, on one':>14}{'index':>8}  same")
+    for count in (int(c) for c in args.triggers.split(",")):
+        def tile() -> Position:
+            return Position(rng.randrange(args.size) * TILE, rng.randrange(args.size) * TILE)
+
+        teleporters = [Teleport(tile(), f"map{i}.tmx") for i in range(count)]
+        # A few unaligned ones, and a few sharing a tile with an earlier one
+        for teleporter in rng.sample(teleporters, count // 10):
+            teleporter.pos = Position(teleporter.pos.x + rng.randrange(TILE), teleporter.pos.y)
+        teleporters += [Teleport(rng.choice(teleporters).pos.copy(), "shared.tmx") for _ in range(count // 10)]
+        warps = [Warp(tile(), tile()) for _ in range(count)]
+        teleport_index = TriggerIndex(TILE)
+        for teleporter in teleporters:
+            teleport_index.add(pg.Rect(teleporter.pos.x, teleporter.pos.y, TILE, TILE), teleporter)
+        warp_index = TriggerIndex(TILE)
+        for warp in warps:
+            warp_index.add(pg.Rect(warp.source.x, warp.source.y, TILE, TILE), warp)
+
+        rects = []
+        for _ in range(args.queries):
+            if rng.random() < 0.5:
+                # On or next to a trigger
+                pos = rng.choice(teleporters).pos if rng.random() < 0.5 else rng.choice(warps).source
+                x, y = pos.x + rng.randint(-TILE, TILE), pos.y + rng.randint(-TILE, TILE)
+            else:
+                x, y = rng.randint(-TILE, args.size * TILE), rng.randint(-TILE, args.size * TILE)
+            rects.append(pg.Rect(x, y, TILE, TILE))
+        same = all(
+            scan_teleport(teleporters, rect) is teleport_index.find(rect)
+            and scan_warp(warps, rect) is warp_index.find(rect)
+            for rect in rects
+        )
+        ok &= same
+
+        away = [rect for rect in rects if scan_teleport(teleporters, rect) is None]
+        on = [rect for rect in rects if scan_teleport(teleporters, rect) is not None]
+        print(f"{count:>9}{timed(lambda r: scan_teleport(teleporters, r), away):>12.2f}"
+              f"{timed(teleport_index.find, away):>8.2f}"
+              f"{timed(lambda r: scan_teleport(teleporters, r), on):>14.2f}"
+              f"{timed(teleport_index.find, on):>8.2f}  {same}")
+    print("OK" if ok else "FAILED")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
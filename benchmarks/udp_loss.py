@@ -0,0 +1,194 @@
+"""
+UDP channel under packet loss and reordering
+
+Starts server.py and puts a lossy relay in front of its UDP port that drops
+a share of the datagrams in both directions and delays the rest by a random
+amount, so they also arrive out of order. Two OnlineManagers talk to the
+server through it: one walks steadily to the right, the other stands still
+and watches.
+
+Checks that the server never applies an older position after a newer one,
+that it ends up with the walker's final position, and that the watcher's
+copy of the world converges to it. Exits non-zero if any check fails.
+
+Usage:
+    python benchmarks/udp_loss.py --loss 0.2 --jitter 0.03 --steps 300
+"""
+import argparse
+import heapq
+import os
+import random
+import select
+import socket
+import sys
+import threading
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.core.managers.online_manager import OnlineManager
+from src.utils import GameSettings
+
+from _common import free_port, start_server
+
+MAP = "map.tmx"
+STEP = 4.0
+Y = 100.0
+
+
+class LossyRelay:
+    """Forwards datagrams between clients and the server, dropping and delaying them"""
+
+    def __init__(self, upstream: tuple[str, int], loss: float, jitter: float, seed: int):
+        self.upstream = upstream
+        self.loss = loss
+        self.jitter = jitter
+        self.rng = random.Random(seed)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.port = self.sock.getsockname()[1]
+        # client address -> socket connected to the server on its behalf
+        self.clients: dict[tuple[str, int], socket.socket] = {}
+        self.owners: dict[socket.socket, tuple[str, int]] = {}
+        # (due time, order sent, socket, payload, destination)
+        self.queue: list[tuple[float, int, socket.socket, bytes, tuple[str, int] | None]] = []
+        self.sent = 0
+        self.forwarded = 0
+        self.dropped = 0
+        self.reordered = 0
+        self._last_order = -1
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="LossyRelay", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join(timeout=2)
+
+    def _schedule(self, sock: socket.socket, data: bytes, dest: tuple[str, int] | None) -> None:
+        self.sent += 1
+        if self.rng.random() < self.loss:
+            self.dropped += 1
+            return
+        due = time.monotonic() + self.rng.uniform(0, self.jitter)
+        heapq.heappush(self.queue, (due, self.sent, sock, data, dest))
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            timeout = 0.01
+            if self.queue:
+                timeout = max(0.0, min(timeout, self.queue[0][0] - time.monotonic()))
+            readable, _, _ = select.select([self.sock, *self.owners], [], [], timeout)
+            for sock in readable:
+                data, addr = sock.recvfrom(65535)
+                if sock is self.sock:
+                    upstream = self.clients.get(addr)
+                    if upstream is None:
+                        upstream = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                        upstream.connect(self.upstream)
+                        self.clients[addr] = upstream
+                        self.owners[upstream] = addr
+                    self._schedule(upstream, data, None)
+                else:
+                    self._schedule(self.sock, data, self.owners[sock])
+
+            now = time.monotonic()
+            while self.queue and self.queue[0][0] <= now:
+                _, order, sock, data, dest = heapq.heappop(self.queue)
+                if order < self._last_order:
+                    self.reordered += 1
+                self._last_order = max(self._last_order, order)
+                if dest is None:
+                    sock.send(data)
+                else:
+                    sock.sendto(data, dest)
+                self.forwarded += 1
+
+
+def watch_server(base: str, pid: int, stop: threading.Event, seen: list[float]) -> None:
+    """Record every x the server reports for the walker, it must never go back"""
+    session = requests.Session()
+    while not stop.is_set():
+        try:
+            players = session.get(f"{base}/players", params={"map": MAP}, timeout=2).json()["players"]
+        except (requests.RequestException, ValueError):
+            continue
+        p = players.get(str(pid))
+        if p is not None and (not seen or p["x"] != seen[-1]):
+            seen.append(p["x"])
+        time.sleep(0.002)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="UDP channel under loss and reordering")
+    parser.add_argument("--loss", type=float, default=0.2, help="share of datagrams dropped each way")
+    parser.add_argument("--jitter", type=float, default=0.03, help="max extra delay per datagram in seconds")
+    parser.add_argument("--steps", type=int, default=300)
+    parser.add_argument("--fps", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    port, udp_port = free_port(), free_port(socket.SOCK_DGRAM)
+    proc = start_server(port, udp_port=udp_port)
+    relay = LossyRelay(("127.0.0.1", udp_port), args.loss, args.jitter, args.seed)
+    relay.start()
+
+    base = f"http://127.0.0.1:{port}"
+    GameSettings.ONLINE_SERVER_URL = base
+    GameSettings.ONLINE_USE_UDP = True
+    GameSettings.ONLINE_UDP_PORT = relay.port
+    walker, watcher = OnlineManager(), OnlineManager()
+    stop = threading.Event()
+    seen: list[float] = []
+    try:
+        walker.enter()
+        watcher.enter()
+        if not (walker.wait_registered(5.0) and watcher.wait_registered(5.0)):
+            raise RuntimeError("could not register with the server")
+        watcher.update(0.0, 0.0, MAP)
+        monitor = threading.Thread(target=watch_server, args=(base, walker.player_id, stop, seen), daemon=True)
+        monitor.start()
+
+        for step in range(args.steps):
+            walker.update(step * STEP, Y, MAP, "right", True)
+            time.sleep(1.0 / args.fps)
+        final = (args.steps - 1) * STEP
+        walker.update(final, Y, MAP, "right", False)
+        stopped_at = time.monotonic()
+
+        converged = None
+        while time.monotonic() - stopped_at < 5.0:
+            mine = [p for p in watcher.get_list_players() if p["id"] == walker.player_id]
+            if mine and mine[0]["x"] == final and not mine[0]["moving"]:
+                converged = time.monotonic() - stopped_at
+                break
+            time.sleep(0.005)
+        time.sleep(0.1)
+    finally:
+        stop.set()
+        walker.exit()
+        watcher.exit()
+        relay.stop()
+        proc.kill()
+
+    regressions = sum(1 for a, b in zip(seen, seen[1:]) if b < a)
+    print(f"loss {args.loss:.0%}, jitter up to {args.jitter * 1000:.0f} ms, {args.steps} steps at {args.fps:.0f} fps")
+    print(f"  relay:   {relay.sent} datagrams, {relay.dropped} dropped, {relay.reordered} delivered out of order")
+    print(f"  server:  {len(seen)} distinct positions seen, {regressions} went backwards, last x = {seen[-1] if seen else None}")
+    if converged is None:
+        print("  watcher: did not converge within 5 s")
+    else:
+        print(f"  watcher: had the final position {converged * 1000:.0f} ms after the walker stopped")
+
+    ok = regressions == 0 and seen and seen[-1] == final and converged is not None
+    print("OK" if ok else "FAILED")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
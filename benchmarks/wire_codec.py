@@ -0,0 +1,109 @@
+"""
+Encode/decode micro-benchmark, JSON against server/binaryProtocol.py
+
+Covers both directions: one client update (client -> server) and a full
+delta of N players (server -> client), including the client-side work of
+turning the reply back into player dicts.
+
+Usage:
+    python benchmarks/wire_codec.py --players 500
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from server import binaryProtocol
+
+MAPS = ["map.tmx", "gym.tmx"]
+
+
+def make_players(n: int) -> dict[int, dict]:
+    return {
+        i: {
+            "id": i,
+            "x": 64.0 * (i % 100) + 0.5,
+            "y": 64.0 * (i // 100) + 0.25,
+            "map": MAPS[i % 2],
+            "direction": binaryProtocol.DIRECTIONS[i % 4],
+            "moving": bool(i % 3),
+            "vx": 256.0 if i % 3 else 0.0,
+            "vy": 0.0,
+        }
+        for i in range(n)
+    }
+
+
+def bench(fn, number: int) -> float:
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--players", type=int, default=500)
+    args = parser.parse_args()
+
+    map_ids = {name: i for i, name in enumerate(MAPS)}
+    players = make_players(args.players)
+    delta = {"version": 1234, "full": True, "players": players, "removed": []}
+
+    # Client -> server, one update
+    update = {
+        "id": 7, "x": 1234.5, "y": 678.25, "map": "map.tmx", "direction": "left", "moving": True,
+        "vx": -256.0, "vy": 0.0,
+    }
+    record = (7, 1234.5, 678.25, 0, binaryProtocol.pack_flags("left", True), -256, 0)
+    json_update = json.dumps(update).encode("utf-8")
+    bin_update = binaryProtocol.encode_update(record)
+
+    # Server -> client, the whole map
+    def encode_json() -> bytes:
+        return json.dumps(delta).encode("utf-8")
+
+    def encode_bin() -> bytes:
+        records = [
+            (
+                p["id"], p["x"], p["y"], map_ids[p["map"]], binaryProtocol.pack_flags(p["direction"], p["moving"]),
+                *binaryProtocol.pack_velocity(p["vx"], p["vy"]),
+            )
+            for p in players.values()
+        ]
+        return binaryProtocol.encode_delta(1234, True, records, [])
+
+    json_delta = encode_json()
+    bin_delta = encode_bin()
+
+    def decode_json() -> dict:
+        data = json.loads(json_delta)
+        return {int(k): p for k, p in data["players"].items()}
+
+    def decode_bin() -> dict:
+        _, _, records, _ = binaryProtocol.decode_delta(bin_delta)
+        out = {}
+        for pid, x, y, map_id, flags, vx, vy in records:
+            direction, moving = binaryProtocol.unpack_flags(flags)
+            out[pid] = {
+                "id": pid, "x": x, "y": y, "map": MAPS[map_id], "direction": direction, "moving": moving,
+                "vx": vx, "vy": vy,
+            }
+        return out
+
+    rows = [
+        ("update encode", lambda: json.dumps(update).encode("utf-8"), lambda: binaryProtocol.encode_update(record), 20000),
+        ("update decode", lambda: json.loads(json_update), lambda: binaryProtocol.decode_update(bin_update), 20000),
+        (f"delta encode ({args.players})", encode_json, encode_bin, 50),
+        (f"delta decode ({args.players})", decode_json, decode_bin, 50),
+    ]
+    print(f"update size: json {len(json_update)} B, binary {len(bin_update)} B")
+    print(f"delta size:  json {len(json_delta)} B, binary {len(bin_delta)} B")
+    for name, json_fn, bin_fn, number in rows:
+        j = bench(json_fn, number)
+        b = bench(bin_fn, number)
+        print(f"{name:>20}: json {j:9.2f} us  binary {b:9.2f} us  ({j / b:4.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,75 +1,394 @@
-from server.playerHandler import PlayerHandler
+from server.playerHandler import MapTableFull, PlayerHandler, TICK_RATE
+from server.persistence import Journal
+from server.sharedPlayerTable import SharedPlayerHandler, DEFAULT_CAPACITY
+from server.streamServer import StreamServer, STREAM_PORT
+from server.udpServer import UdpServer, UDP_PORT
+from server import binaryProtocol, metrics
 
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from http.server import BaseHTTPRequestHandler, HTTPServer, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+import argparse
 import json
+import os
+import signal
+import threading
+import time
 PORT = 8989
 
 PLAYER_HANDLER = PlayerHandler()
 PLAYER_HANDLER.start()
-    
+
+# Unknown paths share one label, so a scanner cannot grow the metrics without bound
+ROUTES = ("/", "/register", "/maps", "/players", "/players/near", "/sync", "/metrics")
+# Same for the method, the request line can say anything
+METHODS = ("GET", "HEAD", "POST", "PUT", "DELETE", "OPTIONS", "PATCH")
+HTTP_REQUESTS = metrics.Counter("http_requests_total", "HTTP requests served", ("route", "method", "code"))
+HTTP_LATENCY = metrics.Histogram("http_request_duration_seconds", "Time to handle a request", ("route",))
+HTTP_BYTES_IN = metrics.Counter("http_request_bytes_total", "Request body bytes received", ("route",))
+HTTP_BYTES_OUT = metrics.Counter("http_response_bytes_total", "Response body bytes sent", ("route",))
+# Requests handled at once past which replies carry X-Server-Busy, telling clients to poll less often
+BUSY_REQUESTS = 32
+
 class Handler(BaseHTTPRequestHandler):
-    # def log_message(self, fmt, *args):
-    #     return
+    # HTTP/1.1 keeps the connection open between polls, every response
+    # below sends a Content-Length so the client knows where it ends.
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes, without this the body
+    # waits on the client's delayed ACK on a kept-alive connection
+    disable_nagle_algorithm = True
+    quiet = False
+    busy_requests = BUSY_REQUESTS
+    # Requests between their request line and their reply, idle keep-alive connections do not count
+    in_flight = 0
+    _in_flight_lock = threading.Lock()
+
+    def log_message(self, fmt, *args):
+        if self.quiet:
+            return
+        super().log_message(fmt, *args)
+
+    def handle_one_request(self):
+        self._started = time.perf_counter()
+        self._code = 0
+        self._counted = False
+        try:
+            super().handle_one_request()
+        finally:
+            if self._counted:
+                with Handler._in_flight_lock:
+                    Handler.in_flight -= 1
+        if self._code:
+            route = self._route()
+            HTTP_REQUESTS.inc(route, self._method(), str(self._code))
+            HTTP_LATENCY.observe(time.perf_counter() - self._started, route)
+
+    def parse_request(self):
+        if not super().parse_request():
+            return False
+        with Handler._in_flight_lock:
+            Handler.in_flight += 1
+        self._counted = True
+        return True
+
+    def send_response(self, code, message=None):
+        self._code = code
+        super().send_response(code, message)
+        if Handler.in_flight > self.busy_requests:
+            self.send_header("X-Server-Busy", str(Handler.in_flight))
+
+    def _route(self) -> str:
+        # path is unset when the request line itself was malformed
+        path = urlsplit(getattr(self, "path", "")).path
+        return path if path in ROUTES else "other"
+
+    def _method(self) -> str:
+        # command is unset when the request line itself was malformed
+        command = getattr(self, "command", None) or ""
+        return command if command in METHODS else "other"
 
     def do_GET(self):
-        if self.path == "/":
+        url = urlsplit(self.path)
+        path = url.path
+        query = parse_qs(url.query)
+
+        if path == "/":
             self._json(200, {"status": "ok"})
             return
             
-        if self.path == "/register":
+        if path == "/register":
             pid = PLAYER_HANDLER.register()
+            if pid < 0:
+                self._json(503, {"error": "server_full"})
+                return
             self._json(200, {"message": "registration successful", "id": pid})
             return
 
-        if self.path == "/players":
-            self._json(200, {"players": PLAYER_HANDLER.list_players()})
+        if path == "/maps":
+            # Map table of the binary protocol, JSON updates add new maps to it
+            self._json(200, {"maps": list(PLAYER_HANDLER.map_names)})
+            return
+
+        if path == "/players":
+            # ?map= only returns the players on that map
+            map_name = query["map"][0] if "map" in query else None
+            if "since" not in query:
+                binary = self._accepts_binary()
+                body = PLAYER_HANDLER.encoded_snapshot(map_name, binary).body
+                self._send(200, body, binaryProtocol.CONTENT_TYPE if binary else "application/json")
+                return
+            self._players_delta(query, map_name)
+            return
+
+        if path == "/players/near":
+            # Players on ?map= within ?r= pixels of (?x=, ?y=)
+            try:
+                map_name = query["map"][0]
+                x, y, r = (float(query[k][0]) for k in ("x", "y", "r"))
+                if not binaryProtocol.in_world(x, y) or not binaryProtocol.finite(r) or r < 0:
+                    raise ValueError("not a position and radius")
+            except (KeyError, ValueError):
+                self._json(400, {"error": "bad_fields", "expected": ["map", "x", "y", "r"]})
+                return
+            version, players = PLAYER_HANDLER.near(map_name, x, y, r)
+            self._json(200, {"players": players, "version": version})
+            return
+
+        if path == "/metrics":
+            body = metrics.render([
+                HTTP_REQUESTS, HTTP_LATENCY, HTTP_BYTES_IN, HTTP_BYTES_OUT, HTTP_IN_FLIGHT,
+                *PLAYER_HANDLER.exported_metrics(),
+            ])
+            self._send(200, body, metrics.CONTENT_TYPE)
             return
 
         self._json(404, {"error": "not_found"})
 
     def do_POST(self):
-        if self.path != "/players":
+        # Always consume the body, otherwise it is parsed as the next
+        # request on a keep-alive connection
+        length = int(self.headers.get("Content-Length", "0"))
+        body = self.rfile.read(length)
+        HTTP_BYTES_IN.inc(self._route(), amount=len(body))
+
+        url = urlsplit(self.path)
+        if url.path not in ("/players", "/sync"):
             self._json(404, {"error": "not_found"})
             return
 
-        length = int(self.headers.get("Content-Length", "0"))
+        if self.headers.get("Content-Type", "") == binaryProtocol.CONTENT_TYPE:
+            update = self._parse_binary(body)
+        else:
+            update = self._parse_json(body)
+        if update is None:
+            return
+
+        try:
+            ok = PLAYER_HANDLER.update(*update)
+        except MapTableFull:
+            # Not the player's fault, registering again would not help
+            self._json(400, {"error": "map_table_full"})
+            return
+        if not ok:
+            self._json(404, {"error": "player_not_found"})
+            return
+
+        if url.path == "/sync":
+            # Update and fetch in one round trip, replies like GET /players?since=
+            # for the map the player is now on
+            self._players_delta(parse_qs(url.query), update[3])
+            return
+
+        self._json(200, {"success": True})
+
+    def _parse_json(self, body: bytes) -> tuple | None:
         try:
-            body = self.rfile.read(length)
             data = json.loads(body.decode("utf-8"))
         except Exception:
             self._json(400, {"error": "invalid_json"})
-            return
+            return None
 
         missing = [k for k in ("id", "x", "y", "map") if k not in data]
         if missing:
             self._json(400, {"error": "bad_fields", "missing": missing})
-            return
+            return None
 
         try:
             pid = int(data["id"])
             x = float(data["x"])
             y = float(data["y"])
             map_name = str(data["map"])
+            direction = data.get("direction")
+            moving = bool(data["moving"]) if "moving" in data else None
+            velocity = (float(data["vx"]), float(data["vy"])) if "vx" in data and "vy" in data else None
         except (ValueError, TypeError):
             self._json(400, {"error": "bad_fields"})
-            return
+            return None
+        if not binaryProtocol.in_world(x, y) or not binaryProtocol.finite(*(velocity or ())):
+            self._json(400, {"error": "bad_fields"})
+            return None
+        if not binaryProtocol.valid_map_name(map_name):
+            self._json(400, {"error": "bad_fields"})
+            return None
+        if direction is not None and direction not in binaryProtocol.DIRECTIONS:
+            self._json(400, {"error": "bad_fields"})
+            return None
+        return pid, x, y, map_name, direction, moving, velocity
 
-        ok = PLAYER_HANDLER.update(pid, x, y, map_name)
-        if not ok:
-            self._json(404, {"error": "player_not_found"})
+    def _parse_binary(self, body: bytes) -> tuple | None:
+        try:
+            pid, x, y, map_id, flags, vx, vy = binaryProtocol.decode_update(body)
+            map_name = PLAYER_HANDLER.map_names[map_id]
+        except (ValueError, IndexError):
+            self._json(400, {"error": "bad_fields"})
+            return None
+        if not binaryProtocol.in_world(x, y):
+            # float32 carries NaN, infinities and huge values too
+            self._json(400, {"error": "bad_fields"})
+            return None
+        direction, moving = binaryProtocol.unpack_flags(flags)
+        return pid, x, y, map_name, direction, moving, (vx, vy)
+
+    def _accepts_binary(self) -> bool:
+        return binaryProtocol.CONTENT_TYPE in self.headers.get("Accept", "")
+
+    def _players_delta(self, query: dict, map_name: str | None) -> None:
+        try:
+            since = int(query["since"][0]) if "since" in query else -1
+        except ValueError:
+            self._json(400, {"error": "bad_since"})
+            return
+        binary = self._accepts_binary()
+        body = PLAYER_HANDLER.encoded_delta(since, map_name, binary)
+        if body is None:
+            self._not_modified()
             return
+        self._send(200, body, binaryProtocol.CONTENT_TYPE if binary else "application/json")
 
-        self._json(200, {"success": True})
+    def _not_modified(self) -> None:
+        self.send_response(304)
+        self.end_headers()
 
     # Utility for JSON responses
     def _json(self, code: int, obj: object) -> None:
-        data = json.dumps(obj).encode("utf-8")
+        self._send(code, json.dumps(obj).encode("utf-8"))
+
+    def _send(self, code: int, data: bytes, content_type: str = "application/json") -> None:
         self.send_response(code)
-        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Type", content_type)
         self.send_header("Content-Length", str(len(data)))
         self.end_headers()
         self.wfile.write(data)
+        HTTP_BYTES_OUT.inc(self._route(), amount=len(data))
+
+
+HTTP_IN_FLIGHT = metrics.Gauge(
+    "http_requests_in_flight", "Requests being handled right now", (), lambda: {(): Handler.in_flight},
+)
+
+
+class LegacyHandler(Handler):
+    # One connection per request, kept for benchmarking against the old server
+    protocol_version = "HTTP/1.0"
+
+
+class ThreadedServer(ThreadingHTTPServer):
+    # Each connection gets its own thread, so a slow or idle keep-alive
+    # client never blocks the others
+    request_queue_size = 128
+
+
+def serve_workers(server: ThreadedServer, workers: int) -> list[int]:
+    """
+    Fork worker processes that all accept on the already bound socket of
+    server, each with its own threads and GIL. Returns their pids.
+    """
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                os._exit(0)
+        children.append(pid)
+    return children
+
 
 if __name__ == "__main__":
-    print(f"[Server] Running on localhost with port {PORT}")
-    HTTPServer(("0.0.0.0", PORT), Handler).serve_forever()
+    parser = argparse.ArgumentParser(description="Monster Go online server")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--legacy", action="store_true",
+                        help="single-threaded HTTP/1.0 server, one request at a time")
+    parser.add_argument("--quiet", action="store_true", help="disable request logging")
+    parser.add_argument("--stream-port", type=int, default=STREAM_PORT,
+                        help="port of the push-based state stream, 0 to disable")
+    parser.add_argument("--udp-port", type=int, default=UDP_PORT,
+                        help="port of the UDP channel for position updates, 0 to disable")
+    parser.add_argument("--tick-rate", type=float, default=None,
+                        help=f"world ticks per second, updates are applied on the tick (default {TICK_RATE:g}, "
+                             "0 applies them at once, not available with --workers)")
+    parser.add_argument("--store", choices=("dict", "array"), default="dict",
+                        help="player storage, array keeps them in NumPy arrays for thousands of players")
+    parser.add_argument("--data-dir", default=None,
+                        help="keep players in this directory across restarts (log + snapshots)")
+    parser.add_argument("--busy-requests", type=int, default=BUSY_REQUESTS,
+                        help="requests in flight past which replies ask clients to back off")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="HTTP worker processes sharing one player table in shared memory")
+    parser.add_argument("--capacity", type=int, default=DEFAULT_CAPACITY,
+                        help="player ids the shared table holds, with --workers")
+    args = parser.parse_args()
+
+    Handler.quiet = args.quiet
+    Handler.busy_requests = args.busy_requests
+    workers = []
+    if args.workers > 1:
+        if args.legacy or not hasattr(os, "fork"):
+            parser.error("--workers needs the threaded server on a system with fork()")
+        if args.tick_rate or args.store != "dict" or args.data_dir:
+            parser.error("--tick-rate, --store and --data-dir are not available with --workers")
+        # Every worker must see the same players, swap in the shared table before forking
+        PLAYER_HANDLER.stop()
+        PLAYER_HANDLER = SharedPlayerHandler(args.capacity)
+        server = ThreadedServer(("0.0.0.0", args.port), Handler)
+        workers = serve_workers(server, args.workers)
+        # Threads do not survive fork, start the parent's only after it
+        PLAYER_HANDLER.start()
+        print(f"[Server] Forked {args.workers} workers: {workers}")
+    elif args.legacy:
+        server = HTTPServer(("0.0.0.0", args.port), LegacyHandler)
+    else:
+        server = ThreadedServer(("0.0.0.0", args.port), Handler)
+
+    if not workers and args.store == "array":
+        if args.tick_rate or args.data_dir:
+            parser.error("--tick-rate and --data-dir are not available with --store array")
+        try:
+            # NumPy is only needed for this store
+            from server.arrayPlayerTable import ArrayPlayerHandler
+        except ImportError:
+            parser.error("--store array needs numpy, pip install numpy")
+        PLAYER_HANDLER.stop()
+        PLAYER_HANDLER = ArrayPlayerHandler()
+        PLAYER_HANDLER.start()
+    elif not workers:
+        PLAYER_HANDLER.tick_rate = TICK_RATE if args.tick_rate is None else args.tick_rate
+        if args.data_dir:
+            restored = PLAYER_HANDLER.attach_journal(Journal(args.data_dir))
+            print(f"[Server] Restored {restored} players from {args.data_dir}")
+        PLAYER_HANDLER.start()
+
+    if args.stream_port:
+        # A ping counts as one more request, so --busy-requests means the same on both channels
+        stream = StreamServer(
+            ("0.0.0.0", args.stream_port), PLAYER_HANDLER,
+            busy=lambda: Handler.in_flight >= Handler.busy_requests,
+        )
+        stream.start()
+        threading.Thread(target=stream.serve_forever, name="StreamServer", daemon=True).start()
+        print(f"[Server] Streaming state on port {args.stream_port}")
+
+    if args.udp_port:
+        udp = UdpServer(("0.0.0.0", args.udp_port), PLAYER_HANDLER)
+        threading.Thread(target=udp.serve_forever, name="UdpServer", daemon=True).start()
+        print(f"[Server] UDP updates on port {args.udp_port}")
+
+    print(f"[Server] Running on localhost with port {args.port}")
+    if not workers:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            # Writes out whatever the journal still has queued
+            PLAYER_HANDLER.stop()
+    else:
+        # The parent only runs the cleaner and the stream, the workers serve HTTP
+        try:
+            for pid in workers:
+                os.waitpid(pid, 0)
+        except KeyboardInterrupt:
+            for pid in workers:
+                os.kill(pid, signal.SIGTERM)
@@ -0,0 +1,335 @@
+"""
+Player store backed by NumPy arrays, a drop-in for PlayerHandler meant
+for thousands of players (server.py --store array). NumPy is optional,
+only this module needs it.
+
+Each player is a row. The wire columns form one structured array laid
+out exactly like binaryProtocol.RECORD, so a binary snapshot is a slice
+of it copied out with tobytes(). Timeouts, per-map filters and deltas
+are whole-column operations instead of Python loops. Rows of removed
+players go on a free list and are handed out again, but ids are never
+reused, so a client that was expired cannot write into someone else's
+row. Like PlayerHandler's indexes, the world and each map keep the ids
+that left them, so a delta only has to look at its own departures.
+
+Positions are kept at the float32 precision of the binary protocol.
+"""
+import threading
+import time
+from typing import Dict
+
+import numpy as np
+
+from server import binaryProtocol, metrics
+from server.playerHandler import (
+    CHECK_INTERVAL_TIME, MAX_TOMBSTONES, TIMEOUT_TIME,
+    Cleaner, Delta, MapTableFull, ReplyCache, Snapshot, encode_delta, encode_snapshot,
+)
+
+INITIAL_CAPACITY = 1024
+
+# Same bytes as binaryProtocol.RECORD
+WIRE = np.dtype([
+    ("id", "<u4"), ("x", "<f4"), ("y", "<f4"), ("map", "<u2"), ("flags", "u1"), ("vx", "<i2"), ("vy", "<i2"),
+])
+assert WIRE.itemsize == binaryProtocol.RECORD.size
+
+
+class ArrayPlayerHandler:
+    timeout_seconds: float
+    cleaner: Cleaner
+    # Updates are applied at once, there is no tick
+    tick_rate: float
+    _lock: threading.Lock
+
+    # One row per player, the id column says whose. Rows past _count were never handed out
+    _wire: np.ndarray
+    _used: np.ndarray
+    # World version of the row's last change
+    _changed: np.ndarray
+    _last_update: np.ndarray
+    _count: int
+    # Rows of removed players, handed out again
+    _free: list[int]
+    # pid -> row of every registered player
+    _rows: Dict[int, int]
+    _next_id: int
+    version: int
+    # Append-only map name table, the map column indexes it
+    map_names: list[str]
+    _map_ids: Dict[str, int]
+    # map id -> version of the last change on it, players arriving, moving or leaving
+    _map_versions: Dict[int, int]
+    # map id (None for the world) -> {pid: version it left at}, oldest first,
+    # and the version of the newest one dropped
+    _departed: Dict[int | None, Dict[int, int]]
+    _departed_floor: Dict[int | None, int]
+    _replies: ReplyCache
+
+    def __init__(
+        self, capacity: int = INITIAL_CAPACITY, *,
+        timeout_seconds: float = TIMEOUT_TIME, check_interval_seconds: float = CHECK_INTERVAL_TIME,
+    ):
+        self.timeout_seconds = timeout_seconds
+        self.cleaner = Cleaner(self.expire, check_interval_seconds)
+        self.tick_rate = 0.0
+        self._lock = threading.Lock()
+
+        self._wire = np.zeros(capacity, WIRE)
+        self._used = np.zeros(capacity, np.bool_)
+        self._changed = np.zeros(capacity, np.int64)
+        self._last_update = np.zeros(capacity, np.float64)
+        self._count = 0
+        self._free = []
+        self._rows = {}
+        self._next_id = 0
+        self.version = 0
+        self.map_names = []
+        self._map_ids = {}
+        self._map_versions = {}
+        self._departed = {}
+        self._departed_floor = {}
+        self._replies = ReplyCache(lambda: self.version)
+
+    # Threading
+    def start(self) -> None:
+        self.cleaner.start()
+
+    def stop(self) -> None:
+        self.cleaner.stop()
+
+    def expire(self, now: float) -> list[int]:
+        """Remove players idle for timeout_seconds, in one sweep over the column"""
+        with self._lock:
+            start = time.perf_counter()
+            n = self._count
+            idle = np.flatnonzero(self._used[:n] & (self._last_update[:n] <= now - self.timeout_seconds))
+            pids = self._wire["id"][idle].tolist()
+            if pids:
+                self.version += 1
+                self._used[idle] = False
+                self._changed[idle] = self.version
+                self._free.extend(idle.tolist())
+                for pid, map_id in zip(pids, self._wire["map"][idle].tolist()):
+                    del self._rows[pid]
+                    self._depart(pid, map_id)
+                    self._depart(pid, None)
+            hold = time.perf_counter() - start
+
+        self.cleaner.record(len(pids), hold)
+        return pids
+
+    # Map table
+    def _intern_map(self, map_name: str) -> int:
+        map_id = self._map_ids.get(map_name)
+        if map_id is None:
+            if len(self.map_names) >= binaryProtocol.NO_MAP:
+                return binaryProtocol.NO_MAP
+            map_id = len(self.map_names)
+            # Append before publishing the id, lock-free readers never see a dangling index
+            self.map_names.append(map_name)
+            self._map_ids[map_name] = map_id
+        return map_id
+
+    def _arrive(self, pid: int, map_id: int | None) -> None:
+        # Caller holds the lock and has bumped the version
+        departed = self._departed.get(map_id)
+        if departed:
+            departed.pop(pid, None)
+        self._map_versions[map_id] = self.version
+
+    def _depart(self, pid: int, map_id: int | None) -> None:
+        departed = self._departed.setdefault(map_id, {})
+        departed.pop(pid, None)
+        departed[pid] = self.version
+        self._map_versions[map_id] = self.version
+        if len(departed) > MAX_TOMBSTONES:
+            self._departed_floor[map_id] = departed.pop(next(iter(departed)))
+
+    # API
+    def _grow(self) -> None:
+        capacity = len(self._wire) * 2
+        for name in ("_wire", "_used", "_changed", "_last_update"):
+            old = getattr(self, name)
+            new = np.zeros(capacity, old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def register(self) -> int:
+        with self._lock:
+            if self._free:
+                row = self._free.pop()
+            else:
+                if self._count == len(self._wire):
+                    self._grow()
+                row = self._count
+                self._count += 1
+            pid = self._next_id
+            self._next_id += 1
+            self._rows[pid] = row
+            self.version += 1
+            map_id = self._intern_map("")
+            self._wire[row] = (pid, 0.0, 0.0, map_id, 0, 0, 0)
+            self._used[row] = True
+            self._changed[row] = self.version
+            self._last_update[row] = time.monotonic()
+            self._arrive(pid, map_id)
+            return pid
+
+    def update(
+        self, pid: int, x: float, y: float, map_name: str,
+        direction: str | None = None, moving: bool | None = None,
+        velocity: tuple[float, float] | None = None,
+    ) -> bool:
+        """Same as PlayerHandler.update, but raises MapTableFull for a map the table cannot hold"""
+        with self._lock:
+            row = self._rows.get(pid)
+            if row is None:
+                return False
+            map_id = self._intern_map(str(map_name))
+            if map_id == binaryProtocol.NO_MAP:
+                raise MapTableFull(map_name)
+            record = self._wire[row]
+            old_direction, old_moving = binaryProtocol.unpack_flags(int(record["flags"]))
+            flags = binaryProtocol.pack_flags(
+                old_direction if direction is None else direction,
+                old_moving if moving is None else moving,
+            )
+            vx, vy = (record["vx"], record["vy"]) if velocity is None else binaryProtocol.pack_velocity(*velocity)
+            new = (pid, x, y, map_id, flags, vx, vy)
+            if self._wire[row:row + 1].tobytes() != np.array([new], WIRE).tobytes():
+                self.version += 1
+                old_map = int(record["map"])
+                self._wire[row] = new
+                self._changed[row] = self.version
+                self._last_update[row] = time.monotonic()
+                if old_map != map_id:
+                    self._depart(pid, old_map)
+                self._arrive(pid, map_id)
+            return True
+
+    def _select(self, map_name: str | None, since: int) -> tuple[int, bool, np.ndarray, np.ndarray] | None:
+        """
+        The world version, whether the reply is a full snapshot, the wire
+        rows of players on map_name changed after since, and the ids that
+        left it after since. Full when since is -1, or older than the
+        departures kept. None when nothing on map_name changed after since.
+        """
+        with self._lock:
+            version = self.version
+            n = self._count
+            used = self._used[:n]
+            if map_name is None:
+                map_id = None
+                full = not self._departed_floor.get(None, 0) <= since <= version
+                if since == version:
+                    return None
+                here = used
+            else:
+                map_id = self._map_ids.get(map_name, -1)
+                full = not self._departed_floor.get(map_id, 0) <= since <= version
+                if not full and self._map_versions.get(map_id, 0) <= since:
+                    return None
+                here = used & (self._wire["map"][:n] == map_id)
+            # Fancy indexing copies, so encoding happens outside the lock
+            if full:
+                return version, True, self._wire[:n][here], np.empty(0, np.int64)
+            changed = self._changed[:n] > since
+            rows = self._wire[:n][here & changed]
+            left = []
+            for pid, left_at in reversed(self._departed.get(map_id, {}).items()):
+                if left_at <= since:
+                    break
+                left.append(pid)
+            return version, False, rows, np.array(left, np.int64)
+
+    def _players(self, rows: np.ndarray) -> dict:
+        names = self.map_names
+        players = {}
+        for pid, x, y, map_id, flags, vx, vy in zip(
+            rows["id"].tolist(), rows["x"].tolist(), rows["y"].tolist(),
+            rows["map"].tolist(), rows["flags"].tolist(), rows["vx"].tolist(), rows["vy"].tolist(),
+        ):
+            direction, moving = binaryProtocol.unpack_flags(flags)
+            players[pid] = {
+                "id": pid, "x": x, "y": y, "map": names[map_id],
+                "direction": direction, "moving": moving, "vx": vx, "vy": vy,
+            }
+        return players
+
+    def list_players(self, map_name: str | None = None) -> dict:
+        return self.snapshot(map_name)[1]
+
+    def snapshot(self, map_name: str | None = None) -> tuple[int, dict]:
+        version, _, rows, _ = self._select(map_name, -1)
+        return version, self._players(rows)
+
+    def near(self, map_name: str, x: float, y: float, r: float) -> tuple[int, dict]:
+        """Same as PlayerHandler.near, as one distance computation over the columns"""
+        with self._lock:
+            wire = self._wire[:self._count]
+            dx = wire["x"].astype(np.float64) - x
+            dy = wire["y"].astype(np.float64) - y
+            here = self._used[:self._count] & (wire["map"] == self._map_ids.get(map_name, -1))
+            rows = wire[here & (dx * dx + dy * dy <= r * r)]
+            version = self.version
+        return version, self._players(rows)
+
+    def delta(self, since: int, map_name: str | None = None) -> Delta | None:
+        """Like PlayerHandler.delta, but every call filters the whole table"""
+        selected = self._select(map_name, since)
+        if selected is None:
+            return None
+        version, full, rows, removed = selected
+        return Delta(version, full, self._players(rows), removed.tolist())
+
+    def count_by_map(self) -> dict[str, int]:
+        with self._lock:
+            n = self._count
+            counts = np.bincount(self._wire["map"][:n][self._used[:n]], minlength=len(self.map_names))
+        return {self.map_names[i]: int(c) for i, c in enumerate(counts) if c}
+
+    def exported_metrics(self) -> list:
+        """Everything exported on GET /metrics"""
+        return [
+            metrics.Gauge(
+                "players_active", "Registered players per map", ("map",),
+                lambda: {(name,): n for name, n in self.count_by_map().items()},
+            ),
+            metrics.Gauge(
+                "player_world_version", "Version of the last change to the world", (),
+                lambda: {(): self.version},
+            ),
+            self.cleaner.pass_seconds,
+        ]
+
+    # Encoded replies, cached for the current world version
+    def _encode(self, version: int, full: bool, rows: np.ndarray, removed: np.ndarray, binary: bool) -> bytes:
+        if binary:
+            # The rows already are binaryProtocol records
+            header = binaryProtocol.HEADER.pack(version, full, len(rows), len(removed))
+            return header + rows.tobytes() + removed.astype("<u4").tobytes()
+        return encode_delta(Delta(version, full, self._players(rows), removed.tolist()), self._map_ids, False)
+
+    def encoded_snapshot(self, map_name: str | None = None, binary: bool = False) -> Snapshot:
+        return self._replies.get(("snapshot", map_name, binary), self._encode_snapshot)
+
+    def _encode_snapshot(self, key: tuple) -> Snapshot:
+        _, map_name, binary = key
+        version, _, rows, removed = self._select(map_name, -1)
+        if binary:
+            return Snapshot(version, self._encode(version, True, rows, removed, True))
+        return Snapshot(version, encode_snapshot(version, self._players(rows), self._map_ids, False))
+
+    def encoded_delta(self, since: int, map_name: str | None = None, binary: bool = False) -> bytes | None:
+        if since == self.version:
+            return None
+        return self._replies.get((map_name, since, binary), self._encode_delta)
+
+    def _encode_delta(self, key: tuple) -> bytes | None:
+        map_name, since, binary = key
+        selected = self._select(map_name, since)
+        if selected is None:
+            return None
+        version, full, rows, removed = selected
+        return self._encode(version, full, rows, removed, binary)
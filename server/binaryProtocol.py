@@ -0,0 +1,146 @@
+"""
+Compact binary encoding of player state, an alternative to JSON picked by
+content negotiation: POST /players with Content-Type: CONTENT_TYPE, and
+GET /players with Accept: CONTENT_TYPE.
+
+Maps travel as uint16 indexes into the table served by GET /maps. A map
+enters the table with the first JSON update that names it, so a client
+sends that one as JSON and fetches the table again.
+Everything is little endian.
+
+    record  = id u32, x f32, y f32, map index u16, flags u8, vx i16, vy i16
+    flags   = direction in bits 0-1 (see DIRECTIONS), moving in bit 2
+    vx, vy  = velocity in whole pixels per second, for dead reckoning
+    update  = one record                       (client -> server)
+    delta   = version i64, full u8, n u32, m u32,
+              n records, m removed ids u32     (server -> client)
+
+Over UDP every datagram starts with kind u8 and seq u32. seq counts the
+client's datagrams, and the server echoes it in its reply.
+
+    UPDATE    = ack i64, record   the state, ack = version the client has
+    DELTA     = delta             the changes on its map since ack
+    UNCHANGED = nothing           nothing changed since ack
+    RESYNC    = nothing           the delta does not fit, fetch it over HTTP
+    NOT_FOUND = nothing           the id is not registered, register again
+"""
+import math
+import re
+import struct
+
+CONTENT_TYPE = "application/x-monster-go"
+
+DIRECTIONS = ("down", "left", "right", "up")
+MOVING_FLAG = 0x04
+# Index of a map that did not fit in the table
+NO_MAP = 0xFFFF
+# Pixels from the origin a position may be, far past any map. float32 still
+# holds whole pixels out there, so every accepted position can be encoded.
+MAX_COORDINATE = float(1 << 24)
+# Map names clients may report, a .tmx path relative to assets/maps
+MAP_NAME = re.compile(r"[A-Za-z0-9_][A-Za-z0-9_./-]*\.tmx")
+MAX_MAP_NAME = 64
+
+RECORD = struct.Struct("<IffHBhh")
+HEADER = struct.Struct("<qBII")
+REMOVED = struct.Struct("<I")
+
+DATAGRAM = struct.Struct("<BI")
+ACK = struct.Struct("<q")
+UPDATE, DELTA, UNCHANGED, RESYNC, NOT_FOUND = range(1, 6)
+# Stays below the usual path MTU, so a datagram is never fragmented
+MAX_DATAGRAM = 1200
+
+Record = tuple[int, float, float, int, int, int, int]
+
+
+def finite(*values: float) -> bool:
+    """False if any value is NaN or infinite, which no velocity or radius can be"""
+    return all(math.isfinite(v) for v in values)
+
+
+def in_world(*values: float) -> bool:
+    """False if any coordinate is NaN or further out than MAX_COORDINATE"""
+    return all(-MAX_COORDINATE <= v <= MAX_COORDINATE for v in values)
+
+
+def valid_map_name(name: str) -> bool:
+    """False for anything that is not a short .tmx path, which could only fill the map table"""
+    return len(name) <= MAX_MAP_NAME and MAP_NAME.fullmatch(name) is not None
+
+
+def pack_flags(direction: str, moving: bool) -> int:
+    flags = DIRECTIONS.index(direction) if direction in DIRECTIONS else 0
+    if moving:
+        flags |= MOVING_FLAG
+    return flags
+
+
+def unpack_flags(flags: int) -> tuple[str, bool]:
+    return DIRECTIONS[flags & 0x03], bool(flags & MOVING_FLAG)
+
+
+def pack_velocity(vx: float, vy: float) -> tuple[int, int]:
+    return (max(-0x8000, min(0x7FFF, round(vx))), max(-0x8000, min(0x7FFF, round(vy))))
+
+
+def encode_update(record: Record) -> bytes:
+    return RECORD.pack(*record)
+
+
+def decode_update(data: bytes) -> Record:
+    if len(data) != RECORD.size:
+        raise ValueError(f"expected {RECORD.size} bytes, got {len(data)}")
+    return RECORD.unpack(data)
+
+
+def encode_delta(version: int, full: bool, records: list[Record], removed: list[int]) -> bytes:
+    out = bytearray(HEADER.size + RECORD.size * len(records) + REMOVED.size * len(removed))
+    HEADER.pack_into(out, 0, version, full, len(records), len(removed))
+    offset = HEADER.size
+    for record in records:
+        RECORD.pack_into(out, offset, *record)
+        offset += RECORD.size
+    for pid in removed:
+        REMOVED.pack_into(out, offset, pid)
+        offset += REMOVED.size
+    return bytes(out)
+
+
+def decode_delta(data: bytes) -> tuple[int, bool, list[Record], list[int]]:
+    version, full, n, m = HEADER.unpack_from(data, 0)
+    start = HEADER.size
+    end = start + RECORD.size * n
+    if len(data) != end + REMOVED.size * m:
+        raise ValueError("truncated delta")
+    view = memoryview(data)
+    records = list(RECORD.iter_unpack(view[start:end]))
+    removed = [pid for (pid,) in REMOVED.iter_unpack(view[end:])]
+    return version, bool(full), records, removed
+
+
+def seq_newer(seq: int, last: int) -> bool:
+    """seq came after last, allowing the u32 counter to wrap"""
+    return 0 < (seq - last) & 0xFFFFFFFF < 0x80000000
+
+
+def encode_datagram(kind: int, seq: int, payload: bytes = b"") -> bytes:
+    return DATAGRAM.pack(kind, seq & 0xFFFFFFFF) + payload
+
+
+def decode_datagram(data: bytes) -> tuple[int, int, bytes]:
+    if len(data) < DATAGRAM.size:
+        raise ValueError("truncated datagram")
+    kind, seq = DATAGRAM.unpack_from(data, 0)
+    return kind, seq, data[DATAGRAM.size:]
+
+
+def encode_udp_update(seq: int, ack: int, record: Record) -> bytes:
+    return encode_datagram(UPDATE, seq, ACK.pack(ack) + RECORD.pack(*record))
+
+
+def decode_udp_update(payload: bytes) -> tuple[int, Record]:
+    if len(payload) != ACK.size + RECORD.size:
+        raise ValueError(f"expected {ACK.size + RECORD.size} bytes, got {len(payload)}")
+    (ack,) = ACK.unpack_from(payload, 0)
+    return ack, RECORD.unpack_from(payload, ACK.size)
@@ -0,0 +1,137 @@
+"""
+Minimal Prometheus instrumentation, rendered in the text exposition format
+by GET /metrics. Only what the server needs: counters, histograms, gauges
+read at scrape time, and a lock that times its waiters and holders.
+"""
+import bisect
+import threading
+import time
+from typing import Callable, Iterable
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds, from a fast in-memory request up to a stalled one
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _escape(value) -> str:
+    # Label values may hold a backslash, a double quote or a newline, e.g. a map name
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def collect(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = list(self._values.items())
+        for values, v in items:
+            lines.append(f"{self.name}{_labels(self.label_names, values)} {v}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.buckets = buckets
+        # label values -> (per-bucket counts, +Inf included, sum)
+        self._values: dict[tuple, tuple[list[int], list[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = ([0] * (len(self.buckets) + 1), [0.0])
+            entry[0][i] += 1
+            entry[1][0] += value
+
+    def collect(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(values, list(counts), total[0]) for values, (counts, total) in self._values.items()]
+        for values, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = _labels(self.label_names, values, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            cumulative += counts[-1]
+            le = _labels(self.label_names, values, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, values)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, values)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Value read from a callback at scrape time, label values -> value"""
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...], read: Callable[[], dict[tuple, float]]):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.read = read
+
+    def collect(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for values, v in self.read().items():
+            lines.append(f"{self.name}{_labels(self.label_names, values)} {v}")
+        return lines
+
+
+class TimedLock:
+    """threading.Lock that records how long callers waited for it and then held it"""
+
+    def __init__(self, wait: Histogram, hold: Histogram):
+        self._lock = threading.Lock()
+        self._wait = wait
+        self._hold = hold
+        self._acquired_at = 0.0
+
+    def acquire(self) -> bool:
+        start = time.perf_counter()
+        self._lock.acquire()
+        # Only the holder writes this, so no extra locking is needed
+        self._acquired_at = time.perf_counter()
+        self._wait.observe(self._acquired_at - start)
+        return True
+
+    def release(self) -> None:
+        held = time.perf_counter() - self._acquired_at
+        self._lock.release()
+        self._hold.observe(held)
+
+    def __enter__(self) -> "TimedLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+def render(metrics: Iterable[Counter | Histogram | Gauge]) -> bytes:
+    lines: list[str] = []
+    for metric in metrics:
+        lines.extend(metric.collect())
+    return ("\n".join(lines) + "\n").encode("utf-8")
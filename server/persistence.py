@@ -0,0 +1,319 @@
+"""
+Optional persistence for PlayerHandler (server.py --data-dir), so players
+and player ids survive a restart.
+
+Changes are appended to a log by a background thread; request threads
+only queue them. Every snapshot_interval the writer stores the whole
+world in a snapshot and starts a new, empty log. Boot reads the snapshot
+and replays the log on top of it.
+
+Both files start with a generation number. A log is only replayed onto
+the snapshot of the same generation, so a crash between writing a new
+snapshot and starting its log never replays records twice.
+
+    snapshot = "MGSN", generation u64, next id u32, map count u32,
+               maps (length u16, utf-8 name), player count u32, records
+    log      = "MGLG", generation u64, then entries of
+               kind u8 + REGISTER/REMOVE id u32
+                        | UPDATE record
+                        | MAP id u16, length u16, utf-8 name
+    record   = id u32, x f32, y f32, map index u16, flags u8
+
+Records are binaryProtocol records without the velocity, a restored player
+stands still until its client reconnects. Positions are stored at the
+float32 precision of binaryProtocol.
+"""
+import os
+import struct
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import BinaryIO, Callable
+
+SNAPSHOT_FILE = "players.snapshot"
+LOG_FILE = "players.log"
+# Seconds between log writes, at most this much is lost in a crash
+FLUSH_INTERVAL = 0.2
+SNAPSHOT_INTERVAL = 60.0
+# A log that grows past this is compacted into a snapshot early
+MAX_LOG_BYTES = 16 << 20
+
+SNAPSHOT_MAGIC = b"MGSN"
+LOG_MAGIC = b"MGLG"
+GENERATION = struct.Struct("<Q")
+COUNTS = struct.Struct("<II")
+COUNT = struct.Struct("<I")
+NAME = struct.Struct("<H")
+MAP_ENTRY = struct.Struct("<HH")
+PID = struct.Struct("<I")
+RECORD = struct.Struct("<IffHB")
+REGISTER, UPDATE, REMOVE, MAP = range(1, 5)
+
+# id, x, y, map index, binaryProtocol flags
+Record = tuple[int, float, float, int, int]
+
+
+@dataclass
+class WorldState:
+    next_id: int = 0
+    map_names: list[str] = field(default_factory=list)
+    # pid -> record
+    players: dict[int, Record] = field(default_factory=dict)
+
+
+@dataclass
+class JournalStats:
+    log_bytes: int = 0
+    snapshot_bytes: int = 0
+    snapshots: int = 0
+    # Updates queued, and the ones written after coalescing per player
+    updates: int = 0
+    updates_written: int = 0
+    # Records that could not be packed, left out of the log and snapshot
+    dropped: int = 0
+
+
+class Journal:
+    directory: str
+    flush_interval: float
+    snapshot_interval: float
+    fsync: bool
+    stats: JournalStats
+    generation: int
+
+    # Changes queued since the last write, grouped so only a player's last update is kept.
+    # Ids are never reused and maps only appended, so writing them group by group is
+    # equivalent to the original order.
+    _maps: list[tuple[int, str]]
+    _registered: list[int]
+    _updates: dict[int, Record]
+    _removed: list[int]
+    _lock: threading.Lock
+
+    _log: BinaryIO | None
+    _dump: Callable[[], WorldState] | None
+    _stop_event: threading.Event
+    _thread: threading.Thread | None
+
+    def __init__(
+        self, directory: str, *, flush_interval: float = FLUSH_INTERVAL,
+        snapshot_interval: float = SNAPSHOT_INTERVAL, fsync: bool = True,
+    ):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.snapshot_interval = snapshot_interval
+        self.fsync = fsync
+        self.stats = JournalStats()
+        self.generation = 0
+        self._maps, self._registered, self._updates, self._removed = [], [], {}, []
+        self._lock = threading.Lock()
+        self._log = None
+        self._dump = None
+        self._stop_event = threading.Event()
+        self._thread = None
+        os.makedirs(directory, exist_ok=True)
+
+    # Queueing, called by PlayerHandler with its lock held
+    def log_map(self, map_id: int, name: str) -> None:
+        with self._lock:
+            self._maps.append((map_id, name))
+
+    def log_register(self, pid: int) -> None:
+        with self._lock:
+            self._registered.append(pid)
+
+    def log_update(self, record: Record) -> None:
+        with self._lock:
+            self._updates[record[0]] = record
+            self.stats.updates += 1
+
+    def log_remove(self, pid: int) -> None:
+        with self._lock:
+            self._updates.pop(pid, None)
+            self._removed.append(pid)
+
+    def _take(self) -> tuple[list, list, dict, list]:
+        with self._lock:
+            taken = self._maps, self._registered, self._updates, self._removed
+            self._maps, self._registered, self._updates, self._removed = [], [], {}, []
+            return taken
+
+    # Recovery
+    def load(self) -> WorldState:
+        """The state of the last run, empty if there was none"""
+        state = WorldState()
+        path = os.path.join(self.directory, SNAPSHOT_FILE)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                self.generation = self._read_snapshot(f.read(), state)
+        path = os.path.join(self.directory, LOG_FILE)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                self._replay(f.read(), state)
+        return state
+
+    def _read_snapshot(self, data: bytes, state: WorldState) -> int:
+        if data[:4] != SNAPSHOT_MAGIC:
+            raise ValueError(f"{SNAPSHOT_FILE} is not a snapshot")
+        (generation,) = GENERATION.unpack_from(data, 4)
+        offset = 4 + GENERATION.size
+        state.next_id, map_count = COUNTS.unpack_from(data, offset)
+        offset += COUNTS.size
+        for _ in range(map_count):
+            (length,) = NAME.unpack_from(data, offset)
+            offset += NAME.size
+            state.map_names.append(data[offset:offset + length].decode("utf-8"))
+            offset += length
+        (count,) = COUNT.unpack_from(data, offset)
+        offset += COUNT.size
+        end = offset + RECORD.size * count
+        for record in RECORD.iter_unpack(data[offset:end]):
+            state.players[record[0]] = record
+        return generation
+
+    def _replay(self, data: bytes, state: WorldState) -> None:
+        if data[:4] != LOG_MAGIC or len(data) < 4 + GENERATION.size:
+            return
+        (generation,) = GENERATION.unpack_from(data, 4)
+        if generation != self.generation:
+            # Written before the snapshot, which already holds all of it
+            return
+        offset = 4 + GENERATION.size
+        record_size = RECORD.size
+        try:
+            while offset < len(data):
+                kind = data[offset]
+                offset += 1
+                if kind == UPDATE:
+                    record = RECORD.unpack_from(data, offset)
+                    offset += record_size
+                    if record[0] in state.players:
+                        state.players[record[0]] = record
+                elif kind == REGISTER:
+                    (pid,) = PID.unpack_from(data, offset)
+                    offset += PID.size
+                    state.players[pid] = (pid, 0.0, 0.0, state.map_names.index(""), 0)
+                    state.next_id = max(state.next_id, pid + 1)
+                elif kind == REMOVE:
+                    (pid,) = PID.unpack_from(data, offset)
+                    offset += PID.size
+                    state.players.pop(pid, None)
+                elif kind == MAP:
+                    map_id, length = MAP_ENTRY.unpack_from(data, offset)
+                    offset += MAP_ENTRY.size
+                    if offset + length > len(data):
+                        break
+                    if map_id == len(state.map_names):
+                        state.map_names.append(data[offset:offset + length].decode("utf-8"))
+                    offset += length
+                else:
+                    break
+        except (struct.error, ValueError, UnicodeDecodeError):
+            # A torn write at the end of the log, everything before it is kept
+            pass
+
+    # Writing
+    def start(self, dump: Callable[[], WorldState]) -> None:
+        """
+        Start writing. dump must return the current state and call
+        take_pending() under the same lock the log_* callers hold, so the
+        snapshot and the log never overlap or leave a gap.
+        """
+        self._dump = dump
+        # A snapshot right away makes whatever was recovered the new base
+        self._compact()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._writer, name="JournalWriter", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=5.0)
+        self._flush()
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    def take_pending(self) -> None:
+        """Drop the queued changes, the snapshot being taken contains them"""
+        self._take()
+
+    def _writer(self) -> None:
+        last_snapshot = time.monotonic()
+        while not self._stop_event.wait(self.flush_interval):
+            try:
+                self._flush()
+                if (time.monotonic() - last_snapshot >= self.snapshot_interval
+                        or self._log.tell() >= MAX_LOG_BYTES):
+                    self._compact()
+                    last_snapshot = time.monotonic()
+            except Exception as e:
+                # The server keeps serving, so the writer keeps writing
+                print(f"[Journal] write failed: {e!r}")
+
+    def _pack(self, record: Record) -> bytes | None:
+        """record packed, or None after logging it if it does not fit the format"""
+        try:
+            return RECORD.pack(*record)
+        except (struct.error, OverflowError) as e:
+            self.stats.dropped += 1
+            print(f"[Journal] dropped record {record!r}: {e}")
+            return None
+
+    def _flush(self) -> None:
+        if self._log is None:
+            return
+        maps, registered, updates, removed = self._take()
+        if not (maps or registered or updates or removed):
+            return
+        out = bytearray()
+        for map_id, name in maps:
+            data = name.encode("utf-8")
+            out += bytes((MAP,)) + MAP_ENTRY.pack(map_id, len(data)) + data
+        for pid in registered:
+            out += bytes((REGISTER,)) + PID.pack(pid)
+        written = 0
+        for record in updates.values():
+            data = self._pack(record)
+            if data is not None:
+                out += bytes((UPDATE,)) + data
+                written += 1
+        for pid in removed:
+            out += bytes((REMOVE,)) + PID.pack(pid)
+        self._log.write(out)
+        self._log.flush()
+        if self.fsync:
+            os.fsync(self._log.fileno())
+        self.stats.log_bytes += len(out)
+        self.stats.updates_written += written
+
+    def _compact(self) -> None:
+        state = self._dump()
+        generation = self.generation + 1
+        out = bytearray(SNAPSHOT_MAGIC + GENERATION.pack(generation))
+        out += COUNTS.pack(state.next_id, len(state.map_names))
+        for name in state.map_names:
+            data = name.encode("utf-8")
+            out += NAME.pack(len(data)) + data
+        records = [data for data in map(self._pack, state.players.values()) if data is not None]
+        out += COUNT.pack(len(records))
+        for data in records:
+            out += data
+
+        # Replace the snapshot atomically, then start the log that goes with it
+        path = os.path.join(self.directory, SNAPSHOT_FILE)
+        with open(path + ".tmp", "wb") as f:
+            f.write(out)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        self.generation = generation
+        if self._log is not None:
+            self._log.close()
+        self._log = open(os.path.join(self.directory, LOG_FILE), "wb")
+        self._log.write(LOG_MAGIC + GENERATION.pack(generation))
+        self._log.flush()
+        self.stats.snapshot_bytes += len(out)
+        self.stats.snapshots += 1
@@ -1,11 +1,30 @@
+import heapq
+import json
 import threading
 import time
 import copy
+from collections import OrderedDict
 from dataclasses import dataclass
-from typing import Dict, Optional
+from typing import Callable, Dict, Optional
+
+from server import binaryProtocol, metrics
+from server.persistence import Journal, Record, WorldState
 
 TIMEOUT_TIME = 60.0
 CHECK_INTERVAL_TIME = 10.0
+# Removed players remembered for delta replies, older clients get a full snapshot
+MAX_TOMBSTONES = 1024
+# Distinct (map, since, format) replies kept per world version
+MAX_CACHED_REPLIES = 64
+# World ticks per second when inputs are buffered, see PlayerHandler.tick
+TICK_RATE = 20.0
+# Side of a spatial grid cell in pixels, one tile (GameSettings.TILE_SIZE)
+GRID_CELL = 64.0
+
+
+class MapTableFull(ValueError):
+    """An update names a map the store has no room left to add"""
+
 
 @dataclass
 class Player:
@@ -14,41 +33,107 @@ class Player:
     y: float
     map: str
     last_update: float
+    # World version of the last change to this player
+    version: int = 0
+    direction: str = "down"
+    moving: bool = False
+    # Pixels per second, clients extrapolate along it until the next update
+    vx: float = 0.0
+    vy: float = 0.0
 
-    def update(self, x: float, y: float, map: str) -> None:
-        if x != self.x or y != self.y or map != self.map:
+    def update(
+        self, x: float, y: float, map: str, direction: str | None = None, moving: bool | None = None,
+        velocity: tuple[float, float] | None = None,
+    ) -> bool:
+        direction = self.direction if direction is None else direction
+        moving = self.moving if moving is None else moving
+        vx, vy = (self.vx, self.vy) if velocity is None else velocity
+        changed = (
+            x != self.x or y != self.y or map != self.map
+            or direction != self.direction or moving != self.moving
+            or vx != self.vx or vy != self.vy
+        )
+        if changed:
             self.last_update = time.monotonic()
         self.x = x
         self.y = y
         self.map = map
+        self.direction = direction
+        self.moving = moving
+        self.vx = vx
+        self.vy = vy
+        return changed
 
     def is_inactive(self) -> bool:
         now = time.monotonic()
         return (now - self.last_update) >= TIMEOUT_TIME
 
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "x": self.x,
+            "y": self.y,
+            "map": self.map,
+            "direction": self.direction,
+            "moving": self.moving,
+            "vx": self.vx,
+            "vy": self.vy,
+        }
 
-class PlayerHandler:
-    _lock: threading.Lock
+
+@dataclass
+class Delta:
+    version: int
+    # True when players holds the whole world rather than changes since the asked version
+    full: bool
+    players: dict
+    removed: list[int]
+
+
+@dataclass
+class CleanerStats:
+    passes: int = 0
+    expired: int = 0
+    # Seconds the cleaner held the player lock
+    last_hold: float = 0.0
+    max_hold: float = 0.0
+    total_hold: float = 0.0
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    # World version the body was built at
+    version: int
+    # Pre-encoded JSON, shared by every reader
+    body: bytes
+
+
+class Cleaner:
+    """
+    Calls expire(now) of a player store every interval seconds on its own
+    thread, and keeps the stats of every pass, whoever ran it.
+    """
+    interval: float
+    stats: CleanerStats
+    # Exported by GET /metrics
+    pass_seconds: metrics.Histogram
+    _expire: Callable[[float], list[int]]
     _stop_event: threading.Event
     _thread: threading.Thread | None
-    
-    players: Dict[int, Player]
-    _next_id: int
 
-    def __init__(self, *, timeout_seconds: float = 120.0, check_interval_seconds: float = 5.0):
-        self._lock = threading.Lock()
+    def __init__(self, expire: Callable[[float], list[int]], interval: float = CHECK_INTERVAL_TIME):
+        self.interval = interval
+        self.stats = CleanerStats()
+        self.pass_seconds = metrics.Histogram("player_cleaner_pass_seconds", "Duration of one expiry pass")
+        self._expire = expire
         self._stop_event = threading.Event()
         self._thread = None
-        
-        self.players = {}
-        self._next_id = 0
-        
-    # Threading
+
     def start(self) -> None:
         if self._thread and self._thread.is_alive():
             return
         self._stop_event.clear()
-        self._thread = threading.Thread(target=self._cleaner, name="PlayerCleaner", daemon=True)
+        self._thread = threading.Thread(target=self._run, name="PlayerCleaner", daemon=True)
         self._thread.start()
 
     def stop(self) -> None:
@@ -56,42 +141,599 @@ class PlayerHandler:
         if self._thread:
             self._thread.join(timeout=2.0)
 
-    def _cleaner(self) -> None:
-        while not self._stop_event.wait(CHECK_INTERVAL_TIME):
-            now = time.monotonic()
-            to_remove: list[int] = []
-            with self._lock:
-                for pid, p in list(self.players.items()):
-                    if now - p.last_update >= TIMEOUT_TIME:
-                        to_remove.append(pid)
-                for pid in to_remove:
-                    _ = self.players.pop(pid, None)
-                    
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            self._expire(time.monotonic())
+
+    def record(self, expired: int, hold: float) -> None:
+        """One pass removed expired players, holding the player lock for hold seconds"""
+        stats = self.stats
+        stats.passes += 1
+        stats.expired += expired
+        stats.last_hold = hold
+        stats.max_hold = max(stats.max_hold, hold)
+        stats.total_hold += hold
+        self.pass_seconds.observe(hold)
+
+
+class ReplyCache:
+    """
+    Encoded replies for the current world version. The first reader to miss
+    one builds it while the others wait here instead of on the player lock,
+    then everyone reads it without locking. The dict is replaced wholesale,
+    never mutated, so a reader holding the old one keeps a consistent view.
+    """
+    _version: Callable[[], int]
+    _replies: tuple[int, Dict[tuple, object]]
+    _lock: threading.Lock
+
+    def __init__(self, version: Callable[[], int]):
+        self._version = version
+        self._replies = (0, {})
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple, build: Callable[[tuple], object]):
+        """The reply cached under key, or build(key), cached if the world did not change meanwhile"""
+        version, replies = self._replies
+        if version == self._version() and key in replies:
+            return replies[key]
+        with self._lock:
+            version = self._version()
+            cached_version, replies = self._replies
+            if cached_version != version:
+                replies = {}
+            elif key in replies:
+                return replies[key]
+            value = build(key)
+            # Only cache what was built at the version it is filed under
+            built_at = value.version if isinstance(value, Snapshot) else version
+            if len(replies) < MAX_CACHED_REPLIES and built_at == version == self._version():
+                self._replies = (version, {**replies, key: value})
+            return value
+
+
+def encode_delta(delta: Delta, map_ids: Dict[str, int], binary: bool) -> bytes:
+    """The body of a delta reply, as JSON or with binaryProtocol"""
+    if binary:
+        records = [
+            (
+                p["id"], p["x"], p["y"],
+                map_ids.get(p["map"], binaryProtocol.NO_MAP),
+                binaryProtocol.pack_flags(p["direction"], p["moving"]),
+                *binaryProtocol.pack_velocity(p["vx"], p["vy"]),
+            )
+            for p in delta.players.values()
+        ]
+        return binaryProtocol.encode_delta(delta.version, delta.full, records, delta.removed)
+    return json.dumps({
+        "version": delta.version,
+        "full": delta.full,
+        "players": delta.players,
+        "removed": delta.removed,
+    }).encode("utf-8")
+
+
+def encode_snapshot(version: int, players: dict, map_ids: Dict[str, int], binary: bool) -> bytes:
+    """The body of a GET /players reply without since"""
+    if binary:
+        return encode_delta(Delta(version, True, players, []), map_ids, True)
+    return json.dumps({"players": players, "version": version}).encode("utf-8")
+
+
+class PlayerIndex:
+    """
+    A set of players ordered by the version of their last change, plus
+    tombstones for players that left it, so deltas only walk the changes.
+    The whole world is one index and every map has its own.
+    """
+    # Ordered by Player.version, the most recently changed player is last
+    players: "OrderedDict[int, Player]"
+    # pid -> version it left at, same ordering as players
+    removed: "OrderedDict[int, int]"
+    # Deltas are only complete for since >= this version
+    removed_floor: int
+    # Version of the last change inside this index
+    version: int
+
+    def __init__(self):
+        self.players = OrderedDict()
+        self.removed = OrderedDict()
+        self.removed_floor = 0
+        self.version = 0
+
+    def touch(self, p: Player) -> None:
+        self.players[p.id] = p
+        self.players.move_to_end(p.id)
+        self.removed.pop(p.id, None)
+        self.version = p.version
+
+    def discard(self, pid: int, version: int) -> None:
+        if self.players.pop(pid, None) is None:
+            return
+        self.removed[pid] = version
+        self.version = version
+        while len(self.removed) > MAX_TOMBSTONES:
+            _, removed_at = self.removed.popitem(last=False)
+            self.removed_floor = removed_at
+
+    def snapshot(self) -> dict:
+        return {p.id: p.to_dict() for p in self.players.values()}
+
+    def delta(self, since: int, world_version: int) -> Delta | None:
+        if since == world_version or self.version <= since < world_version:
+            return None
+        if since < self.removed_floor or since > world_version:
+            return Delta(world_version, True, self.snapshot(), [])
+
+        players = {}
+        for p in reversed(self.players.values()):
+            if p.version <= since:
+                break
+            players[p.id] = p.to_dict()
+        removed = []
+        for pid, removed_at in reversed(self.removed.items()):
+            if removed_at <= since:
+                break
+            removed.append(pid)
+        return Delta(world_version, False, players, removed)
+
+
+class SpatialGrid:
+    """
+    Players of one map bucketed by the grid cell they stand in, so a
+    radius query only looks at the cells the circle overlaps.
+    """
+    cell: float
+    cells: Dict[tuple[int, int], set[int]]
+    # pid -> cell it is bucketed in
+    where: Dict[int, tuple[int, int]]
+
+    def __init__(self, cell: float = GRID_CELL):
+        self.cell = cell
+        self.cells = {}
+        self.where = {}
+
+    def _key(self, x: float, y: float) -> tuple[int, int]:
+        return int(x // self.cell), int(y // self.cell)
+
+    def move(self, pid: int, x: float, y: float) -> None:
+        key = self._key(x, y)
+        old = self.where.get(pid)
+        if old == key:
+            return
+        if old is not None:
+            self._leave(pid, old)
+        self.where[pid] = key
+        self.cells.setdefault(key, set()).add(pid)
+
+    def remove(self, pid: int) -> None:
+        old = self.where.pop(pid, None)
+        if old is not None:
+            self._leave(pid, old)
+
+    def _leave(self, pid: int, key: tuple[int, int]) -> None:
+        bucket = self.cells[key]
+        bucket.discard(pid)
+        if not bucket:
+            del self.cells[key]
+
+    def near(self, x: float, y: float, r: float, players: Dict[int, Player]) -> list[Player]:
+        """Players within r of (x, y), positions are looked up in players"""
+        x0, y0 = self._key(x - r, y - r)
+        x1, y1 = self._key(x + r, y + r)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) <= len(self.cells):
+            keys = ((cx, cy) for cx in range(x0, x1 + 1) for cy in range(y0, y1 + 1))
+        else:
+            # A huge radius covers more cells than are occupied, only visit those
+            keys = (k for k in self.cells if x0 <= k[0] <= x1 and y0 <= k[1] <= y1)
+        r2 = r * r
+        found = []
+        for key in keys:
+            for pid in self.cells.get(key, ()):
+                p = players[pid]
+                if (p.x - x) ** 2 + (p.y - y) ** 2 <= r2:
+                    found.append(p)
+        return found
+
+
+class PlayerHandler:
+    _lock: metrics.TimedLock
+    _stop_event: threading.Event
+    timeout_seconds: float
+    cleaner: Cleaner
+    # 0 applies every update at once, otherwise they wait for the next tick
+    tick_rate: float
+    _tick_thread: threading.Thread | None
+    # Latest input per player since the last tick, older ones are superseded
+    _inputs: Dict[int, tuple]
+    _input_lock: threading.Lock
+    _tick_listeners: list[Callable[[int], None]]
+    # Writes every change to disk when set, see attach_journal
+    _journal: Journal | None
+
+    players: Dict[int, Player]
+    _next_id: int
+    # Bumped on every change to the world, so readers can tell if anything moved
+    version: int
+    _world: PlayerIndex
+    # Secondary index by map name, so readers only pay for their own map
+    _maps: Dict[str, PlayerIndex]
+    _grids: Dict[str, SpatialGrid]
+    # Encoded snapshots, replaced wholesale (never mutated) so readers need no lock.
+    # One stays fresh while only other maps change, so they are not in _replies
+    _snapshots: Dict[tuple[str | None, bool], Snapshot]
+    # Only one reader encodes a stale snapshot, the others wait for it instead of the player lock
+    _snapshot_lock: threading.Lock
+    _replies: ReplyCache
+    # Append-only map name table for the binary protocol, index = position
+    map_names: list[str]
+    _map_ids: Dict[str, int]
+    # Min-heap of (last_update when pushed, pid), one entry per player
+    _expiry: list[tuple[float, int]]
+    # Exported by GET /metrics
+    lock_wait: metrics.Histogram
+    lock_hold: metrics.Histogram
+    tick_duration: metrics.Histogram
+    tick_errors: metrics.Counter
+
+    def __init__(
+        self, *, timeout_seconds: float = TIMEOUT_TIME, check_interval_seconds: float = CHECK_INTERVAL_TIME,
+        tick_rate: float = 0.0,
+    ):
+        self.lock_wait = metrics.Histogram("player_lock_wait_seconds", "Time spent waiting for the player lock")
+        self.lock_hold = metrics.Histogram("player_lock_hold_seconds", "Time the player lock was held")
+        self.tick_duration = metrics.Histogram("world_tick_seconds", "Time to apply one tick of inputs")
+        self.tick_errors = metrics.Counter("world_tick_input_errors_total", "Buffered inputs a tick failed to apply")
+        self._lock = metrics.TimedLock(self.lock_wait, self.lock_hold)
+        self._stop_event = threading.Event()
+        self.timeout_seconds = timeout_seconds
+        self.cleaner = Cleaner(self.expire, check_interval_seconds)
+        self.tick_rate = tick_rate
+        self._tick_thread = None
+        self._inputs = {}
+        self._input_lock = threading.Lock()
+        self._tick_listeners = []
+        self._journal = None
+        self._expiry = []
+
+        self._world = PlayerIndex()
+        self._maps = {}
+        self._grids = {}
+        self.players = self._world.players
+        self._next_id = 0
+        self.version = 0
+        self._snapshots = {}
+        self._snapshot_lock = threading.Lock()
+        self._replies = ReplyCache(lambda: self.version)
+        self.map_names = []
+        self._map_ids = {}
+
+    # Threading
+    def start(self) -> None:
+        self.cleaner.start()
+        self._stop_event.clear()
+        if self.tick_rate > 0 and not (self._tick_thread and self._tick_thread.is_alive()):
+            self._tick_thread = threading.Thread(target=self._ticker, name="WorldTick", daemon=True)
+            self._tick_thread.start()
+
+    def stop(self) -> None:
+        self.cleaner.stop()
+        self._stop_event.set()
+        if self._tick_thread:
+            self._tick_thread.join(timeout=2.0)
+        if self._journal is not None:
+            self._journal.stop()
+
+    def _ticker(self) -> None:
+        interval = 1.0 / self.tick_rate
+        next_tick = time.monotonic() + interval
+        while not self._stop_event.wait(max(0.0, next_tick - time.monotonic())):
+            self.tick()
+            next_tick += interval
+            if next_tick < time.monotonic():
+                # Fell a whole tick behind, skip it rather than running a burst to catch up
+                next_tick = time.monotonic() + interval
+
+    def add_tick_listener(self, callback: Callable[[int], None]) -> None:
+        """Call callback(version) on the tick thread after every tick"""
+        self._tick_listeners.append(callback)
+
+    def tick(self) -> int:
+        """
+        Apply the inputs buffered since the last tick as one change of the
+        world, so everything readers encode is bounded by the tick rate
+        rather than the update rate. Returns the world version after it.
+        """
+        with self._input_lock:
+            inputs, self._inputs = self._inputs, {}
+        start = time.perf_counter()
+        with self._lock:
+            version = self.version + 1
+            changed = False
+            for pid, state in inputs.items():
+                p = self.players.get(pid)
+                # The player may have expired since the input was buffered
+                if p is None:
+                    continue
+                try:
+                    if self._apply(p, *state, version):
+                        changed = True
+                except Exception:
+                    # One bad input must not stop the world for everyone else,
+                    # and it may have been half applied, so readers still refetch
+                    self.tick_errors.inc()
+                    changed = True
+            if changed:
+                self.version = version
+            version = self.version
+        self.tick_duration.observe(time.perf_counter() - start)
+        for callback in self._tick_listeners:
+            callback(version)
+        return version
+
+    def expire(self, now: float) -> list[int]:
+        """
+        Remove players idle for timeout_seconds. Only heap entries whose
+        deadline has passed are looked at, so a pass over mostly active
+        players costs nothing however many there are.
+        """
+        to_remove: list[int] = []
+        with self._lock:
+            start = time.perf_counter()
+            deadline = now - self.timeout_seconds
+            while self._expiry and self._expiry[0][0] <= deadline:
+                last_update, pid = heapq.heappop(self._expiry)
+                p = self.players.get(pid)
+                if p is None:
+                    continue
+                if p.last_update > last_update:
+                    # Active since the entry was pushed, re-arm at its real deadline
+                    heapq.heappush(self._expiry, (p.last_update, pid))
+                    continue
+                to_remove.append(pid)
+
+            if to_remove:
+                self.version += 1
+            for pid in to_remove:
+                p = self.players[pid]
+                self._world.discard(pid, self.version)
+                self._map_index(p.map).discard(pid, self.version)
+                self._grid(p.map).remove(pid)
+                if self._journal is not None:
+                    self._journal.log_remove(pid)
+            hold = time.perf_counter() - start
+
+        self.cleaner.record(len(to_remove), hold)
+        return to_remove
+
+    def _grid(self, map_name: str) -> SpatialGrid:
+        grid = self._grids.get(map_name)
+        if grid is None:
+            grid = self._grids[map_name] = SpatialGrid()
+        return grid
+
+    def _map_index(self, map_name: str) -> PlayerIndex:
+        index = self._maps.get(map_name)
+        if index is None:
+            index = self._maps[map_name] = PlayerIndex()
+            self._intern_map(map_name)
+        return index
+
+    def _intern_map(self, map_name: str) -> int:
+        map_id = self._map_ids.get(map_name)
+        if map_id is None:
+            if len(self.map_names) >= binaryProtocol.NO_MAP:
+                return binaryProtocol.NO_MAP
+            map_id = len(self.map_names)
+            # Append before publishing the id, lock-free readers never see a dangling index
+            self.map_names.append(map_name)
+            self._map_ids[map_name] = map_id
+            if self._journal is not None:
+                self._journal.log_map(map_id, map_name)
+        return map_id
+
+    def count_by_map(self) -> dict[str, int]:
+        with self._lock:
+            return {name: len(index.players) for name, index in self._maps.items() if index.players}
+
+    def exported_metrics(self) -> list:
+        """Everything PlayerHandler exports on GET /metrics"""
+        return [
+            metrics.Gauge(
+                "players_active", "Registered players per map", ("map",),
+                lambda: {(name,): n for name, n in self.count_by_map().items()},
+            ),
+            metrics.Gauge(
+                "player_world_version", "Version of the last change to the world", (),
+                lambda: {(): self.version},
+            ),
+            self.lock_wait,
+            self.lock_hold,
+            self.cleaner.pass_seconds,
+            self.tick_duration,
+            self.tick_errors,
+        ]
+
+    # Persistence
+    def attach_journal(self, journal: Journal) -> int:
+        """
+        Restore the players journal saved last run and write every change
+        to it from now on. Call before serving. Returns the number restored.
+        """
+        state = journal.load()
+        now = time.monotonic()
+        with self._lock:
+            for name in state.map_names:
+                self._intern_map(name)
+            if state.players:
+                self.version += 1
+            for pid, x, y, map_id, flags in state.players.values():
+                direction, moving = binaryProtocol.unpack_flags(flags)
+                # Everyone gets a fresh timeout, the downtime was not their idling
+                p = Player(pid, x, y, state.map_names[map_id], now, self.version, direction, moving)
+                heapq.heappush(self._expiry, (now, pid))
+                self._world.touch(p)
+                self._map_index(p.map).touch(p)
+                self._grid(p.map).move(pid, p.x, p.y)
+            self._next_id = max(self._next_id, state.next_id)
+            self._journal = journal
+        journal.start(self._dump_state)
+        return len(state.players)
+
+    def _dump_state(self) -> WorldState:
+        with self._lock:
+            # Everything queued so far is in this state, the journal drops it
+            self._journal.take_pending()
+            return WorldState(
+                self._next_id, list(self.map_names),
+                {pid: self._saved(p) for pid, p in self.players.items()},
+            )
+
     # API
     def register(self) -> int:
         with self._lock:
             pid = self._next_id
             self._next_id += 1
-            self.players[pid] = Player(pid, 0.0, 0.0, "", time.monotonic())
+            self.version += 1
+            p = Player(pid, 0.0, 0.0, "", time.monotonic(), self.version)
+            heapq.heappush(self._expiry, (p.last_update, pid))
+            self._world.touch(p)
+            self._map_index(p.map).touch(p)
+            self._grid(p.map).move(pid, p.x, p.y)
+            if self._journal is not None:
+                self._journal.log_register(pid)
             return pid
 
-    def update(self, pid: int, x: float, y: float, map_name: str) -> bool:
+    def update(
+        self, pid: int, x: float, y: float, map_name: str,
+        direction: str | None = None, moving: bool | None = None,
+        velocity: tuple[float, float] | None = None,
+    ) -> bool:
+        if velocity is not None:
+            # Whole pixels per second, the same in JSON as in the binary protocol
+            velocity = binaryProtocol.pack_velocity(*velocity)
+        state = (float(x), float(y), str(map_name), direction, moving, velocity)
+        if self.tick_rate > 0:
+            # Applied by the next tick, together with everyone else's
+            if pid not in self.players:
+                return False
+            with self._input_lock:
+                self._inputs[pid] = state
+            return True
+
         with self._lock:
             p = self.players.get(pid)
             if not p:
                 return False
-            else:
-                p.update(float(x), float(y), str(map_name))
-                return True
+            if self._apply(p, *state, self.version + 1):
+                self.version += 1
+            return True
+
+    def _apply(
+        self, p: Player, x: float, y: float, map_name: str,
+        direction: str | None, moving: bool | None, velocity: tuple[int, int] | None, version: int,
+    ) -> bool:
+        # Caller holds the lock, version is what the change is filed under
+        old_map = p.map
+        if not p.update(x, y, map_name, direction, moving, velocity):
+            return False
+        p.version = version
+        self._world.touch(p)
+        if p.map != old_map:
+            self._map_index(old_map).discard(p.id, version)
+            self._grid(old_map).remove(p.id)
+        self._map_index(p.map).touch(p)
+        self._grid(p.map).move(p.id, p.x, p.y)
+        if self._journal is not None:
+            self._journal.log_update(self._saved(p))
+        return True
+
+    def _saved(self, p: Player) -> Record:
+        return (
+            p.id, p.x, p.y, self._map_ids.get(p.map, binaryProtocol.NO_MAP),
+            binaryProtocol.pack_flags(p.direction, p.moving),
+        )
 
-    def list_players(self) -> dict:
+    def list_players(self, map_name: str | None = None) -> dict:
+        return self.snapshot(map_name)[1]
+
+    def snapshot(self, map_name: str | None = None) -> tuple[int, dict]:
+        """Return the world version together with the players at that version"""
+        with self._lock:
+            index = self._world if map_name is None else self._maps.get(map_name)
+            return self.version, index.snapshot() if index else {}
+
+    def near(self, map_name: str, x: float, y: float, r: float) -> tuple[int, dict]:
+        """The world version and the players on map_name within r pixels of (x, y)"""
         with self._lock:
-            player_list = {}
-            for p in self.players.values():
-                player_list[p.id] = {
-                    "id": p.id,
-                    "x": p.x,
-                    "y": p.y,
-                    "map": p.map
-                }
-            return player_list
+            grid = self._grids.get(map_name)
+            found = grid.near(x, y, r, self.players) if grid else []
+            return self.version, {p.id: p.to_dict() for p in found}
+
+    def delta(self, since: int, map_name: str | None = None) -> Delta | None:
+        """
+        Players added, changed or removed after version `since`, or None if
+        nothing changed. Cost is proportional to the changes, not the world.
+        With map_name, leaving that map counts as a removal.
+        """
+        with self._lock:
+            if map_name is None:
+                index = self._world
+            else:
+                # Unknown maps are not indexed, a bad query must not grow _maps
+                index = self._maps.get(map_name) or PlayerIndex()
+            return index.delta(since, self.version)
+
+    def _index(self, map_name: str | None) -> PlayerIndex | None:
+        return self._world if map_name is None else self._maps.get(map_name)
+
+    def _encode(self, delta: Delta, binary: bool) -> bytes:
+        return encode_delta(delta, self._map_ids, binary)
+
+    def encoded_snapshot(self, map_name: str | None = None, binary: bool = False) -> Snapshot:
+        """
+        The full player list of the world or one map, encoded as JSON or with
+        binaryProtocol. It is built once per change and then served to every
+        reader without locking.
+        """
+        key = (map_name, binary)
+        snap = self._fresh_snapshot(key)
+        if snap is not None:
+            return snap
+        with self._snapshot_lock:
+            snap = self._fresh_snapshot(key)
+            if snap is not None:
+                return snap
+            return self._encode_snapshot(key)
+
+    def _fresh_snapshot(self, key: tuple[str | None, bool]) -> Snapshot | None:
+        snap = self._snapshots.get(key)
+        index = self._index(key[0])
+        if snap is not None and index is not None and index.version <= snap.version:
+            return snap
+        return None
+
+    def _encode_snapshot(self, key: tuple[str | None, bool]) -> Snapshot:
+        map_name, binary = key
+        index = self._index(map_name)
+        version, players = self.snapshot(map_name)
+        snap = Snapshot(version, encode_snapshot(version, players, self._map_ids, binary))
+        if index is not None:
+            # Copy on write, a reader holding the old dict keeps a consistent view
+            self._snapshots = {**self._snapshots, key: snap}
+        return snap
+
+    def encoded_delta(self, since: int, map_name: str | None = None, binary: bool = False) -> bytes | None:
+        """
+        delta() encoded as JSON or with binaryProtocol, or None if nothing
+        changed. Clients polling at the same rate ask for the same since, so
+        each reply is encoded once.
+        """
+        if since == self.version:
+            return None
+        return self._replies.get((map_name, since, binary), self._encode_delta)
+
+    def _encode_delta(self, key: tuple[str | None, int, bool]) -> bytes | None:
+        map_name, since, binary = key
+        delta = self.delta(since, map_name)
+        return None if delta is None else self._encode(delta, binary)
@@ -0,0 +1,326 @@
+"""
+Player table in shared memory, so several server processes (server.py
+--workers) serve the same world. It is a drop-in for PlayerHandler.
+
+The table is one anonymous mmap created before the workers fork:
+
+    header  = version i64, next id u32, map count u32
+    maps    = MAX_MAPS slots of MAP_SLOT bytes, utf-8, NUL padded
+    map versions = MAX_MAPS i64, the last change on each map
+    records = one per player id, see RECORD
+
+A record with used = 0 and version > 0 is a player removed at that
+version. Ids are never reused, so a removed record stays a tombstone.
+Each record also keeps the map it was on before its last map change
+(or removal) and when it got there, which is what a per-map delta needs
+to tell who left the map.
+Writers serialize on one process-shared lock; readers copy the records
+under it and do the decoding and encoding outside.
+"""
+import mmap
+import multiprocessing
+import struct
+import time
+from typing import Dict
+
+from server import binaryProtocol, metrics
+from server.playerHandler import (
+    CHECK_INTERVAL_TIME, TIMEOUT_TIME,
+    Cleaner, Delta, MapTableFull, ReplyCache, Snapshot, encode_delta, encode_snapshot,
+)
+
+DEFAULT_CAPACITY = 65536
+MAX_MAPS = 256
+MAP_SLOT = 128
+
+HEADER = struct.Struct("<qII")
+# used u8, flags u8 (as in binaryProtocol), map index u16, x f32, y f32,
+# vx i16, vy i16, version of the last change i64, last_update (time.monotonic) f64,
+# version it arrived on its map (or was removed) at i64, map before that u16
+# (NO_MAP when registered), version it arrived on that one at i64
+RECORD = struct.Struct("<BBHffhhqdqHq")
+MAP_VERSION = struct.Struct("<q")
+# used, flags, map, position and velocity, compared to tell whether an update changed anything
+STATE_SIZE = 16
+
+
+class SharedPlayerHandler:
+    capacity: int
+    timeout_seconds: float
+    cleaner: Cleaner
+    _buf: mmap.mmap
+    _map_versions_at: int
+    _records_at: int
+    # Shared by every process, taken by writers and by readers copying records
+    _lock: "multiprocessing.synchronize.Lock"
+    # Per-process copy of the append-only map table, refreshed when it grows
+    _map_names: list[str]
+    _map_ids: Dict[str, int]
+    # Per-process encoded replies for one world version, keyed like PlayerHandler's
+    _replies: ReplyCache
+
+    def __init__(
+        self, capacity: int = DEFAULT_CAPACITY, *,
+        timeout_seconds: float = TIMEOUT_TIME, check_interval_seconds: float = CHECK_INTERVAL_TIME,
+    ):
+        self.capacity = capacity
+        self.timeout_seconds = timeout_seconds
+        self.cleaner = Cleaner(self.expire, check_interval_seconds)
+        self._map_versions_at = HEADER.size + MAP_SLOT * MAX_MAPS
+        self._records_at = self._map_versions_at + MAP_VERSION.size * MAX_MAPS
+        # Anonymous and MAP_SHARED, children inherit it across fork
+        self._buf = mmap.mmap(-1, self._records_at + RECORD.size * capacity)
+        self._lock = multiprocessing.Lock()
+        self._map_names = []
+        self._map_ids = {}
+        self._replies = ReplyCache(lambda: self.version)
+
+    # Threading, only the parent process runs the cleaner
+    def start(self) -> None:
+        self.cleaner.start()
+
+    def stop(self) -> None:
+        self.cleaner.stop()
+
+    def expire(self, now: float) -> list[int]:
+        """
+        Remove players idle for timeout_seconds. A heap cannot live in the
+        table, so this scans every record, which is fine for one process
+        every few seconds.
+        """
+        to_remove: list[int] = []
+        with self._lock:
+            start = time.perf_counter()
+            version, count, _ = HEADER.unpack_from(self._buf, 0)
+            deadline = now - self.timeout_seconds
+            for pid in range(count):
+                record = RECORD.unpack_from(self._buf, self._offset(pid))
+                if record[0] and record[8] <= deadline:
+                    to_remove.append(pid)
+            if to_remove:
+                version += 1
+                for pid in to_remove:
+                    _, flags, map_id, x, y, vx, vy, _, last_update, arrived_at, _, _ = RECORD.unpack_from(
+                        self._buf, self._offset(pid)
+                    )
+                    RECORD.pack_into(
+                        self._buf, self._offset(pid), 0, flags, map_id, x, y, vx, vy, version, last_update,
+                        version, map_id, arrived_at,
+                    )
+                    self._touch_map(map_id, version)
+                self._set_version(version)
+            hold = time.perf_counter() - start
+
+        self.cleaner.record(len(to_remove), hold)
+        return to_remove
+
+    # Layout
+    def _offset(self, pid: int) -> int:
+        return self._records_at + RECORD.size * pid
+
+    def _set_version(self, version: int) -> None:
+        struct.pack_into("<q", self._buf, 0, version)
+
+    def _touch_map(self, map_id: int, version: int) -> None:
+        MAP_VERSION.pack_into(self._buf, self._map_versions_at + MAP_VERSION.size * map_id, version)
+
+    def _map_version(self, map_id: int) -> int:
+        if not 0 <= map_id < MAX_MAPS:
+            return 0
+        return MAP_VERSION.unpack_from(self._buf, self._map_versions_at + MAP_VERSION.size * map_id)[0]
+
+    @property
+    def version(self) -> int:
+        return HEADER.unpack_from(self._buf, 0)[0]
+
+    # Map table
+    @property
+    def map_names(self) -> list[str]:
+        self._refresh_maps()
+        return self._map_names
+
+    def _refresh_maps(self) -> None:
+        count = HEADER.unpack_from(self._buf, 0)[2]
+        while len(self._map_names) < count:
+            map_id = len(self._map_names)
+            at = HEADER.size + MAP_SLOT * map_id
+            name = self._buf[at:at + MAP_SLOT].rstrip(b"\0").decode("utf-8")
+            self._map_names.append(name)
+            self._map_ids[name] = map_id
+
+    def _intern_map(self, map_name: str) -> int:
+        # Caller holds the lock
+        self._refresh_maps()
+        map_id = self._map_ids.get(map_name)
+        if map_id is not None:
+            return map_id
+        data = map_name.encode("utf-8")
+        version, next_id, count = HEADER.unpack_from(self._buf, 0)
+        if count >= MAX_MAPS or len(data) > MAP_SLOT or b"\0" in data:
+            return binaryProtocol.NO_MAP
+        at = HEADER.size + MAP_SLOT * count
+        self._buf[at:at + MAP_SLOT] = data.ljust(MAP_SLOT, b"\0")
+        # Write the name before publishing the count, lock-free readers never see a blank slot
+        HEADER.pack_into(self._buf, 0, version, next_id, count + 1)
+        self._refresh_maps()
+        return count
+
+    # API
+    def register(self) -> int:
+        """A new player id, or -1 once the table is full"""
+        with self._lock:
+            version, pid, count = HEADER.unpack_from(self._buf, 0)
+            if pid >= self.capacity:
+                return -1
+            map_id = self._intern_map("")
+            version += 1
+            RECORD.pack_into(
+                self._buf, self._offset(pid), 1, 0, map_id, 0.0, 0.0, 0, 0, version, time.monotonic(),
+                version, binaryProtocol.NO_MAP, 0,
+            )
+            self._touch_map(map_id, version)
+            # _intern_map may have grown the map count
+            count = HEADER.unpack_from(self._buf, 0)[2]
+            HEADER.pack_into(self._buf, 0, version, pid + 1, count)
+            return pid
+
+    def update(
+        self, pid: int, x: float, y: float, map_name: str,
+        direction: str | None = None, moving: bool | None = None,
+        velocity: tuple[float, float] | None = None,
+    ) -> bool:
+        """Same as PlayerHandler.update, but raises MapTableFull for a map the table cannot hold"""
+        with self._lock:
+            version, count, _ = HEADER.unpack_from(self._buf, 0)
+            if not 0 <= pid < count:
+                return False
+            offset = self._offset(pid)
+            used, flags, old_map, _, _, vx, vy, _, _, arrived_at, prev_map, prev_arrived_at = RECORD.unpack_from(
+                self._buf, offset
+            )
+            if not used:
+                return False
+            map_id = self._intern_map(str(map_name))
+            if map_id == binaryProtocol.NO_MAP:
+                raise MapTableFull(map_name)
+            old_direction, old_moving = binaryProtocol.unpack_flags(flags)
+            flags = binaryProtocol.pack_flags(
+                old_direction if direction is None else direction,
+                old_moving if moving is None else moving,
+            )
+            if velocity is not None:
+                vx, vy = binaryProtocol.pack_velocity(*velocity)
+            if map_id != old_map:
+                prev_map, prev_arrived_at, arrived_at = old_map, arrived_at, version + 1
+            record = RECORD.pack(
+                1, flags, map_id, float(x), float(y), vx, vy, version + 1, time.monotonic(),
+                arrived_at, prev_map, prev_arrived_at,
+            )
+            if record[:STATE_SIZE] != self._buf[offset:offset + STATE_SIZE]:
+                self._buf[offset:offset + RECORD.size] = record
+                self._touch_map(map_id, version + 1)
+                if map_id != old_map:
+                    self._touch_map(old_map, version + 1)
+                self._set_version(version + 1)
+            return True
+
+    def _read(self) -> tuple[int, bytes]:
+        """The world version and a consistent copy of every record"""
+        with self._lock:
+            version, count, _ = HEADER.unpack_from(self._buf, 0)
+            return version, self._buf[self._records_at:self._offset(count)]
+
+    def _players(self, data: bytes, map_name: str | None, since: int) -> tuple[dict, list[int]]:
+        """Players on map_name changed after since, and the ones that left it or were removed after since"""
+        names = self.map_names
+        map_id = None if map_name is None else self._map_ids.get(map_name, -1)
+        players = {}
+        removed = []
+        for pid, (used, flags, mid, x, y, vx, vy, changed_at, _, arrived_at, prev_map, prev_arrived_at) in enumerate(
+            RECORD.iter_unpack(data)
+        ):
+            if changed_at <= since:
+                continue
+            if used and (map_id is None or mid == map_id):
+                direction, moving = binaryProtocol.unpack_flags(flags)
+                players[pid] = {
+                    "id": pid, "x": x, "y": y, "map": names[mid],
+                    "direction": direction, "moving": moving, "vx": vx, "vy": vy,
+                }
+            elif since < 0:
+                continue
+            elif map_id is None or (arrived_at > since and (prev_map == map_id or prev_arrived_at > since)):
+                # Left the map, or was removed, after since. One that changed map twice since
+                # may have started out on this one, it is listed too and clients ignore ids they never had.
+                removed.append(pid)
+        return players, removed
+
+    def list_players(self, map_name: str | None = None) -> dict:
+        return self.snapshot(map_name)[1]
+
+    def snapshot(self, map_name: str | None = None) -> tuple[int, dict]:
+        version, data = self._read()
+        return version, self._players(data, map_name, -1)[0]
+
+    def near(self, map_name: str, x: float, y: float, r: float) -> tuple[int, dict]:
+        """Same as PlayerHandler.near, by scanning the table"""
+        version, players = self.snapshot(map_name)
+        r2 = r * r
+        return version, {pid: p for pid, p in players.items() if (p["x"] - x) ** 2 + (p["y"] - y) ** 2 <= r2}
+
+    def delta(self, since: int, map_name: str | None = None) -> Delta | None:
+        """Like PlayerHandler.delta, but every call scans the table"""
+        version, data = self._read()
+        if since == version:
+            return None
+        if since < 0 or since > version:
+            return Delta(version, True, self._players(data, map_name, -1)[0], [])
+        if map_name is not None:
+            # Read after the records, so it is never older than them
+            self._refresh_maps()
+            if self._map_version(self._map_ids.get(map_name, -1)) <= since:
+                return None
+        players, removed = self._players(data, map_name, since)
+        return Delta(version, False, players, removed)
+
+    def count_by_map(self) -> dict[str, int]:
+        _, data = self._read()
+        names = self.map_names
+        counts: dict[str, int] = {}
+        for used, _, mid, *_ in RECORD.iter_unpack(data):
+            if used:
+                counts[names[mid]] = counts.get(names[mid], 0) + 1
+        return counts
+
+    def exported_metrics(self) -> list:
+        """Everything exported on GET /metrics, the cleaner's pass_seconds only fills in the parent process"""
+        return [
+            metrics.Gauge(
+                "players_active", "Registered players per map", ("map",),
+                lambda: {(name,): n for name, n in self.count_by_map().items()},
+            ),
+            metrics.Gauge(
+                "player_world_version", "Version of the last change to the world", (),
+                lambda: {(): self.version},
+            ),
+            self.cleaner.pass_seconds,
+        ]
+
+    # Encoded replies, cached per process for the current world version
+    def encoded_snapshot(self, map_name: str | None = None, binary: bool = False) -> Snapshot:
+        return self._replies.get(("snapshot", map_name, binary), self._encode_snapshot)
+
+    def _encode_snapshot(self, key: tuple) -> Snapshot:
+        _, map_name, binary = key
+        version, players = self.snapshot(map_name)
+        return Snapshot(version, encode_snapshot(version, players, self._map_ids, binary))
+
+    def encoded_delta(self, since: int, map_name: str | None = None, binary: bool = False) -> bytes | None:
+        if since == self.version:
+            return None
+        return self._replies.get((map_name, since, binary), self._encode_delta)
+
+    def _encode_delta(self, key: tuple) -> bytes | None:
+        map_name, since, binary = key
+        delta = self.delta(since, map_name)
+        return None if delta is None else encode_delta(delta, self._map_ids, binary)
@@ -0,0 +1,254 @@
+import json
+import socket
+import socketserver
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable
+
+from server.playerHandler import MapTableFull, PlayerHandler
+from server.binaryProtocol import DIRECTIONS, finite, in_world, valid_map_name
+
+STREAM_PORT = 8990
+TICK_RATE = 20.0
+# Longest a client may ask to go between pushes
+MAX_PUSH_INTERVAL = 5.0
+
+
+@dataclass(eq=False)
+class Subscriber:
+    sock: socket.socket
+    pid: int = -1
+    # Map the client is on, None (whole world) until its first update
+    map: str | None = None
+    # (map, world version) last queued for this client
+    queued: tuple[str | None, int] = (None, -1)
+    # (map, world version) the client is known to have, deltas are built from here
+    sent: tuple[str | None, int] = (None, -1)
+    alive: bool = True
+    # Seconds the client wants at least between pushes, and when the last one was queued
+    interval: float = 0.0
+    pushed_at: float = 0.0
+    _pending: tuple[bytes, tuple[str | None, int]] | None = None
+    # Replies to pings and errors, written before any delta
+    _control: deque[bytes] = field(default_factory=deque)
+    _wake: threading.Event = field(default_factory=threading.Event)
+
+    def since(self) -> int:
+        # A client that changed map starts over with a full snapshot of the new one
+        map_name, version = self.sent
+        return version if map_name == self.map else -1
+
+    def push(self, data: bytes, state: tuple[str | None, int]) -> None:
+        # Only the newest delta is kept. It is built from sent, so it also
+        # covers whatever an unsent one it replaces would have carried.
+        self._pending = (data, state)
+        self.queued = state
+        self.pushed_at = time.monotonic()
+        self._wake.set()
+
+    def send_control(self, data: bytes) -> None:
+        self._control.append(data)
+        self._wake.set()
+
+    def close(self) -> None:
+        self.alive = False
+        self._wake.set()
+
+    def run_writer(self) -> None:
+        while self.alive:
+            self._wake.wait()
+            self._wake.clear()
+            try:
+                while self._control:
+                    self.sock.sendall(self._control.popleft())
+                pending, self._pending = self._pending, None
+                if pending is None:
+                    continue
+                data, state = pending
+                self.sock.sendall(data)
+                self.sent = state
+            except OSError:
+                self.alive = False
+        try:
+            # Wakes the reader thread of a connection that died while writing
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class StreamHandler(socketserver.StreamRequestHandler):
+    """
+    One persistent connection per client, newline delimited JSON both ways.
+
+    Client -> server:
+        {"type": "hello", "id": <player id from /register>}
+        {"type": "update", "x": .., "y": .., "map": .., "direction": .., "moving": .., "vx": .., "vy": ..}
+        {"type": "rate", "interval": <seconds at least between pushes, 0 for every tick>}
+        {"type": "ping", "t": ..}
+    Server -> client, the GET /players?since= reply for the client's current map:
+        {"version": .., "full": .., "players": {...}, "removed": [...]}
+    and the answer to a ping, with its t unchanged and whether the server is
+    overloaded, in which case the client should ask for fewer pushes:
+        {"type": "pong", "t": .., "busy": ..}
+    An update for an id the server does not know (expired, or from before
+    a restart) is answered once, and later updates are ignored until the
+    client registers again and says hello with its new id:
+        {"type": "error", "error": "player_not_found"}
+    An update naming a map the server has no room left for is dropped, and
+    answered with the id kept:
+        {"type": "error", "error": "map_table_full"}
+    """
+    server: "StreamServer"
+
+    def handle(self) -> None:
+        sub = self.server.subscribe(self.connection)
+        # Writes get their own thread so a client that stops reading only stalls itself
+        writer = threading.Thread(target=sub.run_writer, name="StreamWriter", daemon=True)
+        writer.start()
+        try:
+            while sub.alive:
+                line = self.rfile.readline()
+                if not line:
+                    break
+                try:
+                    msg = json.loads(line.decode("utf-8"))
+                except ValueError:
+                    break
+                if not isinstance(msg, dict) or not self._on_message(sub, msg):
+                    break
+        except OSError:
+            pass
+        finally:
+            self.server.unsubscribe(sub)
+
+    def _on_message(self, sub: Subscriber, msg: dict) -> bool:
+        """False if msg is malformed, which ends the connection as a line that is not JSON does"""
+        kind = msg.get("type")
+        if kind == "hello":
+            try:
+                sub.pid = int(msg.get("id", -1))
+            except (ValueError, TypeError, OverflowError):
+                return False
+        elif kind == "ping":
+            pong = {"type": "pong", "t": msg.get("t"), "busy": self.server.busy()}
+            sub.send_control((json.dumps(pong) + "\n").encode("utf-8"))
+        elif kind == "rate":
+            try:
+                sub.interval = min(max(float(msg["interval"]), 0.0), MAX_PUSH_INTERVAL)
+            except (KeyError, ValueError, TypeError):
+                pass
+        elif kind == "update" and sub.pid != -1:
+            direction = msg.get("direction")
+            if direction not in DIRECTIONS:
+                direction = None
+            moving = bool(msg["moving"]) if "moving" in msg else None
+            try:
+                x, y = float(msg["x"]), float(msg["y"])
+                velocity = (float(msg["vx"]), float(msg["vy"])) if "vx" in msg and "vy" in msg else None
+                map_name = str(msg["map"])
+                if not in_world(x, y) or not finite(*(velocity or ())) or not valid_map_name(map_name):
+                    return
+                if self.server.player_handler.update(sub.pid, x, y, map_name, direction, moving, velocity):
+                    sub.map = map_name
+                else:
+                    sub.pid = -1
+                    error = {"type": "error", "error": "player_not_found"}
+                    sub.send_control((json.dumps(error) + "\n").encode("utf-8"))
+            except MapTableFull:
+                error = {"type": "error", "error": "map_table_full"}
+                sub.send_control((json.dumps(error) + "\n").encode("utf-8"))
+            except (KeyError, ValueError, TypeError, OverflowError):
+                pass
+        return True
+
+
+class StreamServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    player_handler: PlayerHandler
+    tick_rate: float
+    # Whether pongs tell clients the server is overloaded
+    busy: Callable[[], bool]
+
+    _subscribers: set[Subscriber]
+    _subs_lock: threading.Lock
+    _stop_event: threading.Event
+    _thread: threading.Thread | None
+
+    def __init__(
+        self, address: tuple[str, int], player_handler: PlayerHandler, *,
+        tick_rate: float = TICK_RATE, busy: Callable[[], bool] = lambda: False,
+    ):
+        super().__init__(address, StreamHandler)
+        self.player_handler = player_handler
+        self.tick_rate = tick_rate
+        self.busy = busy
+
+        self._subscribers = set()
+        self._subs_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def subscribe(self, sock: socket.socket) -> Subscriber:
+        sub = Subscriber(sock)
+        with self._subs_lock:
+            self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscriber) -> None:
+        sub.close()
+        with self._subs_lock:
+            self._subscribers.discard(sub)
+
+    # Threading
+    def start(self) -> None:
+        if getattr(self.player_handler, "tick_rate", 0) > 0:
+            # The world ticks itself, push once per tick right after it
+            self.player_handler.add_tick_listener(self._push_stale)
+            return
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._broadcast, name="StreamBroadcaster", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=2.0)
+
+    def _broadcast(self) -> None:
+        interval = 1.0 / self.tick_rate
+        while not self._stop_event.wait(interval):
+            self._push_stale(self.player_handler.version)
+
+    def _push_stale(self, version: int) -> None:
+        # Pushes happen at a fixed rate, and only to clients that are behind,
+        # so an idle world costs nothing no matter how many clients are connected
+        with self._subs_lock:
+            subs = list(self._subscribers)
+        if not subs:
+            return
+        stale: dict[tuple[str | None, int], list[Subscriber]] = {}
+        # Ticks wobble, half a tick early still counts as due
+        due = time.monotonic() + 0.5 / self.tick_rate
+        for sub in subs:
+            # A client that asked for fewer pushes waits, the next delta it gets covers what it skipped
+            if sub.queued != (sub.map, version) and due - sub.pushed_at >= sub.interval:
+                stale.setdefault((sub.map, sub.since()), []).append(sub)
+
+        # Clients on the same map that are equally behind share one encoded delta
+        for (map_name, since), group in stale.items():
+            body = self.player_handler.encoded_delta(since, map_name)
+            if body is None:
+                # Something changed, but not on this map
+                for sub in group:
+                    sub.queued = (map_name, version)
+                continue
+            # The delta may be newer than version, then the next one repeats a little
+            data = body + b"\n"
+            for sub in group:
+                sub.push(data, (map_name, version))
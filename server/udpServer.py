@@ -0,0 +1,84 @@
+import socket
+import socketserver
+import struct
+
+from server import binaryProtocol
+from server.playerHandler import PlayerHandler
+
+UDP_PORT = 8991
+
+
+class UdpHandler(socketserver.BaseRequestHandler):
+    """
+    One datagram from a client, see binaryProtocol for the format. Every
+    UPDATE is answered with the changes on the client's map since its ack,
+    so the client both sends and polls with it and a lost datagram is
+    simply covered by the next one. An UPDATE from an id the server does
+    not know is answered with NOT_FOUND instead.
+    """
+    server: "UdpServer"
+
+    def handle(self) -> None:
+        data, sock = self.request
+        try:
+            kind, seq, payload = binaryProtocol.decode_datagram(data)
+            if kind != binaryProtocol.UPDATE:
+                return
+            ack, (pid, x, y, map_id, flags, vx, vy) = binaryProtocol.decode_udp_update(payload)
+            map_name = self.server.player_handler.map_names[map_id]
+        except (ValueError, IndexError, struct.error):
+            return
+        if not binaryProtocol.in_world(x, y):
+            return
+
+        last = self.server.last_seq.get(pid)
+        if last is not None and not binaryProtocol.seq_newer(seq, last):
+            # Late or duplicated, a newer state is already applied
+            self.server.stale += 1
+            return
+        direction, moving = binaryProtocol.unpack_flags(flags)
+        if not self.server.player_handler.update(pid, x, y, map_name, direction, moving, (vx, vy)):
+            # Expired, or registered with a server that has restarted since
+            self.server.last_seq.pop(pid, None)
+            reply = binaryProtocol.encode_datagram(binaryProtocol.NOT_FOUND, seq)
+        else:
+            self.server.last_seq[pid] = seq
+            reply = self._reply(seq, ack, map_name)
+        try:
+            sock.sendto(reply, self.client_address)
+        except OSError:
+            pass
+
+    def _reply(self, seq: int, ack: int, map_name: str) -> bytes:
+        body = self.server.player_handler.encoded_delta(ack, map_name, True)
+        if body is None:
+            return binaryProtocol.encode_datagram(binaryProtocol.UNCHANGED, seq)
+        if binaryProtocol.DATAGRAM.size + len(body) > binaryProtocol.MAX_DATAGRAM:
+            # Full snapshots of a busy map go over HTTP instead
+            return binaryProtocol.encode_datagram(binaryProtocol.RESYNC, seq)
+        return binaryProtocol.encode_datagram(binaryProtocol.DELTA, seq, body)
+
+
+class UdpServer(socketserver.UDPServer):
+    """
+    Optional UDP channel for position updates and deltas. Datagrams are
+    handled one at a time on the serving thread, each is only a dict lookup
+    and a cached encode. Registration and the map table stay on HTTP.
+    """
+    allow_reuse_address = True
+
+    player_handler: PlayerHandler
+    # Highest seq applied per player, older datagrams are dropped
+    last_seq: dict[int, int]
+    stale: int
+
+    def __init__(self, address: tuple[str, int], player_handler: PlayerHandler):
+        super().__init__(address, UdpHandler)
+        self.player_handler = player_handler
+        self.last_seq = {}
+        self.stale = 0
+
+    def server_bind(self) -> None:
+        # Room for a burst of datagrams from many clients while one is handled
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        super().server_bind()
@@ -164,6 +164,12 @@ class GameManager:
 
         return False
 
+    def check_collisions(self, rects: list[pg.Rect]) -> list[bool]:
+        """check_collision() for every rect, the map answers all of them in one pass"""
+        hits = self.maps[self.current_map_key].check_collisions(rects)
+        entities = [entity.animation.rect for entity in self.enemy_trainers[self.current_map_key]]
+        return [hit or rect.collidelist(entities) != -1 for rect, hit in zip(rects, hits)]
+
     def save(self, path: str) -> None:
         try:
             with open(path, "w") as f:
@@ -1,39 +1,295 @@
+import json
 import requests
+import socket
 import threading
 import time
+from collections import deque
+from typing import Callable
+from urllib.parse import urlparse
+from server import binaryProtocol
 from src.utils import Logger, GameSettings
 
-POLL_INTERVAL = 0.02
+# Poll interval with other players around, the rest adapts to the game and
+# the server within ONLINE_MIN_POLL_INTERVAL and ONLINE_MAX_POLL_INTERVAL
+POLL_INTERVAL = 0.1
+IDLE_POLL_INTERVAL = 0.5
+PAUSED_POLL_INTERVAL = 1.0
+# Moving remote players closer than this many pixels get polled as fast as allowed
+NEARBY_DISTANCE = 1024.0
+# A round trip slower than twice the fastest one plus this means the server queues requests
+QUEUEING_DELAY = 0.1
+MAX_BACKOFF = 8.0
+# Seconds between RTT probes on the stream, which has no round trips of its own
+PING_INTERVAL = 2.0
+RECONNECT_INTERVAL = 1.0
+# Remote players are drawn this far in the past, so there are usually two
+# samples to interpolate between even when one arrives late
+INTERPOLATION_DELAY = 0.15
+# Our state is sent when remote players extrapolating the last one sent
+# would be off by more than this many pixels, or on a heartbeat
+DEAD_RECKONING_ERROR = 8.0
+HEARTBEAT_INTERVAL = 2.0
+# Past the newest sample a player is extrapolated for at most this long,
+# enough to get to the next heartbeat of one walking in a straight line
+MAX_EXTRAPOLATION = HEARTBEAT_INTERVAL + 0.5
+# Samples kept per remote player, more than INTERPOLATION_DELAY worth at 60 updates a second
+HISTORY_SIZE = 32
+# A jump longer than this (pixels) is a teleport, drawn at once instead of sliding there
+SNAP_DISTANCE = 256.0
+# Silence on the UDP channel for this long means the server does not offer it
+UDP_TIMEOUT = 3.0
+
+# x, y, map, direction, moving, vx, vy
+PlayerState = tuple[float, float, str, str, bool, int, int]
+
+class RemoteTrack:
+    """Timestamped positions of one remote player, sampled where it should be drawn"""
+    # time, x, y, vx, vy
+    samples: deque[tuple[float, float, float, float, float]]
+
+    def __init__(self):
+        self.samples = deque(maxlen=HISTORY_SIZE)
+
+    def add(self, now: float, x: float, y: float, vx: float = 0.0, vy: float = 0.0) -> None:
+        if self.samples:
+            t, last_x, last_y, last_vx, last_vy = self.samples[-1]
+            expected_x, expected_y = last_x + last_vx * (now - t), last_y + last_vy * (now - t)
+            if (x - expected_x) ** 2 + (y - expected_y) ** 2 > SNAP_DISTANCE ** 2:
+                self.samples.clear()
+            elif last_vx == last_vy == 0 and now - t > 2 * POLL_INTERVAL:
+                # Standing still sends nothing, so the player started walking
+                # about one interval ago rather than gliding there since t
+                self.samples.append((now - POLL_INTERVAL, last_x, last_y, 0.0, 0.0))
+        self.samples.append((now, x, y, vx, vy))
+
+    def position(self, t: float) -> tuple[float, float]:
+        samples = self.samples
+        if t <= samples[0][0]:
+            return samples[0][1], samples[0][2]
+        for (t0, x0, y0, _, _), (t1, x1, y1, _, _) in zip(samples, list(samples)[1:]):
+            if t <= t1:
+                k = (t - t0) / (t1 - t0) if t1 > t0 else 1.0
+                return x0 + (x1 - x0) * k, y0 + (y1 - y0) * k
+        # Nothing newer yet, keep going along the velocity it was sent with
+        t1, x1, y1, vx, vy = samples[-1]
+        ahead = min(t - t1, MAX_EXTRAPOLATION)
+        return x1 + vx * ahead, y1 + vy * ahead
+
+
+class DeadReckoning:
+    """
+    Picks the states worth sending out of the one the game reports every
+    frame: a change of map, direction or moving, a position remote players
+    extrapolating the last sent state would get wrong by more than
+    DEAD_RECKONING_ERROR, and a heartbeat. Walking in a straight line or
+    standing still sends next to nothing.
+    """
+    # When the last state was sent, and that state
+    _sent: tuple[float, PlayerState] | None
+    # Time, position and map of the previous frame, to measure the velocity
+    _previous: tuple[float, float, float, str] | None
+
+    def __init__(self):
+        self._sent = None
+        self._previous = None
+
+    def reset(self) -> None:
+        """Send the next state whatever it is"""
+        self._sent = None
+
+    def observe(
+        self, now: float, x: float, y: float, map_name: str, direction: str, moving: bool,
+    ) -> PlayerState | None:
+        """The state to send for this frame, None if remote players can predict it"""
+        vx = vy = 0
+        previous, self._previous = self._previous, (now, x, y, map_name)
+        if moving and previous is not None and previous[3] == map_name and now > previous[0]:
+            dx, dy = x - previous[1], y - previous[2]
+            # A warp is no velocity
+            if dx * dx + dy * dy <= SNAP_DISTANCE ** 2:
+                dt = now - previous[0]
+                # Whole pixels per second, what the server keeps
+                vx, vy = binaryProtocol.pack_velocity(dx / dt, dy / dt)
+        state = (x, y, map_name, direction, moving, vx, vy)
+
+        if self._sent is not None:
+            t, (sent_x, sent_y, sent_map, sent_direction, sent_moving, sent_vx, sent_vy) = self._sent
+            elapsed = now - t
+            if (
+                (map_name, direction, moving) == (sent_map, sent_direction, sent_moving)
+                and elapsed < HEARTBEAT_INTERVAL
+                and (sent_x + sent_vx * elapsed - x) ** 2 + (sent_y + sent_vy * elapsed - y) ** 2
+                <= DEAD_RECKONING_ERROR ** 2
+            ):
+                return None
+        self._sent = (now, state)
+        return state
+
+
+class PollRate:
+    """
+    How long to wait between round trips. Polls as fast as allowed while
+    players nearby are moving, slower when nobody else is on the map or the
+    game is paused, and backs off further while the server is overloaded:
+    it says so, fails, or answers much slower than its fastest.
+    """
+    # Smoothed round trip time in seconds, None until the first reply
+    rtt: float | None
+    _min_rtt: float
+    # The interval is multiplied by this, doubled on every sign of overload
+    backoff: float
+    paused: bool
+
+    def __init__(self):
+        self.rtt = None
+        self._min_rtt = float("inf")
+        self.backoff = 1.0
+        self.paused = False
+
+    def measured(self, rtt: float, busy: bool = False) -> None:
+        self.rtt = rtt if self.rtt is None else self.rtt + (rtt - self.rtt) / 8
+        self._min_rtt = min(self._min_rtt, rtt)
+        if busy or rtt > 2 * self._min_rtt + QUEUEING_DELAY:
+            self.failed()
+        else:
+            # Back to normal a little at a time, so a busy server is not hit at full rate at once
+            self.backoff = max(1.0, self.backoff * 0.8)
+
+    def failed(self) -> None:
+        self.backoff = min(self.backoff * 2, MAX_BACKOFF)
+
+    def interval(self, players: list[dict], map_name: str | None, position: tuple[float, float] | None) -> float:
+        """Seconds until the next round trip, given the remote players and where we are"""
+        others = [p for p in players if p.get("map") == map_name]
+        if self.paused:
+            interval = PAUSED_POLL_INTERVAL
+        elif not others:
+            interval = IDLE_POLL_INTERVAL
+        elif position is not None and any(
+            p.get("moving") and (p["x"] - position[0]) ** 2 + (p["y"] - position[1]) ** 2 <= NEARBY_DISTANCE ** 2
+            for p in others
+        ):
+            interval = GameSettings.ONLINE_MIN_POLL_INTERVAL
+        else:
+            interval = POLL_INTERVAL
+        interval *= self.backoff
+        return min(max(interval, GameSettings.ONLINE_MIN_POLL_INTERVAL), GameSettings.ONLINE_MAX_POLL_INTERVAL)
+
 
 class OnlineManager:
     list_players: list[dict]
     player_id: int
-    
+    # Local copy of the players on our map, kept in sync by applying deltas
+    _players: dict[int, dict]
+    _version: int
+    # Map the player was last seen on, the server only sends players there
+    _map: str | None
+    _table_map: str | None
+    # Map table of the binary protocol, fetched from the server when needed
+    _map_names: list[str]
+    _map_ids: dict[str, int]
+    # Position history of every remote player, for drawing them smoothly
+    _tracks: dict[int, RemoteTrack]
+    # Where the player was last seen, to tell which remote players are nearby
+    _position: tuple[float, float] | None
+    _rate: PollRate
+    # Interval the network thread last waited or asked the stream for
+    _interval: float
+    _requested_interval: float | None
+    # Last seq sent over UDP. The server drops datagrams not newer than the
+    # last one it applied from our id, so it carries on from run to run
+    _udp_seq: int
+
+    # Set to stop the threads of the current run, every start() gets a new one
     _stop_event: threading.Event
     _thread: threading.Thread | None
     _lock: threading.Lock
-    
+    _sock: socket.socket | None
+    _send_lock: threading.Lock
+    _sender: threading.Thread | None
+
+    # Newest state from the game thread that is not sent yet, only the latest is kept
+    _pending: PlayerState | None
+    _reckoning: DeadReckoning
+    _state_lock: threading.Lock
+    _wake: threading.Event
+
     def __init__(self):
         self.base: str = GameSettings.ONLINE_SERVER_URL
         self.player_id = -1
         self.list_players = []
+        self._players = {}
+        self._version = -1
+        self._map = None
+        self._table_map = None
+        self._map_names = []
+        self._map_ids = {}
+        self._tracks = {}
+        self._position = None
+        self._rate = PollRate()
+        self._interval = POLL_INTERVAL
+        self._requested_interval = None
+        self._udp_seq = 0
+        # Reuse one keep-alive connection instead of reconnecting every poll
+        self._session = requests.Session()
 
         self._thread = None
         self._stop_event = threading.Event()
         self._lock = threading.Lock()
-        
+
+        # Push-based stream, used instead of polling when the server offers it
+        self._sock = None
+        self._send_lock = threading.Lock()
+        self._sender = None
+
+        self._pending = None
+        self._reckoning = DeadReckoning()
+        self._state_lock = threading.Lock()
+        self._wake = threading.Event()
+
         Logger.info("OnlineManager initialized")
-        
+
     def enter(self):
-        self.register()
+        # Registration happens on the network thread, update() does nothing until then
         self.start()
-            
+
     def exit(self):
         self.stop()
-        
+
+    def set_paused(self, paused: bool) -> None:
+        """The game is behind an overlay, remote players matter less until it is closed"""
+        if paused != self._rate.paused:
+            self._rate.paused = paused
+            # The stream sender tells the server right away
+            self._wake.set()
+
+    @property
+    def rtt(self) -> float | None:
+        """Smoothed round trip time to the server in seconds, None until measured"""
+        return self._rate.rtt
+
+    @property
+    def poll_interval(self) -> float:
+        """Seconds between round trips, or between pushes on the stream, right now"""
+        return self._interval
+
+    @property
+    def rate(self) -> float:
+        """poll_interval as updates per second"""
+        return 1.0 / self._interval
+
     def get_list_players(self) -> list[dict]:
+        """Remote players, at the position they should be drawn at right now"""
+        t = time.monotonic() - INTERPOLATION_DELAY
         with self._lock:
-            return list(self.list_players)
+            players = []
+            for p in self.list_players:
+                track = self._tracks.get(p["id"])
+                if track is not None:
+                    x, y = track.position(t)
+                    p = {**p, "x": x, "y": y}
+                players.append(p)
+            return players
 
     # ------------------------------------------------------------------
     # Threading and API Calling Below
@@ -41,7 +297,7 @@ class OnlineManager:
     def register(self):
         try:
             url = f"{self.base}/register"
-            resp = requests.get(url, timeout=5)
+            resp = self._session.get(url, timeout=5)
             resp.raise_for_status()
             data = resp.json()
             if resp.status_code == 200:
@@ -53,58 +309,474 @@ class OnlineManager:
             Logger.warning(f"OnlineManager registration error: {e}")
         return
 
-    def update(self, x: float, y: float, map_name: str) -> bool:
+    def _lost_id(self) -> None:
+        """
+        The server does not know our id, it expired us or restarted. The
+        network thread registers again before it sends anything else.
+        """
+        Logger.warning(f"OnlineManager id={self.player_id} is unknown to the server, registering again")
+        self.player_id = -1
+        # The first state under the new id is sent whatever it is
+        self._reckoning.reset()
+
+    def _registered(self) -> bool:
+        """Register again after _lost_id, False while the server still does not know us"""
+        if self.player_id == -1:
+            self.register()
+            if self.player_id == -1:
+                self._rate.failed()
+        return self.player_id != -1
+
+    def update(self, x: float, y: float, map_name: str, direction: str = "down", moving: bool = False) -> bool:
+        """
+        Queue the player's state for the background threads. Never touches
+        the network, so the game loop cannot stall on a slow server.
+        """
         if self.player_id == -1:
             # Try to register again
             return False
-        
-        url = f"{self.base}/players"
-        body = {"id": self.player_id, "x": x, "y": y, "map": map_name}
-        try:
-            resp = requests.post(url, json=body, timeout=5)
-            if resp.status_code == 200:
-                return True
-            Logger.warning(f"Update failed: {resp.status_code} {resp.text}")
-        except Exception as e:
-            if self._on_error:
-                try:
-                    self._on_error(e)
-                except Exception:
-                    pass
-            Logger.warning(f"Online update error: {e}")
-        return False
+        if direction not in binaryProtocol.DIRECTIONS:
+            direction = "down"
+        self._map = map_name
+        self._position = (x, y)
+        state = self._reckoning.observe(time.monotonic(), x, y, map_name, direction, moving)
+        if state is not None:
+            with self._state_lock:
+                # An older unsent state is dropped
+                self._pending = state
+            self._wake.set()
+        return True
+
+    def _take_pending(self) -> PlayerState | None:
+        with self._state_lock:
+            state, self._pending = self._pending, None
+            return state
+
+    def _requeue(self, state: PlayerState) -> None:
+        # A failed send is retried unless the game already queued something newer
+        with self._state_lock:
+            if self._pending is None:
+                self._pending = state
 
     def start(self) -> None:
-        if self._thread and self._thread.is_alive():
+        if self._thread and self._thread.is_alive() and not self._stop_event.is_set():
             return
-        self._stop_event.clear()
-        self._thread = threading.Thread(
-            target=self._loop,
-            name="OnlineManagerPoller",
-            daemon=True
-        )
+        # Threads of a previous run may still be finishing a request, they keep their own event
+        stop = self._stop_event = threading.Event()
+        if GameSettings.ONLINE_USE_UDP:
+            loop = self._udp_loop
+        elif GameSettings.ONLINE_USE_STREAM:
+            loop = self._stream_loop
+        else:
+            loop = self._loop
+        self._thread = threading.Thread(target=self._run, args=(stop, loop), name="OnlineManagerPoller", daemon=True)
         self._thread.start()
+        if loop == self._stream_loop:
+            self._sender = threading.Thread(target=self._send_loop, args=(stop,), name="OnlineManagerSender", daemon=True)
+            self._sender.start()
 
     def stop(self) -> None:
+        """
+        Stop the threads without waiting for them, so leaving the scene never
+        waits on the server. A request in flight finishes in the background.
+        """
         self._stop_event.set()
-        if self._thread and self._thread.is_alive():
-            self._thread.join(timeout=2)
-
-    def _loop(self) -> None:
-        while not self._stop_event.wait(POLL_INTERVAL):
-            self._fetch_players()
-            
-    def _fetch_players(self) -> None:
+        self._wake.set()
+        self._close_stream()
+
+    def wait_registered(self, timeout: float) -> bool:
+        """Block until the network thread registered us, for tools and benchmarks"""
+        deadline = time.monotonic() + timeout
+        while self.player_id == -1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return self.player_id != -1
+
+    def _run(self, stop: threading.Event, loop: Callable[[threading.Event], None]) -> None:
+        # Only the first run registers, later ones keep the id the server already knows
+        while self.player_id == -1:
+            self.register()
+            if self.player_id != -1 or stop.wait(RECONNECT_INTERVAL):
+                break
+        if not stop.is_set():
+            loop(stop)
+
+    def _next_interval(self) -> float:
+        with self._lock:
+            players = self.list_players
+        self._interval = self._rate.interval(players, self._map, self._position)
+        return self._interval
+
+    def _wait_next(self, stop: threading.Event, since: float) -> bool:
+        """
+        Wait until the poll interval after since is over. The interval is
+        checked again while waiting, so closing an overlay is picked up at
+        once. True when stopped.
+        """
+        while (left := since + self._next_interval() - time.monotonic()) > 0:
+            if stop.wait(min(left, GameSettings.ONLINE_MIN_POLL_INTERVAL)):
+                return True
+        return False
+
+    def _loop(self, stop: threading.Event) -> None:
+        while not self._wait_next(stop, time.monotonic()):
+            self._sync()
+
+    def _sync(self) -> None:
+        """
+        One round trip: send the pending state if there is one and get the
+        players that changed on our map in the same reply.
+        """
+        if not self._registered():
+            return
+        state = self._take_pending()
+        map_name = state[2] if state is not None else self._map
+        if map_name is None:
+            return
+        if map_name != self._table_map:
+            # New map, start over with a full snapshot of it
+            self._version = -1
+            self._table_map = map_name
+
+        binary = GameSettings.ONLINE_BINARY
+        headers = {"Accept": binaryProtocol.CONTENT_TYPE} if binary else {}
         try:
-            url = f"{self.base}/players"
-            resp = requests.get(url, timeout=5)
+            start = time.monotonic()
+            if state is None:
+                params = {"since": self._version, "map": map_name}
+                resp = self._session.get(f"{self.base}/players", params=params, headers=headers, timeout=5)
+            else:
+                resp = self._post_sync(state, headers, binary)
+            self._rate.measured(
+                time.monotonic() - start, busy=resp.status_code == 503 or "X-Server-Busy" in resp.headers,
+            )
+            if resp.status_code == 404 and resp.json().get("error") == "player_not_found":
+                # The state goes out again under the new id
+                self._lost_id()
+                if state is not None:
+                    self._requeue(state)
+                return
+            if resp.status_code == 400 and resp.json().get("error") == "map_table_full":
+                # Sending it again cannot help, the server has no room for this map
+                Logger.warning(f"OnlineManager: server cannot hold map {map_name}")
+                return
+            if resp.status_code == 304:
+                return
             resp.raise_for_status()
-            all_players = resp.json().get("players", [])
+            if resp.headers.get("Content-Type") == binaryProtocol.CONTENT_TYPE:
+                self._apply_delta(self._decode_delta(resp.content))
+            else:
+                self._apply_delta(resp.json())
 
-            pid = self.player_id
-            filtered = [p for key, p in all_players.items() if int(key) != pid]
-            with self._lock:
-                self.list_players = filtered
-            
         except Exception as e:
-            Logger.warning(f"OnlineManager fetch error: {e}")
\ No newline at end of file
+            if state is not None:
+                self._requeue(state)
+            self._rate.failed()
+            Logger.warning(f"OnlineManager sync error: {e}")
+
+    def _post_sync(self, state: PlayerState, headers: dict, binary: bool) -> requests.Response:
+        x, y, map_name, direction, moving, vx, vy = state
+        url = f"{self.base}/sync"
+        params = {"since": self._version}
+        map_id = self._map_id(map_name) if binary else binaryProtocol.NO_MAP
+        if map_id != binaryProtocol.NO_MAP:
+            record = (
+                self.player_id, x, y, map_id,
+                binaryProtocol.pack_flags(direction, moving), vx, vy,
+            )
+            headers = {**headers, "Content-Type": binaryProtocol.CONTENT_TYPE}
+            return self._session.post(
+                url, params=params, data=binaryProtocol.encode_update(record), headers=headers, timeout=5
+            )
+        # Also the first update on a map the server has no index for yet, this one adds it
+        return self._session.post(url, params=params, json=self._json_update(state), headers=headers, timeout=5)
+
+    def _json_update(self, state: PlayerState) -> dict:
+        x, y, map_name, direction, moving, vx, vy = state
+        return {
+            "id": self.player_id, "x": x, "y": y, "map": map_name,
+            "direction": direction, "moving": moving, "vx": vx, "vy": vy,
+        }
+
+    def _apply_delta(self, data: dict) -> None:
+        if data.get("full"):
+            self._players = {}
+        for key in data.get("removed", []):
+            self._players.pop(int(key), None)
+        changed = data.get("players", {})
+        for key, p in changed.items():
+            self._players[int(key)] = p
+        self._version = data.get("version", -1)
+
+        pid = self.player_id
+        filtered = [p for key, p in self._players.items() if key != pid]
+        now = time.monotonic()
+        with self._lock:
+            self.list_players = filtered
+            for key, p in changed.items():
+                self._tracks.setdefault(int(key), RemoteTrack()).add(
+                    now, p["x"], p["y"], p.get("vx", 0.0), p.get("vy", 0.0),
+                )
+            for key in [key for key in self._tracks if key not in self._players]:
+                del self._tracks[key]
+
+    # ------------------------------------------------------------------
+    # Binary protocol
+    # ------------------------------------------------------------------
+    def _fetch_map_table(self) -> None:
+        resp = self._session.get(f"{self.base}/maps", timeout=5)
+        resp.raise_for_status()
+        self._map_names = resp.json()["maps"]
+        self._map_ids = {name: i for i, name in enumerate(self._map_names)}
+
+    def _map_id(self, map_name: str) -> int:
+        """Index of map_name, NO_MAP until a JSON update has put it in the server's table"""
+        if map_name not in self._map_ids:
+            self._fetch_map_table()
+        return self._map_ids.get(map_name, binaryProtocol.NO_MAP)
+
+    def _decode_delta(self, data: bytes) -> dict:
+        version, full, records, removed = binaryProtocol.decode_delta(data)
+        if any(map_id >= len(self._map_names) for _, _, _, map_id, *_ in records):
+            # The table only grows, a newer copy knows every index
+            self._fetch_map_table()
+        players = {}
+        for pid, x, y, map_id, flags, vx, vy in records:
+            direction, moving = binaryProtocol.unpack_flags(flags)
+            players[pid] = {
+                "id": pid,
+                "x": x,
+                "y": y,
+                "map": self._map_names[map_id] if map_id < len(self._map_names) else "",
+                "direction": direction,
+                "moving": moving,
+                "vx": vx,
+                "vy": vy,
+            }
+        return {"version": version, "full": full, "players": players, "removed": removed}
+
+    # ------------------------------------------------------------------
+    # Push-based stream
+    # ------------------------------------------------------------------
+    def _stream_loop(self, stop: threading.Event) -> None:
+        host = urlparse(self.base).hostname or "localhost"
+        while not stop.is_set():
+            if not self._registered():
+                stop.wait(RECONNECT_INTERVAL)
+                continue
+            try:
+                sock = socket.create_connection((host, GameSettings.ONLINE_STREAM_PORT), timeout=5)
+            except OSError as e:
+                # Older servers have no stream, keep playing by polling instead
+                Logger.warning(f"OnlineManager stream unavailable ({e}), polling instead")
+                self._loop(stop)
+                return
+
+            if stop.is_set():
+                # Stopped while connecting, a newer run may own the stream by now
+                sock.close()
+                return
+            sock.settimeout(None)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            # A new connection is a new subscriber, the next update() resends our state
+            self._reckoning.reset()
+            # The server starts every new connection with a full snapshot
+            self._version = -1
+            self._requested_interval = None
+            try:
+                self._send_line(sock, {"type": "hello", "id": self.player_id})
+                # Only now the sender may use it, updates before hello are ignored
+                self._sock = sock
+                self._wake.set()
+                for line in sock.makefile("rb"):
+                    msg = json.loads(line.decode("utf-8"))
+                    if msg.get("type") == "pong":
+                        self._rate.measured(time.monotonic() - float(msg["t"]), busy=bool(msg.get("busy")))
+                        continue
+                    if msg.get("type") == "error":
+                        if msg.get("error") == "player_not_found":
+                            # The hello of this connection named the old id, start over with a new one
+                            self._lost_id()
+                            break
+                        continue
+                    self._apply_delta(msg)
+                    self._request_interval(sock)
+            except (OSError, ValueError) as e:
+                if not stop.is_set():
+                    Logger.warning(f"OnlineManager stream error: {e}")
+            finally:
+                if self._sock is sock:
+                    self._close_stream()
+                sock.close()
+            stop.wait(RECONNECT_INTERVAL)
+
+    def _send_loop(self, stop: threading.Event) -> None:
+        pinged = 0.0
+        while not stop.is_set():
+            self._wake.wait(PING_INTERVAL)
+            if stop.is_set():
+                # Leave the wake-up to the sender of a newer run
+                break
+            self._wake.clear()
+            sock = self._sock
+            if sock is None:
+                # Not connected, the state stays pending for the poller or the next connection
+                continue
+            try:
+                if time.monotonic() - pinged >= PING_INTERVAL:
+                    pinged = time.monotonic()
+                    # Servers without pings ignore it, rtt then stays unknown
+                    self._send_line(sock, {"type": "ping", "t": pinged})
+                self._request_interval(sock)
+            except OSError:
+                # The stream loop sees the broken connection and reconnects
+                continue
+            state = self._take_pending()
+            if state is None:
+                continue
+            x, y, map_name, direction, moving, vx, vy = state
+            try:
+                self._send_line(sock, {
+                    "type": "update", "x": x, "y": y, "map": map_name,
+                    "direction": direction, "moving": moving, "vx": vx, "vy": vy,
+                })
+            except OSError as e:
+                self._requeue(state)
+                Logger.warning(f"Online update error: {e}")
+                continue
+
+    def _request_interval(self, sock: socket.socket) -> None:
+        """Ask the server to push less or more often when the poll interval changed"""
+        interval = self._next_interval()
+        if self._requested_interval is not None and abs(interval - self._requested_interval) < 1e-3:
+            return
+        self._requested_interval = interval
+        # Every tick when we would poll as fast as allowed
+        push = 0.0 if interval <= GameSettings.ONLINE_MIN_POLL_INTERVAL else interval
+        self._send_line(sock, {"type": "rate", "interval": push})
+
+    def _send_line(self, sock: socket.socket, msg: dict) -> None:
+        data = (json.dumps(msg) + "\n").encode("utf-8")
+        with self._send_lock:
+            sock.sendall(data)
+
+    def _close_stream(self) -> None:
+        sock, self._sock = self._sock, None
+        if sock is None:
+            return
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        sock.close()
+
+    # ------------------------------------------------------------------
+    # UDP channel
+    # ------------------------------------------------------------------
+    def _udp_loop(self, stop: threading.Event) -> None:
+        """
+        Send the current state every poll interval, standing still included,
+        and apply the deltas the server answers with. Nothing is resent, the
+        next datagram carries newer state anyway.
+        """
+        host = urlparse(self.base).hostname or "localhost"
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        state: PlayerState | None = None
+        seq = self._udp_seq
+        # Replies to datagrams sent before this seq are for another map, or already superseded
+        map_seq = applied_seq = seq
+        heard = time.monotonic()
+        try:
+            sock.connect((host, GameSettings.ONLINE_UDP_PORT))
+            while not stop.is_set():
+                state = self._take_pending() or state
+                if state is None:
+                    heard = time.monotonic()
+                    stop.wait(self._next_interval())
+                    continue
+                if not self._registered():
+                    heard = time.monotonic()
+                    stop.wait(self._next_interval())
+                    continue
+                x, y, map_name, direction, moving, vx, vy = state
+                seq = self._udp_seq = seq + 1
+                if map_name != self._table_map:
+                    self._version = -1
+                    self._table_map = map_name
+                    map_seq = seq
+                try:
+                    map_id = self._map_id(map_name)
+                    if map_id == binaryProtocol.NO_MAP:
+                        # Datagrams can only name maps in the table, a JSON update adds this one
+                        resp = self._session.post(f"{self.base}/players", json=self._json_update(state), timeout=5)
+                        if resp.status_code == 404 and resp.json().get("error") == "player_not_found":
+                            self._lost_id()
+                    else:
+                        record = (
+                            self.player_id, x, y, map_id,
+                            binaryProtocol.pack_flags(direction, moving), vx, vy,
+                        )
+                        sock.send(binaryProtocol.encode_udp_update(seq, self._version, record))
+                except (OSError, requests.RequestException) as e:
+                    Logger.warning(f"OnlineManager UDP send error: {e}")
+                sent = time.monotonic()
+
+                # Apply replies until it is time to send again
+                deadline = sent + self._next_interval()
+                while (left := deadline - time.monotonic()) > 0:
+                    sock.settimeout(left)
+                    try:
+                        data = sock.recv(65535)
+                    except TimeoutError:
+                        break
+                    except OSError:
+                        # ICMP port unreachable from an earlier datagram
+                        continue
+                    heard = time.monotonic()
+                    try:
+                        kind, reply_seq, payload = binaryProtocol.decode_datagram(data)
+                        if reply_seq == seq and sent:
+                            # Only the first reply to the newest datagram times a round trip
+                            self._rate.measured(heard - sent)
+                            sent = 0.0
+                        if kind == binaryProtocol.NOT_FOUND:
+                            # Replies to older datagrams may be about an id already replaced
+                            if reply_seq == seq and self.player_id != -1:
+                                self._lost_id()
+                            continue
+                        if reply_seq < map_seq or reply_seq <= applied_seq:
+                            continue
+                        if self._on_datagram(kind, payload, map_name):
+                            applied_seq = reply_seq
+                    except (ValueError, requests.RequestException) as e:
+                        Logger.warning(f"OnlineManager UDP reply error: {e}")
+
+                if time.monotonic() - heard > UDP_TIMEOUT:
+                    Logger.warning("OnlineManager got no UDP replies, polling instead")
+                    sock.close()
+                    self._loop(stop)
+                    return
+        except OSError as e:
+            Logger.warning(f"OnlineManager UDP unavailable ({e}), polling instead")
+            self._loop(stop)
+        finally:
+            sock.close()
+
+    def _on_datagram(self, kind: int, payload: bytes, map_name: str) -> bool:
+        """Apply one reply, True if it moved the local table forward"""
+        if kind == binaryProtocol.DELTA:
+            delta = self._decode_delta(payload)
+        elif kind == binaryProtocol.RESYNC:
+            # Too big for a datagram, the same delta comes reliably over HTTP instead
+            resp = self._session.get(
+                f"{self.base}/players", params={"since": self._version, "map": map_name},
+                headers={"Accept": binaryProtocol.CONTENT_TYPE}, timeout=5,
+            )
+            if resp.status_code != 200:
+                return False
+            delta = self._decode_delta(resp.content)
+        else:
+            return False
+        if delta["version"] <= self._version:
+            return False
+        self._apply_delta(delta)
+        return True
@@ -12,10 +12,12 @@ class Player(Entity):
     speed: float = 4.0 * GameSettings.TILE_SIZE
     game_manager: GameManager
     tp_cooldown: float
+    is_moving: bool
 
     def __init__(self, x: float, y: float, game_manager: GameManager) -> None:
         super().__init__(x, y, game_manager)
         self.tp_cooldown = 0.0
+        self.is_moving = False
 
     @override
     def update(self, dt: float) -> None:
@@ -62,6 +64,7 @@ class Player(Entity):
 
         dis.x *= self.speed * dt
         dis.y *= self.speed * dt
+        self.is_moving = dis.x != 0 or dis.y != 0
 
         if dis.x != 0 or dis.y != 0:
             if abs(dis.y) > abs(dis.x):
@@ -81,15 +84,17 @@ class Player(Entity):
 
         np_rectx = self.animation.rect.copy()
         np_rectx.x += int(dis.x)
+        np_recty = self.animation.rect.copy()
+        np_recty.y += int(dis.y)
+        # Both moves start from the same rect, so they are checked together
+        hit_x, hit_y = self.game_manager.check_collisions([np_rectx, np_recty])
 
-        if self.game_manager.check_collision(np_rectx):
+        if hit_x:
             self.position.x = self._snap_to_grid(self.position.x)
         else:
             self.position.x += dis.x
 
-        np_recty = self.animation.rect.copy()
-        np_recty.y += int(dis.y)
-        if self.game_manager.check_collision(np_recty):
+        if hit_y:
             self.position.y = self._snap_to_grid(self.position.y)
         else:
             self.position.y += dis.y
@@ -1 +1,3 @@
-from .map import Map
\ No newline at end of file
+from .map import Map
+from .collision import CollisionGrid
+from .triggers import TriggerIndex
@@ -0,0 +1,78 @@
+import pygame as pg
+from typing import Iterable
+
+
+class CollisionGrid:
+    """
+    Blocked tiles of a map, one byte per tile. A query only looks at the
+    tiles a rect overlaps, however big the map is. Outside the map nothing
+    is blocked, like with a list of one rect per blocked tile.
+    """
+    width: int
+    height: int
+    tile_size: int
+    # 1 for a blocked tile, row by row
+    cells: bytearray
+
+    def __init__(self, width: int, height: int, tile_size: int):
+        self.width = width
+        self.height = height
+        self.tile_size = tile_size
+        self.cells = bytearray(width * height)
+
+    def block(self, x: int, y: int) -> None:
+        self.cells[y * self.width + x] = 1
+
+    def is_blocked(self, x: int, y: int) -> bool:
+        return 0 <= x < self.width and 0 <= y < self.height and self.cells[y * self.width + x] == 1
+
+    def collides(self, rect: pg.Rect) -> bool:
+        """True if rect overlaps a blocked tile, same as colliderect against each of them"""
+        if rect.width <= 0 or rect.height <= 0:
+            return False
+        size = self.tile_size
+        # Tiles rect overlaps, its right and bottom edges are exclusive
+        x0, x1 = max(rect.left // size, 0), min((rect.right - 1) // size, self.width - 1)
+        y0, y1 = max(rect.top // size, 0), min((rect.bottom - 1) // size, self.height - 1)
+        if x0 > x1 or y0 > y1:
+            return False
+        cells, width = self.cells, self.width
+        for y in range(y0, y1 + 1):
+            row = y * width
+            if cells.find(1, row + x0, row + x1 + 1) != -1:
+                return True
+        return False
+
+    def collides_many(self, rects: Iterable[pg.Rect]) -> list[bool]:
+        """collides() for every rect, in order"""
+        collides = self.collides
+        return [collides(rect) for rect in rects]
+
+    def merged_rects(self) -> list[pg.Rect]:
+        """
+        The blocked tiles as few non-overlapping rects, in pixels. Greedy:
+        from the first tile not covered yet, in row order, a rect grows as far
+        right as the row is blocked, then down for as long as the rows below
+        are blocked over its whole width.
+        """
+        width, height, size = self.width, self.height, self.tile_size
+        left = bytearray(self.cells)
+        rects = []
+        for y in range(height):
+            row = y * width
+            x = left.find(1, row, row + width)
+            while x != -1:
+                start = x - row
+                end = left.find(0, x, row + width)
+                end = row + width if end == -1 else end
+                span = end - x
+                full = b"\x01" * span
+                bottom = y + 1
+                while bottom < height and left[bottom * width + start:bottom * width + start + span] == full:
+                    bottom += 1
+                for covered in range(y, bottom):
+                    offset = covered * width + start
+                    left[offset:offset + span] = bytes(span)
+                rects.append(pg.Rect(start * size, y * size, span * size, (bottom - y) * size))
+                x = left.find(1, end, row + width)
+        return rects
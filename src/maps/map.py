@@ -1,7 +1,93 @@
+import os
 import pygame as pg
 import pytmx
+from collections import OrderedDict
 
 from src.utils import load_tmx, Position, GameSettings, PositionCamera, Teleport, Warp
+from .collision import CollisionGrid
+from .triggers import TriggerIndex
+
+
+class ChunkCache:
+    """
+    Baked map chunks of every map, keyed by (map path, chunk x, chunk y).
+    Once they take more than budget bytes the least recently drawn ones are
+    dropped, and baked again if they come back into view.
+    """
+    budget: int
+    size: int
+    _chunks: OrderedDict[tuple[str, int, int], pg.Surface]
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.size = 0
+        self._chunks = OrderedDict()
+
+    def get(self, key: tuple[str, int, int]) -> pg.Surface | None:
+        surface = self._chunks.get(key)
+        if surface is not None:
+            self._chunks.move_to_end(key)
+        return surface
+
+    def put(self, key: tuple[str, int, int], surface: pg.Surface) -> None:
+        self._chunks[key] = surface
+        self.size += self._bytes(surface)
+        # The chunk just baked stays even over budget, it is about to be drawn
+        while self.size > self.budget and len(self._chunks) > 1:
+            _, old = self._chunks.popitem(last=False)
+            self.size -= self._bytes(old)
+
+    def __len__(self) -> int:
+        return len(self._chunks)
+
+    @staticmethod
+    def _bytes(surface: pg.Surface) -> int:
+        return surface.get_pitch() * surface.get_height()
+
+
+# Shared by all maps, so the budget holds however many maps are loaded
+CHUNK_CACHE = ChunkCache(GameSettings.MAP_CHUNK_BUDGET_MB << 20)
+
+
+class TileImageCache:
+    """
+    Tile images scaled to TILE_SIZE, in the display's format once there is
+    one, made once per tile of a tileset and shared by every layer of every
+    map using it. pytmx numbers tiles per map, so they are keyed by the
+    tileset image and the tile's index and flips in it rather than by gid.
+    """
+    # tileset image path -> (tile index, flips) -> image, None for tiles without one
+    _tilesets: dict[str, dict[tuple[int, tuple], pg.Surface | None]]
+
+    def __init__(self):
+        self._tilesets = {}
+
+    def get(self, tmxdata: pytmx.TiledMap, gid: int) -> pg.Surface | None:
+        tiled_gid = tmxdata.tiledgidmap[gid]
+        flags = next((tuple(f) for g, f in tmxdata.gidmap[tiled_gid] if g == gid), ())
+        tileset = tmxdata.get_tileset_from_gid(gid)
+        if tileset.source:
+            path = os.path.normpath(os.path.join(os.path.dirname(tmxdata.filename), tileset.source))
+        else:
+            # Not from one image, only shared within the map
+            path = f"{tmxdata.filename}#{tileset.name}"
+        tiles = self._tilesets.setdefault(path, {})
+        key = (tiled_gid - tileset.firstgid, flags)
+        if key not in tiles:
+            image = tmxdata.get_tile_image_by_gid(gid)
+            if image is not None:
+                image = pg.transform.scale(image, (GameSettings.TILE_SIZE, GameSettings.TILE_SIZE))
+                if pg.display.get_surface() is not None:
+                    # Opaque tiles stay opaque, they blit as a plain copy
+                    image = image.convert_alpha() if image.get_flags() & pg.SRCALPHA else image.convert()
+            tiles[key] = image
+        return tiles[key]
+
+    def __len__(self) -> int:
+        return sum(len(tiles) for tiles in self._tilesets.values())
+
+
+TILE_IMAGES = TileImageCache()
 
 
 class Map:
@@ -12,9 +98,19 @@ class Map:
     spawn: Position
     teleporters: list[Teleport]
     warps: list[Warp]
+    # The two above by the tiles they are on, built once with the map
+    _teleport_index: TriggerIndex[Teleport]
+    _warp_index: TriggerIndex[Warp]
     # Rendering Properties
-    _surface: pg.Surface
-    _collision_map: list[pg.Rect]
+    _chunk_tiles: int
+    # gid -> scaled image from TILE_IMAGES, looked up once per map
+    _tile_images: dict[int, pg.Surface | None]
+    # Map size in chunks
+    _chunks_w: int
+    _chunks_h: int
+    _collision_grid: CollisionGrid
+    # The blocked tiles merged into as few rects as possible, made on first use
+    _merged_collision: list[pg.Rect] | None
 
     def __init__(
         self,
@@ -28,111 +124,127 @@ class Map:
         self.spawn = spawn
         self.teleporters = tp
         self.warps = warps if warps is not None else []
+        self._teleport_index = TriggerIndex(GameSettings.TILE_SIZE)
+        for teleporter in self.teleporters:
+            self._teleport_index.add(self._trigger_rect(teleporter.pos), teleporter)
+        self._warp_index = TriggerIndex(GameSettings.TILE_SIZE)
+        for warp in self.warps:
+            self._warp_index.add(self._trigger_rect(warp.source), warp)
 
-        pixel_w = self.tmxdata.width * GameSettings.TILE_SIZE
-        pixel_h = self.tmxdata.height * GameSettings.TILE_SIZE
-
-        # Prebake the map
-        self._surface = pg.Surface((pixel_w, pixel_h), pg.SRCALPHA)
-        self._render_all_layers(self._surface)
-        # Prebake the collision map
-        self._collision_map = self._create_collision_map()
+        # The map is baked chunk by chunk when first drawn, see draw()
+        self._chunk_tiles = GameSettings.MAP_CHUNK_TILES
+        self._tile_images = {}
+        self._chunks_w = -(-self.tmxdata.width // self._chunk_tiles)
+        self._chunks_h = -(-self.tmxdata.height // self._chunk_tiles)
+        # Prebake the collision map, merged_collision_rects() is what DRAW_HITBOXES draws
+        self._collision_grid = self._create_collision_grid()
+        self._merged_collision = None
 
     def update(self, dt: float):
         return
 
     def draw(self, screen: pg.Surface, camera: PositionCamera):
-        screen.blit(self._surface, camera.transform_position(Position(0, 0)))
+        # Only the chunks the screen overlaps are baked and drawn
+        size = self._chunk_tiles * GameSettings.TILE_SIZE
+        cam_x, cam_y = int(camera.x), int(camera.y)
+        screen_w, screen_h = screen.get_size()
+        first_x, last_x = max(cam_x // size, 0), min((cam_x + screen_w - 1) // size, self._chunks_w - 1)
+        first_y, last_y = max(cam_y // size, 0), min((cam_y + screen_h - 1) // size, self._chunks_h - 1)
+        for cy in range(first_y, last_y + 1):
+            for cx in range(first_x, last_x + 1):
+                screen.blit(self._chunk(cx, cy), (cx * size - cam_x, cy * size - cam_y))
 
         # Draw the hitboxes collision map
         if GameSettings.DRAW_HITBOXES:
-            for rect in self._collision_map:
+            for rect in self.merged_collision_rects():
                 pg.draw.rect(screen, (255, 0, 0), camera.transform_rect(rect), 1)
 
     def check_collision(self, rect: pg.Rect) -> bool:
         """
-        [TODO HACKATHON 4]
-        Return True if collide if rect param collide with self._collision_map
-        Hint: use API colliderect and iterate each rectangle to check
+        Return True if rect overlaps a collision tile. Only the tiles under
+        rect are looked at, see CollisionGrid.collides
         """
-        for collision_rect in self._collision_map:
-            if rect.colliderect(collision_rect):
-                return True
-        return False
+        return self._collision_grid.collides(rect)
 
-    def check_teleport(self, rect: pg.Rect) -> Teleport | None:
-        for teleporter in self.teleporters:
-            tp_rect = pg.Rect(
-                teleporter.pos.x,
-                teleporter.pos.y,
-                GameSettings.TILE_SIZE,
-                GameSettings.TILE_SIZE,
-            )
+    def check_collisions(self, rects: list[pg.Rect]) -> list[bool]:
+        """check_collision() for every rect, in order"""
+        return self._collision_grid.collides_many(rects)
 
-            if rect.colliderect(tp_rect):
-                return teleporter
+    def merged_collision_rects(self) -> list[pg.Rect]:
+        """The collision tiles merged into non-overlapping rects covering exactly the same area"""
+        if self._merged_collision is None:
+            self._merged_collision = self._collision_grid.merged_rects()
+        return self._merged_collision
 
-        return None
+    def check_teleport(self, rect: pg.Rect) -> Teleport | None:
+        return self._teleport_index.find(rect)
 
     def check_warp(self, rect: pg.Rect) -> Warp | None:
-        for warp in self.warps:
-            warp_rect = pg.Rect(
-                warp.source.x,
-                warp.source.y,
-                GameSettings.TILE_SIZE,
-                GameSettings.TILE_SIZE,
-            )
+        return self._warp_index.find(rect)
 
-            if rect.colliderect(warp_rect):
-                return warp
+    @staticmethod
+    def _trigger_rect(pos: Position) -> pg.Rect:
+        return pg.Rect(pos.x, pos.y, GameSettings.TILE_SIZE, GameSettings.TILE_SIZE)
 
-        return None
+    def _chunk(self, cx: int, cy: int) -> pg.Surface:
+        key = (self.path_name, cx, cy)
+        surface = CHUNK_CACHE.get(key)
+        if surface is None:
+            surface = self._bake_chunk(cx, cy)
+            CHUNK_CACHE.put(key, surface)
+        return surface
+
+    def _bake_chunk(self, cx: int, cy: int) -> pg.Surface:
+        """The tiles of chunk (cx, cy), the last row and column of chunks may be smaller"""
+        tiles = pg.Rect(cx * self._chunk_tiles, cy * self._chunk_tiles, self._chunk_tiles, self._chunk_tiles)
+        tiles = tiles.clip(pg.Rect(0, 0, self.tmxdata.width, self.tmxdata.height))
+        surface = pg.Surface(
+            (tiles.width * GameSettings.TILE_SIZE, tiles.height * GameSettings.TILE_SIZE), pg.SRCALPHA
+        )
+        self._render_all_layers(surface, tiles)
+        return surface
 
-    def _render_all_layers(self, target: pg.Surface) -> None:
+    def _render_all_layers(self, target: pg.Surface, tiles: pg.Rect) -> None:
         for layer in self.tmxdata.visible_layers:
             if isinstance(layer, pytmx.TiledTileLayer):
-                self._render_tile_layer(target, layer)
+                self._render_tile_layer(target, layer, tiles)
             # elif isinstance(layer, pytmx.TiledImageLayer) and layer.image:
             #     target.blit(layer.image, (layer.x or 0, layer.y or 0))
 
     def _render_tile_layer(
-        self, target: pg.Surface, layer: pytmx.TiledTileLayer
+        self, target: pg.Surface, layer: pytmx.TiledTileLayer, tiles: pg.Rect
     ) -> None:
-        for x, y, gid in layer:
-            if gid == 0:
-                continue
-            image = self.tmxdata.get_tile_image_by_gid(gid)
-            if image is None:
-                continue
-
-            image = pg.transform.scale(
-                image, (GameSettings.TILE_SIZE, GameSettings.TILE_SIZE)
-            )
-            target.blit(image, (x * GameSettings.TILE_SIZE, y * GameSettings.TILE_SIZE))
-
-    def _create_collision_map(self) -> list[pg.Rect]:
-        rects = []
+        """Draw the tiles of layer inside tiles (in tile coordinates), target's origin at its top left"""
+        for y in range(tiles.top, tiles.bottom):
+            row = layer.data[y]
+            for x in range(tiles.left, tiles.right):
+                gid = row[x]
+                if gid == 0:
+                    continue
+                image = self._tile_image(gid)
+                if image is None:
+                    continue
+
+                target.blit(
+                    image,
+                    ((x - tiles.left) * GameSettings.TILE_SIZE, (y - tiles.top) * GameSettings.TILE_SIZE),
+                )
+
+    def _tile_image(self, gid: int) -> pg.Surface | None:
+        if gid not in self._tile_images:
+            self._tile_images[gid] = TILE_IMAGES.get(self.tmxdata, gid)
+        return self._tile_images[gid]
+
+    def _create_collision_grid(self) -> CollisionGrid:
+        grid = CollisionGrid(self.tmxdata.width, self.tmxdata.height, GameSettings.TILE_SIZE)
         for layer in self.tmxdata.visible_layers:
             if isinstance(layer, pytmx.TiledTileLayer) and (
                 "collision" in layer.name.lower() or "house" in layer.name.lower()
             ):
                 for x, y, gid in layer:
                     if gid != 0:
-                        """
-                        [TODO HACKATHON 4]
-                        rects.append(pg.Rect(...))
-                        Append the collision rectangle to the rects[] array
-                        Remember scale the rectangle with the TILE_SIZE from settings
-                        """
-                        rects.append(
-                            pg.Rect(
-                                x * GameSettings.TILE_SIZE,
-                                y * GameSettings.TILE_SIZE,
-                                GameSettings.TILE_SIZE,
-                                GameSettings.TILE_SIZE,
-                            )
-                        )
-        return rects
+                        grid.block(x, y)
+        return grid
 
     @classmethod
     def from_dict(cls, data: dict) -> "Map":
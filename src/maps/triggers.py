@@ -0,0 +1,47 @@
+import pygame as pg
+from typing import Generic, TypeVar
+
+T = TypeVar("T")
+
+
+class TriggerIndex(Generic[T]):
+    """
+    Things that fire when the player walks onto them (teleporters, warps,
+    encounter zones...) keyed by every tile their rect covers. A check
+    looks up the few tiles under the player instead of building and
+    testing a rect per trigger.
+    """
+    tile_size: int
+    # tile -> (order added, rect, trigger) of every trigger on it
+    _tiles: dict[tuple[int, int], list[tuple[int, pg.Rect, T]]]
+    _count: int
+
+    def __init__(self, tile_size: int):
+        self.tile_size = tile_size
+        self._tiles = {}
+        self._count = 0
+
+    def add(self, rect: pg.Rect, trigger: T) -> None:
+        entry = (self._count, pg.Rect(rect), trigger)
+        self._count += 1
+        size = self.tile_size
+        for y in range(rect.top // size, (rect.bottom - 1) // size + 1):
+            for x in range(rect.left // size, (rect.right - 1) // size + 1):
+                self._tiles.setdefault((x, y), []).append(entry)
+
+    def find(self, rect: pg.Rect) -> T | None:
+        """The first trigger added that rect overlaps, None if there is none"""
+        tiles = self._tiles
+        if not tiles or rect.width <= 0 or rect.height <= 0:
+            return None
+        size = self.tile_size
+        found = None
+        for y in range(rect.top // size, (rect.bottom - 1) // size + 1):
+            for x in range(rect.left // size, (rect.right - 1) // size + 1):
+                for entry in tiles.get((x, y), ()):
+                    if (found is None or entry[0] < found[0]) and rect.colliderect(entry[1]):
+                        found = entry
+        return found[2] if found is not None else None
+
+    def __len__(self) -> int:
+        return self._count
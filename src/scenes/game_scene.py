@@ -93,6 +93,9 @@ class GameScene(Scene):
         for overlay in self.overlays:
             if not overlay.is_open and all_off:
                 overlay.on_button.update(dt)
+        if self.online_manager is not None:
+            # Behind an overlay remote players can wait, poll them less often
+            self.online_manager.set_paused(not all_off)
 
         self.game_manager.try_switch_map()
 
@@ -108,6 +111,8 @@ class GameScene(Scene):
                 self.game_manager.player.position.x,
                 self.game_manager.player.position.y,
                 self.game_manager.current_map.path_name,
+                self.game_manager.player.direction.name.lower(),
+                self.game_manager.player.is_moving,
             )
 
     @override
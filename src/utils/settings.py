@@ -11,6 +11,8 @@ class Settings:
     DEBUG: bool = True  # Debug mode
     TILE_SIZE: int = 64  # Size of each tile in pixels
     DRAW_HITBOXES: bool = False  # Draw hitboxes for debugging
+    MAP_CHUNK_TILES: int = 16  # Maps are baked and drawn in square chunks of this many tiles
+    MAP_CHUNK_BUDGET_MB: int = 64  # Baked chunks kept in memory, least recently drawn go first
     # Audio
     MAX_CHANNELS: int = 16
     AUDIO_VOLUME: float = 0.5  # Volume of audio
@@ -18,6 +20,13 @@ class Settings:
     # Online
     IS_ONLINE: bool = False
     ONLINE_SERVER_URL: str = "http://localhost:8989"
+    ONLINE_USE_STREAM: bool = True  # Receive pushed snapshots instead of polling
+    ONLINE_STREAM_PORT: int = 8990
+    ONLINE_BINARY: bool = False  # Binary instead of JSON bodies when polling over HTTP
+    ONLINE_USE_UDP: bool = False  # Send updates and get deltas over UDP, takes precedence over the stream
+    ONLINE_UDP_PORT: int = 8991
+    ONLINE_MIN_POLL_INTERVAL: float = 0.05  # Fastest poll (seconds), when players nearby are moving
+    ONLINE_MAX_POLL_INTERVAL: float = 1.0  # Slowest poll, when paused, alone or the server is busy
 
 
 GameSettings = Settings()